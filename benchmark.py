@@ -0,0 +1,224 @@
+# -*- coding: UTF-8 -*-
+
+import io
+import json
+import argparse
+import platform
+import subprocess
+import tracemalloc
+
+from contextlib import redirect_stdout
+from datetime import datetime, timezone
+from os import path, makedirs
+from statistics import median
+from time import perf_counter
+
+import numpy as np
+import pandas as pd
+
+from src.synthetic import (
+    BENCHMARK_SCALES, generate_wallets, generate_snapshot_timestamps,
+    generate_pool_txns, generate_lp_history, generate_pool_snapshots,
+    generate_combined_snapshot, generate_kyc_export, generate_registrations,
+    generate_wallet_delegations
+)
+from src.calculate import (
+    filter_txns, process_txns, calculate, process_kyc_data,
+    process_registration_data, process_wallet_delegation_data, process_tiers
+)
+from src.utils import finalize, load_json
+
+
+POOL_CONTRACT = "0x00000000000000000000000000000000000000aa"
+POOL_OWNER = "0x00000000000000000000000000000000000000bb"
+TOKEN_NAME = "SFUND"
+
+
+def setup_filter_txns(data):
+    return lambda: filter_txns(data["txns"], data["exclude_list"])
+
+def setup_process_txns(data):
+    df_filtered, unique_wallets = filter_txns(data["txns"], data["exclude_list"])
+    return lambda: process_txns(df_filtered, unique_wallets, data["snapshot_timestamps"])
+
+def setup_calculate(data):
+    pool = ("SFUND_BNB_FARM", POOL_CONTRACT, 2, POOL_OWNER, POOL_CONTRACT, data["lp_history"])
+    return lambda: calculate(TOKEN_NAME, data["txns"], pool, data["snapshot_timestamps"], data["exclude_list"], True, df_lp_history=data["lp_history"].copy())
+
+def setup_finalize(data):
+    snapshot_list = generate_pool_snapshots(data["wallets"], TOKEN_NAME, seed=data["seed"])
+    return lambda: finalize("BNB", TOKEN_NAME, True, snapshot_list)
+
+def setup_process_tiers(data):
+    df_snapshot = generate_combined_snapshot(data["wallets"], TOKEN_NAME, seed=data["seed"])
+    return lambda: process_tiers(df_snapshot.copy(), TOKEN_NAME, data["tiers"], True)
+
+def setup_process_wallet_delegation_data(data):
+    df_kyc = generate_kyc_export(data["wallets"], seed=data["seed"])
+    df_registered = generate_registrations(data["wallets"], seed=data["seed"])
+    df_wallet_delegation = generate_wallet_delegations(data["wallets"], seed=data["seed"])
+
+    df_snapshot = generate_combined_snapshot(data["wallets"], TOKEN_NAME, seed=data["seed"])
+    df_snapshot = process_kyc_data(df_snapshot, df_kyc)
+    df_snapshot = process_registration_data(df_snapshot, df_registered)
+
+    return lambda: process_wallet_delegation_data(df_snapshot.copy(), df_wallet_delegation, df_registered, df_kyc)
+
+
+BENCHMARKS = {
+    "filter_txns": setup_filter_txns,
+    "process_txns": setup_process_txns,
+    "calculate": setup_calculate,
+    "finalize": setup_finalize,
+    "process_tiers": setup_process_tiers,
+    "process_wallet_delegation_data": setup_process_wallet_delegation_data,
+}
+
+
+def build_dataset(scale, seed, ssp_period):
+    transfer_count = BENCHMARK_SCALES[scale]["TRANSFERS"]
+    wallet_count = BENCHMARK_SCALES[scale]["WALLETS"]
+
+    wallets = generate_wallets(wallet_count, seed)
+    snapshot_timestamps = generate_snapshot_timestamps(ssp_period)
+
+    return {
+        "seed": seed,
+        "wallets": wallets,
+        "snapshot_timestamps": snapshot_timestamps,
+        "txns": generate_pool_txns(transfer_count, wallets, POOL_CONTRACT, snapshot_timestamps, seed),
+        "lp_history": generate_lp_history(snapshot_timestamps, seed),
+        "exclude_list": [POOL_CONTRACT, POOL_OWNER],
+        "tiers": load_json("tokens.json")[TOKEN_NAME]["TIERS"],
+    }
+
+
+def run_quietly(func):
+    with redirect_stdout(io.StringIO()):
+        return func()
+
+
+def measure(func, repeat):
+    timings = []
+
+    for _ in range(repeat):
+        start = perf_counter()
+        run_quietly(func)
+        timings.append(perf_counter() - start)
+
+    # separate pass, tracemalloc slows down allocation-heavy code
+    tracemalloc.start()
+    run_quietly(func)
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return timings, peak_memory
+
+
+def get_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL, text=True).strip()
+    except Exception:
+        return None
+
+
+def compare_results(results, baseline_filename):
+    baseline = load_json(baseline_filename)
+    baseline_results = {(r["function"], r["scale"]): r for r in baseline["results"]}
+
+    print()
+    print(f"* Comparing with {baseline_filename} (commit: {baseline['meta'].get('commit')})")
+    print()
+
+    for r in results:
+        old = baseline_results.get((r["function"], r["scale"]))
+        if old is None: continue
+
+        time_ratio = r["seconds_min"] / old["seconds_min"] if old["seconds_min"] else float("nan")
+        memory_ratio = r["peak_memory_mb"] / old["peak_memory_mb"] if old["peak_memory_mb"] else float("nan")
+
+        print(f"** {r['function']} [{r['scale']}]: time x{time_ratio:.2f}, peak memory x{memory_ratio:.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks the snapshot calculation hot paths on seeded synthetic data")
+
+    parser.add_argument("-s", "--scales", type=str, default="small,medium", help=f"Comma separated list of scales ({', '.join(BENCHMARK_SCALES)})")
+    parser.add_argument("-f", "--functions", type=str, default=",".join(BENCHMARKS), help="Comma separated list of functions to benchmark")
+    parser.add_argument("-r", "--repeat", type=int, default=3, help="Number of timed runs per function")
+    parser.add_argument("--seed", type=int, default=42, help="Seed of the synthetic data generator")
+    parser.add_argument("--ssp-period", type=int, default=90, help="Number of daily snapshot columns")
+    parser.add_argument("-o", "--output", type=str, default="Benchmarks", help="Directory for the JSON results")
+    parser.add_argument("-c", "--compare", type=str, help="Previous results file to compare against")
+
+    args = parser.parse_args()
+
+    scales = [s.strip() for s in args.scales.split(",") if s.strip()]
+    functions = [f.strip() for f in args.functions.split(",") if f.strip()]
+
+    for name in scales:
+        if name not in BENCHMARK_SCALES: parser.error(f"Unknown scale: {name}")
+
+    for name in functions:
+        if name not in BENCHMARKS: parser.error(f"Unknown function: {name}")
+
+    results = []
+
+    for scale in scales:
+        print()
+        print(f"* Generating {scale} dataset ({BENCHMARK_SCALES[scale]['TRANSFERS']} transfers, {BENCHMARK_SCALES[scale]['WALLETS']} wallets)")
+
+        data = build_dataset(scale, args.seed, args.ssp_period)
+
+        for function_name in functions:
+            func = run_quietly(lambda: BENCHMARKS[function_name](data))
+
+            timings, peak_memory = measure(func, args.repeat)
+
+            result = {
+                "function": function_name,
+                "scale": scale,
+                "transfers": BENCHMARK_SCALES[scale]["TRANSFERS"],
+                "wallets": BENCHMARK_SCALES[scale]["WALLETS"],
+                "repeat": args.repeat,
+                "seconds_min": round(min(timings), 4),
+                "seconds_median": round(median(timings), 4),
+                "peak_memory_mb": round(peak_memory / (1024 * 1024), 2),
+            }
+
+            results.append(result)
+
+            print(f"** {function_name}: {result['seconds_min']} s (median {result['seconds_median']} s), peak {result['peak_memory_mb']} MB")
+
+    commit = get_commit()
+    run_datetime = datetime.now(tz=timezone.utc)
+
+    output = {
+        "meta": {
+            "commit": commit,
+            "date": run_datetime.isoformat(),
+            "seed": args.seed,
+            "ssp_period": args.ssp_period,
+            "python": platform.python_version(),
+            "pandas": pd.__version__,
+            "numpy": np.__version__,
+            "machine": platform.machine(),
+        },
+        "results": results,
+    }
+
+    makedirs(args.output, exist_ok=True)
+    output_filename = path.join(args.output, f"benchmark_{commit or 'nocommit'}_{run_datetime.strftime('%Y%m%d%H%M%S')}.json")
+
+    with open(output_filename, "w") as json_file:
+        json.dump(output, json_file, indent=4)
+
+    print()
+    print("** Saved as:", output_filename)
+
+    if args.compare:
+        compare_results(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
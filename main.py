@@ -3,34 +3,25 @@
 
 # -*- coding: UTF-8 -*-
 
-from src.fetch import (
-    fetch_pool_txns, epochToBlockNumber, fetch_lp_history, query_pool, 
-    find_file, fetch_kyc_data, fetch_registration_data, 
-    fetch_wallet_delegation_data, notify_backend
-)
-
-from src.utils import (
-    clear, end_timer, initialize, initialize_token, finalize, 
-    parse_args, setCurrentDir, set_snapshot_timestamps, 
-    timestamp_to_date_str, date_to_str, df_to_csv, checkAddress, 
-    move_columns_to_head, createDir
-
-)
-from src.calculate import (
-    calculate, load_kyc_data, process_kyc_data, 
-    process_registration_data, process_wallet_delegation_data, 
-    process_tiers
-)
-
-from src.s3 import s3_download_all, s3_upload_specific_folders
-
-from os import chdir, getenv
+from src.metrics import start_run, stage, add_rows, write_report, measure_import
+
+# modules needed before the arguments are parsed, stage modules (pandas, requests, web3, boto3) are imported later
+with measure_import("startup"):
+    from src.utils import (
+        clear, end_timer, initialize, initialize_token, finalize, 
+        parse_args, setCurrentDir, set_snapshot_timestamps, 
+        timestamp_to_date_str, date_to_str, df_to_csv, checkAddress, 
+        move_columns_to_head, createDir, get_snapshot_filename,
+        get_required_s3_prefixes, create_network_settings, cache_lock
+
+    )
+    from src.pipeline import Pipeline, CPU_STAGE
+
+from os import getenv, path
 from time import time
 from sys import exit
 from decimal import Decimal
 
-import pandas as pd
-
 def main(tokens_filename, config_filename):
     startTime = time()
 
@@ -39,9 +30,16 @@ def main(tokens_filename, config_filename):
 
     print("* Importing config files")
 
-    project_id, all_tokens_dict, target_tokens_list, all_tokens_list, snapshot_datetime, target_pools  = parse_args(tokens_filename)
+    project_id, all_tokens_dict, target_tokens_list, all_tokens_list, snapshot_datetime, target_pools, run_options = parse_args(tokens_filename)
     settings, main_dir, output_dir, data_dir = initialize(config_filename)
 
+    start_run({
+        "tokens": target_tokens_list,
+        "snapshot_date": date_to_str(snapshot_datetime),
+        "pools": target_pools,
+        "project_id": project_id,
+    }, profile=run_options["PROFILE"])
+
     print()
     print("* Target token(s):", ", ".join(target_tokens_list))
     print()
@@ -112,11 +110,88 @@ def main(tokens_filename, config_filename):
                 if node_key is not None:
                     settings["NETWORK"][network]["RPC_NODES"][r_ind] += node_key
         
+        # explorer keys of networks with their own explorer (comma-separated for multiple keys)
+        network_api_key = getenv(f"{network}_API_KEY", None)
+
+        if network_api_key is not None:
+            settings["NETWORK"][network]["API_KEY"] = network_api_key
+
         mandatory_env_vars["MULTICHAIN_API_URL"] = settings["NETWORK"]["MULTICHAIN_API_URL"]
         mandatory_env_vars["MULTICHAIN_API_KEY"] = settings["NETWORK"]["MULTICHAIN_API_KEY"]
 
     # ------------------------------
 
+    kyc_export_filename = "KYC_EXPORT.csv"
+
+    # ------------------------------
+
+    # work list and time estimate from config and local caches, nothing is fetched
+    if run_options["PLAN"]:
+        from src.plan import create_plan, print_plan, write_plan
+
+        plan = create_plan(
+            settings, main_dir, data_dir, output_dir, project_id, all_tokens_dict, target_tokens_list, all_tokens_list,
+            unique_networks_list, target_pools, snapshot_timestamps, S3_BUCKET, BACKEND_API_URL, path.join(data_dir, kyc_export_filename)
+        )
+
+        print_plan(plan)
+        write_plan(plan, output_dir)
+
+        return
+
+    # balances of a wallet from the change points in the snapshot store, nothing is fetched or recalculated
+    if run_options["WALLET"] is not None:
+        from src.store import lookup_wallet
+
+        lookup_wallet(settings.get("STORE"), main_dir, all_tokens_dict, run_options["WALLET"], settings["SNAPSHOT_TIMESTAMP"])
+
+        return
+
+    # ------------------------------
+
+    with measure_import("stages"):
+        from src.fetch import (
+            fetch_pool_txns, get_snapshot_block_number, fetch_lp_history, query_pool, 
+            find_file, fetch_kyc_data, fetch_registration_data, 
+            fetch_wallet_delegation_data, notify_backend
+        )
+        from src.calculate import (
+            calculate, load_and_deduplicate_kyc_data, merge_kyc_data, 
+            process_registration_data, process_wallet_delegation_data, 
+            process_tiers
+        )
+        from src.s3 import (
+            s3_download_all, s3_download_selected, s3_upload_specific_folders,
+            s3_upload_files, enable_lazy_hydration
+        )
+        from src.results import (
+            RESULTS_DIR_NAME, get_pool_fingerprint, get_network_fingerprint,
+            load_result, save_result
+        )
+        from src.apikeys import load_key_usage, save_key_usage
+        from src.retry import configure_retries
+        from src.providers import configure_providers, close_providers
+        from src.blocks import load_block_cache
+        from src.store import open_store, close_store
+        from src.archive import DEFAULT_ARCHIVE_SETTINGS, get_archive_filename, is_archived
+
+        import pandas as pd
+
+    # retry policies and circuit breakers per host
+    configure_retries(settings.get("RETRY"))
+
+    # connection pool of the RPC providers shared by all nodes
+    configure_providers(settings["NETWORK"].get("RPC_POOL"))
+
+    # optional embedded database of transfers, LP history, snapshot blocks and balances (None when it isn't enabled)
+    store = open_store(settings.get("STORE"), main_dir)
+
+    # optional memory-mapped archive of the daily pool balances (None when it isn't enabled)
+    archive_settings = {**DEFAULT_ARCHIVE_SETTINGS, **settings.get("BALANCE_ARCHIVE", {})}
+    archive_dir = createDir(main_dir, archive_settings["DIR"]) if archive_settings["ENABLED"] else None
+
+    # ------------------------------
+
     print()
     print("* Checking required variables")
 
@@ -131,239 +206,319 @@ def main(tokens_filename, config_filename):
     
     # ------------------------------
 
-    kyc_export_filename = "KYC_EXPORT.csv"
+    # gaps of the txn caches are reported and filled, nothing else is fetched
+    if run_options["VERIFY_CACHE"]:
+        from src.follow import verify_caches
 
-    # ------------------------------
+        with cache_lock(data_dir):
+            verify_caches(
+                settings, main_dir, data_dir, output_dir, all_tokens_dict, target_tokens_list, all_tokens_list,
+                unique_networks_list, target_pools, settings["SNAPSHOT_TIMESTAMP"], S3_BUCKET
+            )
 
-    s3_download_all(S3_BUCKET, main_dir)
+        end_timer(startTime)
 
-    for token_name in target_tokens_list:
-        
-        # Seed Staking Points (SSP) calculations are only required for SFUND token
-        if token_name != "SFUND":
-            CALCULATE_SSP = False
+        return
 
-        if target_pools == "stake":
-            snapshot_filename = f"Raw_{token_name}_Stake_Snapshot.csv"
-        elif target_pools == "farm":
-            snapshot_filename = f"Raw_{token_name}_Farm_Snapshot.csv"
+    # caches are kept up to date until the process is stopped, the snapshot run uses them later
+    if run_options["FOLLOW"]:
+        from src.follow import follow
+
+        follow(
+            settings, main_dir, data_dir, output_dir, all_tokens_dict, target_tokens_list, all_tokens_list,
+            unique_networks_list, target_pools, run_options["SNAPSHOT_TIME"], S3_BUCKET, path.join(data_dir, kyc_export_filename)
+        )
+
+        return
+
+    # ------------------------------
+
+    # Independent stages (e.g. KYC sync and chain fetching, uploads of finished networks) run at the same time
+    pipeline = Pipeline(settings.get("PIPELINE"))
+
+    def download_from_s3():
+        if settings.get("S3_FULL_DOWNLOAD"):
+            s3_download_all(S3_BUCKET, main_dir)
         else:
-            snapshot_filename = f"Raw_{token_name}_Snapshot.csv"
-
-        temp_settings = {
-            "SNAPSHOT_TIMESTAMP": settings["SNAPSHOT_TIMESTAMP"],
-            "SNAPSHOT_BLOCK_NUMBER": None,
-            "SEED_STAKING_START_TIMESTAMP": None,
-            "API_URL": None,
-            "API_KEY": None,
-            "RPC_NODES": None,
-            "CUR_RPC_NODE_IDX": None,
-            "MAX_RPC_TRY": None,
-            "DAILY_EPOCH_DIFF": settings["DAILY_EPOCH_DIFF"],
-            "API_CALL_DELAY": settings["NETWORK"]["API_CALL_DELAY"],
-        }
+            # only the cache files of current token(s)/network(s), everything else is fetched on demand
+            s3_prefixes = get_required_s3_prefixes(main_dir, data_dir, output_dir, project_id, target_tokens_list, all_tokens_dict, unique_networks_list, target_pools)
+            s3_download_selected(S3_BUCKET, main_dir, s3_prefixes)
 
-        TIERS = None
+        enable_lazy_hydration(S3_BUCKET, main_dir)
 
-        if "TIERS" in all_tokens_dict[token_name].keys():
-            TIERS = all_tokens_dict[token_name]["TIERS"]
-        
-        if project_id is None:
+        # daily call counts of the explorer keys are kept across runs
+        load_key_usage(data_dir)
 
-            # ------------------------------
+        # snapshot blocks resolved by earlier runs or the follow mode
+        load_block_cache(data_dir)
 
-            df_snapshot = pd.DataFrame()
+    pipeline.add("s3_download", download_from_s3)
 
-            # ------------------------------
+    # ------------------------------
 
-            for network in unique_networks_list:
-                chdir(data_dir)
+    def add_network_stages(token_name, network, CALCULATE_SSP):
+        stage_prefix = f"{token_name}:{network}"
+        labels = {"token": token_name, "network": network}
 
-                # if network not in all_tokens_dict[token_name].keys(): continue
+        temp_settings = create_network_settings(settings, network)
 
-                temp_settings["SNAPSHOT_TIMESTAMP"] = settings["SNAPSHOT_TIMESTAMP"]
-                temp_settings["CHAIN_ID"] = settings["NETWORK"][network]["CHAIN_ID"]
+        token_dir, token_contract, lp_contract, stakes, farms = initialize_token(data_dir, all_tokens_dict, token_name, network)
 
-                if settings["NETWORK"][network]["CHAIN_ID"] == "":
-                    temp_settings["API_URL"] = settings["NETWORK"][network]["API_URL"]
-                    temp_settings["API_KEY"] = settings["NETWORK"][network]["API_KEY"]
-                else:
-                    temp_settings["API_URL"] = settings["NETWORK"]["MULTICHAIN_API_URL"]
-                    temp_settings["API_KEY"] = settings["NETWORK"]["MULTICHAIN_API_KEY"]
+        # stages of different networks run at the same time, cache files are read and written with absolute paths
+        temp_settings["TOKEN_DIR"] = token_dir
 
-                temp_settings["RPC_NODES"] = settings["NETWORK"][network]["RPC_NODES"]
-                temp_settings["CUR_RPC_NODE_IDX"] = 0
-                temp_settings["MAX_RPC_TRY"] = 3
+        # I/O stages of the network run at the same time, each one gets its own copy of the settings (RPC node index, retries)
 
-                temp_settings["SNAPSHOT_BLOCK_NUMBER"] = epochToBlockNumber(temp_settings["SNAPSHOT_TIMESTAMP"], temp_settings)
+        token_contract = checkAddress(token_contract)
+        lp_contract = checkAddress(lp_contract)
 
+        # pool and network results are stored under a fingerprint of their inputs, they aren't uploaded to S3
+        results_dir = path.join(main_dir, RESULTS_DIR_NAME, f"{token_name}_{network}") if settings.get("RESULT_CACHE", True) else None
+
+        # ------------------------------
+
+        def get_snapshot_block(_):
+            temp_settings["SNAPSHOT_BLOCK_NUMBER"] = get_snapshot_block_number(temp_settings["SNAPSHOT_TIMESTAMP"], dict(temp_settings))
+
+            if store is not None:
+                store.save_snapshot_block(network, temp_settings["SNAPSHOT_TIMESTAMP"], temp_settings["SNAPSHOT_BLOCK_NUMBER"])
+
+            print()
+            print("#"*20)
+            print()
+            print("* Snapshot Details *")
+            print()
+            print(f"Token: {token_name} (on {network} chain)")
+            print("Date:", snapshot_date_str)
+            print("Timestamp:", temp_settings["SNAPSHOT_TIMESTAMP"])
+            print("Block:", temp_settings["SNAPSHOT_BLOCK_NUMBER"])
+
+            if CALCULATE_SSP:
                 print()
-                print("#"*20)
-                print()
-                print("* Snapshot Details *")
+                print("* SSP Details *")
                 print()
-                print(f"Token: {token_name} (on {network} chain)")
-                print("Date:", snapshot_date_str)
-                print("Timestamp:", temp_settings["SNAPSHOT_TIMESTAMP"])
-                print("Block:", temp_settings["SNAPSHOT_BLOCK_NUMBER"])
+                print("Period:", SSP_PERIOD, "days")
+                print("Start Date:", timestamp_to_date_str(snapshot_timestamps[0]))
+                print("End Date:", timestamp_to_date_str(snapshot_timestamps[-1]))
 
-                if CALCULATE_SSP:
-                    print()
-                    print("* SSP Details *")
-                    print()
-                    print("Period:", SSP_PERIOD, "days")
-                    print("Start Date:", timestamp_to_date_str(snapshot_timestamps[0]))
-                    print("End Date:", timestamp_to_date_str(snapshot_timestamps[-1]))
+            return temp_settings["SNAPSHOT_BLOCK_NUMBER"]
+
+        block_stage = pipeline.add(f"snapshot_block:{stage_prefix}", get_snapshot_block, deps=["s3_download"], **labels)
+
+        def add_lp_history_stage(target_lp_contract):
+            def get_lp_history(_):
+                lp_history = fetch_lp_history( target_lp_contract, token_contract, snapshot_timestamps, dict(temp_settings) )
+
+                if store is not None:
+                    store.save_lp_history(network, target_lp_contract, token_contract, lp_history)
+
+                return lp_history
+
+            return pipeline.add(f"lp_history:{stage_prefix}:{target_lp_contract}", get_lp_history, deps=["s3_download"], **labels, lp=target_lp_contract)
+
+        # (pool, target token, LP history stage, pool is skipped without LP history), in the order of the network snapshot columns
+        pool_entries = []
+
+        if target_pools == "farm" or target_pools == "all":
+            lp_stage = add_lp_history_stage(lp_contract)
+
+            for pool in farms:
+                pool_entries.append((pool, lp_contract, lp_stage, False))
+
+        if target_pools == "stake" or target_pools == "all":
+            for pool in stakes:
+                pool_entries.append((pool, token_contract, None, False))
+
+        if target_pools == "farm" or target_pools == "all":
+            other_tokens = all_tokens_list.copy()
+            other_tokens.remove(token_name)
+
+            for other_token_name in other_tokens:
+                if not network in all_tokens_dict[other_token_name].keys(): continue
+
+                other_token_details = all_tokens_dict[other_token_name][network]
+                other_lp_contract = other_token_details["lp_contract"]
+
+                if other_lp_contract is None or other_lp_contract == '': continue
+
+                other_lp_contract = checkAddress(other_lp_contract)
+                other_lp_stage = add_lp_history_stage(other_lp_contract)
+
+                for pool in other_token_details["farm"]:
+                    pool_entries.append((pool, other_lp_contract, other_lp_stage, True))
+
+        # ------------------------------
+
+        def add_pool_metadata_stage(pool, target_token, lp_stage, requires_lp_history):
+            def get_pool_metadata(*lp_result):
+                lp_history = lp_result[0] if lp_result else None
+
+                # farms of other tokens are only included when the LP history of their pair is available
+                if requires_lp_history and lp_history is None: return None
+
+                return query_pool(pool, dict(temp_settings)) + (target_token, lp_history)
+
+            deps = [lp_stage] if lp_stage else []
+
+            return pipeline.add(f"pool_metadata:{stage_prefix}:{pool[0]}", get_pool_metadata, deps=deps, **labels, pool=pool[0])
+
+        metadata_stages = [add_pool_metadata_stage(*entry) for entry in pool_entries]
+
+        def get_exclude_list(*pool_list):
+            exclude_list = settings["EXCLUDE"].copy()
+
+            for pool in pool_list:
+                if pool is None: continue
+
+                pool_name, pool_contract, pool_multiplier, pool_contract_owner, target_token, lp_history = pool
+
+                if not pool_contract in exclude_list: exclude_list.append(pool_contract)
+                if not pool_contract_owner in exclude_list: exclude_list.append(pool_contract_owner)
+
+            return exclude_list
+
+        exclude_stage = pipeline.add(f"exclude_list:{stage_prefix}", get_exclude_list, deps=metadata_stages, kind=CPU_STAGE, **labels)
+
+        # ------------------------------
+
+        def add_pool_stages(metadata_stage, pool_name):
+            def get_pool_txns(pool, _):
+                if pool is None: return None
+
+                pool_name, pool_contract, pool_multiplier, pool_contract_owner, target_token, lp_history = pool
 
                 print()
                 print("-"*10)
                 print()
+                print("Pool:", pool_name)
+                print("Contract:", pool_contract)
+                print("Contract Owner:", pool_contract_owner)
+                print("Target Token:", target_token)
 
-                token_dir, token_contract, lp_contract, stakes, farms = initialize_token(data_dir, all_tokens_dict, token_name, network)
-                chdir(token_dir)
+                if CALCULATE_SSP:
+                    print("SSP Multiplier:", pool_multiplier)
 
-                token_contract = checkAddress(token_contract)
-                lp_contract = checkAddress(lp_contract)
+                print()
 
-                snapshot_list = []
-                df_network_snapshot = None
+                df_pool_txns = fetch_pool_txns( pool, dict(temp_settings) )
+                add_rows(0 if df_pool_txns is None else len(df_pool_txns))
 
-                print()
-                print("* Gathering data")
+                if store is not None:
+                    store.sync_transfers(network, pool_contract, df_pool_txns, temp_settings["SNAPSHOT_TIMESTAMP"])
 
-                DF_LP_HISTORY = None
+                return df_pool_txns
 
-                exclude_list = settings["EXCLUDE"].copy()
-                pool_list = []
+            txns_stage = pipeline.add(f"pool_txns:{stage_prefix}:{pool_name}", get_pool_txns, deps=[metadata_stage, block_stage], **labels, pool=pool_name)
 
-                if target_pools == "farm" or target_pools == "all":
-                    DF_LP_HISTORY = fetch_lp_history( lp_contract, token_contract, snapshot_timestamps, temp_settings )
+            def get_pool_snapshot(pool, df_pool_txns, exclude_list):
+                if pool is None: return None
 
-                    print("** Collecting info on farm contracts")
+                pool_name, pool_contract, pool_multiplier, pool_contract_owner, target_token, lp_history = pool
 
-                    for pool in farms:
-                        pool = query_pool(pool, temp_settings)
+                pool_fingerprint = get_pool_fingerprint( token_name, pool, df_pool_txns, snapshot_timestamps, exclude_list, CALCULATE_SSP, lp_history )
 
-                        target_token = lp_contract
-                        lp_history = DF_LP_HISTORY
+                # the dense daily balances are only created while calculating
+                daily_balances_filename = None
 
-                        pool+= (target_token,)
-                        pool+= (lp_history,)
-                        
-                        pool_list.append(pool)
+                if settings.get("DAILY_BALANCES_EXPORT"):
+                    daily_balances_filename = path.join(createDir(output_dir, "Daily_Balances"), f"{token_name}_{network}_{pool_name}.csv")
 
-                        pool_name, pool_contract, pool_multiplier, pool_contract_owner, target_token, lp_history = pool
+                balance_archive_filename = get_archive_filename(archive_dir, network, pool_contract) if archive_dir is not None else None
 
-                        if not pool_contract in exclude_list: exclude_list.append(pool_contract)
-                        if not pool_contract_owner in exclude_list: exclude_list.append(pool_contract_owner)
-                
-                if target_pools == "stake" or target_pools == "all":
-                    print("** Collecting info on stake contracts")
-                    
-                    for pool in stakes:
-                        pool = query_pool(pool, temp_settings)
-
-                        target_token = token_contract
-                        lp_history = None
-
-                        pool+= (target_token,)
-                        pool+= (lp_history,)
-                        
-                        pool_list.append(pool)
-
-                        pool_name, pool_contract, pool_multiplier, pool_contract_owner, target_token, lp_history = pool
-                        
-                        if not pool_contract in exclude_list: exclude_list.append(pool_contract)
-                        if not pool_contract_owner in exclude_list: exclude_list.append(pool_contract_owner)
-                
-                if target_pools == "farm" or target_pools == "all":
-                    print(f"** Collecting info on possible farm contracts with {token_name} in them")
+                # stored results are only used when there is nothing to export or archive
+                use_stored_result = daily_balances_filename is None and (balance_archive_filename is None or is_archived(balance_archive_filename, snapshot_timestamps[-1]))
 
-                    other_tokens = all_tokens_list.copy()
-                    other_tokens.remove(token_name)
+                df_pool_snapshot = load_result(results_dir, pool_name, pool_fingerprint) if use_stored_result else None
 
-                    for other_token_name in other_tokens:
-                        if not network in all_tokens_dict[other_token_name].keys(): continue
+                if df_pool_snapshot is not None:
+                    print(f"** {pool_name}: inputs didn't change, using the stored result")
+                else:
+                    # LP history is shared by the farms of the pair, calculate() adds columns to it
+                    if lp_history is not None:
+                        lp_history = lp_history.copy()
 
-                        other_token_details = all_tokens_dict[other_token_name][network]
-                        other_lp_contract = other_token_details["lp_contract"]
+                    df_pool_snapshot = calculate( token_name, df_pool_txns, pool, snapshot_timestamps, exclude_list, CALCULATE_SSP, df_lp_history = lp_history, store = store, network = network, daily_balances_filename = daily_balances_filename, balance_archive_filename = balance_archive_filename )
 
-                        if other_lp_contract is None or other_lp_contract == '': continue
+                    save_result(results_dir, pool_name, pool_fingerprint, df_pool_snapshot)
 
-                        other_token_farms = other_token_details["farm"]
+                return df_pool_snapshot, pool_fingerprint
 
-                        target_token = checkAddress(token_contract)
-                        other_lp_contract = checkAddress(other_lp_contract)
+            return pipeline.add(f"calculate:{stage_prefix}:{pool_name}", get_pool_snapshot, deps=[metadata_stage, txns_stage, exclude_stage], kind=CPU_STAGE, **labels, pool=pool_name)
 
-                        DF_LP_HISTORY_OTHER = None
-                        DF_LP_HISTORY_OTHER = fetch_lp_history( other_lp_contract, token_contract, snapshot_timestamps, temp_settings )
+        pool_stages = [add_pool_stages(metadata_stage, entry[0][0]) for metadata_stage, entry in zip(metadata_stages, pool_entries)]
 
-                        if DF_LP_HISTORY_OTHER is None: continue
+        # ------------------------------
 
-                        for pool in other_token_farms:
-                            pool = query_pool(pool, temp_settings)
+        def get_network_snapshot(*pool_results):
+            pool_results = [result for result in pool_results if result is not None]
 
-                            target_token = other_lp_contract
-                            lp_history = DF_LP_HISTORY_OTHER
+            snapshot_list = [df_pool_snapshot for df_pool_snapshot, pool_fingerprint in pool_results]
+            pool_fingerprints = [pool_fingerprint for df_pool_snapshot, pool_fingerprint in pool_results]
 
-                            pool+= (target_token,)
-                            pool+= (lp_history,)
+            network_result_name = f"{token_name}_{network}_{target_pools}"
+            network_fingerprint = get_network_fingerprint( network, token_name, CALCULATE_SSP, pool_fingerprints )
 
-                            pool_list.append(pool)
+            network_result = load_result(results_dir, network_result_name, network_fingerprint)
 
-                            pool_name, pool_contract, pool_multiplier, pool_contract_owner, target_token, lp_history = pool
-                                                
-                            if not pool_contract in exclude_list: exclude_list.append(pool_contract)
-                            if not pool_contract_owner in exclude_list: exclude_list.append(pool_contract_owner)
-                
+            if network_result is not None:
                 print()
-                print(f"* Processing all pools/contracts")
+                print(f"* {network} pools didn't change, using the stored {network} snapshot")
 
-                for pool in pool_list:
-                    pool_name, pool_contract, pool_multiplier, pool_contract_owner, target_token, lp_history = pool
+                return network_result
 
-                    print()
-                    print("-"*10)
-                    print()
-                    print("Pool:", pool_name)
-                    print("Contract:", pool_contract)
-                    print("Contract Owner:", pool_contract_owner)
-                    print("Target Token:", target_token)
+            network_result = finalize( network, token_name, CALCULATE_SSP, snapshot_list )
 
-                    if CALCULATE_SSP:
-                        print("SSP Multiplier:", pool_multiplier)
+            save_result(results_dir, network_result_name, network_fingerprint, network_result)
 
-                    print()
+            return network_result
 
-                    df_pool_txns = fetch_pool_txns( pool, temp_settings )
-                    df_pool_snapshot = calculate( token_name, df_pool_txns, pool, snapshot_timestamps, exclude_list, CALCULATE_SSP, df_lp_history = lp_history )
+        finalize_stage = pipeline.add(f"finalize:{stage_prefix}", get_network_snapshot, deps=pool_stages, kind=CPU_STAGE, **labels)
 
-                    snapshot_list.append(df_pool_snapshot)
-                
-                df_network_snapshot, columns_to_copy, new_column_names = finalize( network, token_name, CALCULATE_SSP, snapshot_list )
-                
-                chdir(output_dir)
+        if target_pools == "stake":
+            network_snapshot_filename = f"{token_name}_{network}_Stake_Snapshot.csv"
+        elif target_pools == "farm":
+            network_snapshot_filename = f"{token_name}_{network}_Farm_Snapshot.csv"
+        else:
+            network_snapshot_filename = f"{token_name}_{network}_Snapshot.csv"
 
-                if (df_network_snapshot is not None) and (not df_network_snapshot.empty):
-                    print()
-                    print(f"* Saving {network} snapshot")
+        def write_network_snapshot(network_result):
+            df_network_snapshot, columns_to_copy, new_column_names = network_result
+
+            if (df_network_snapshot is not None) and (not df_network_snapshot.empty):
+                print()
+                print(f"* Saving {network} snapshot")
 
-                    df_snapshot = df_snapshot.sort_index()
+                df_to_csv(df_network_snapshot, path.join(output_dir, network_snapshot_filename), 'Wallet', ',')
+                add_rows(len(df_network_snapshot))
 
-                    if target_pools == "stake":
-                        network_snapshot_filename = f"{token_name}_{network}_Stake_Snapshot.csv"
-                    elif target_pools == "farm":
-                        network_snapshot_filename = f"{token_name}_{network}_Farm_Snapshot.csv"
-                    else:
-                        network_snapshot_filename = f"{token_name}_{network}_Snapshot.csv"
+                print("** Saved as:", network_snapshot_filename)
 
-                    df_to_csv(df_network_snapshot, network_snapshot_filename, 'Wallet', ',')
+            return network_result
 
-                    print("** Saved as:", network_snapshot_filename)
+        write_stage = pipeline.add(f"write_csv:{stage_prefix}", write_network_snapshot, deps=[finalize_stage], **labels)
+
+        # caches and the snapshot of a finished network are uploaded while the other networks are processed
+        def upload_network_files(_):
+            s3_upload_files(S3_BUCKET, main_dir, [token_dir, path.join(output_dir, network_snapshot_filename)])
+
+        upload_stage = pipeline.add(f"s3_upload:{stage_prefix}", upload_network_files, deps=[write_stage], **labels)
+
+        return write_stage, upload_stage
+
+    # ------------------------------
+
+    def add_token_snapshot_stage(token_name, network_stages, TIERS, CALCULATE_SSP, snapshot_filename):
+        def create_token_snapshot(*network_results):
+            df_snapshot = pd.DataFrame()
+
+            for df_network_snapshot, columns_to_copy, new_column_names in network_results:
+                if (df_network_snapshot is None) or df_network_snapshot.empty: continue
+
+                df_snapshot = df_snapshot.sort_index()
+
+                df_snapshot = pd.concat([ df_snapshot, df_network_snapshot[columns_to_copy] ], axis=1)
+                df_snapshot = df_snapshot.rename(columns=new_column_names)
 
-                    df_snapshot = pd.concat([ df_snapshot, df_network_snapshot[columns_to_copy] ], axis=1)
-                    df_snapshot = df_snapshot.rename(columns=new_column_names)
-                    
             # ------------------------------
 
             df_snapshot = df_snapshot.fillna(Decimal("0"))
@@ -377,7 +532,9 @@ def main(tokens_filename, config_filename):
                     print()
                     print("* Calculating tiers and seed staking points")
 
-                    df_snapshot = process_tiers(df_snapshot, token_name, TIERS, CALCULATE_SSP)
+                    with stage("process_tiers", token=token_name):
+                        df_snapshot = process_tiers(df_snapshot, token_name, TIERS, CALCULATE_SSP)
+                        add_rows(len(df_snapshot))
                 else:
                     total_tokens_column_name = f"Total {token_name}"
                     df_snapshot[total_tokens_column_name] = df_snapshot[df_snapshot.columns].sum(axis=1).apply(Decimal)
@@ -389,24 +546,22 @@ def main(tokens_filename, config_filename):
                 print()
                 print("* Saving snapshot")
 
-                chdir(output_dir)
-
-                df_to_csv(df_snapshot, snapshot_filename, 'Wallet', ',')
+                with stage("write_csv", token=token_name):
+                    df_to_csv(df_snapshot, path.join(output_dir, snapshot_filename), 'Wallet', ',')
+                    add_rows(len(df_snapshot))
 
                 print("** Saved as:", snapshot_filename)
 
-            # ------------------------------
-
-            chdir(data_dir)
+        return pipeline.add(f"token_snapshot:{token_name}", create_token_snapshot, deps=network_stages, kind=CPU_STAGE, token=token_name)
 
-            if token_name == "SFUND":
-                fetch_kyc_data(settings["KYC"], kyc_export_filename)
+    # ------------------------------
 
-        elif project_id is not None and token_name == "SFUND":
+    def add_whitelist_stages(token_name, TIERS, CALCULATE_SSP, snapshot_filename):
 
-            chdir(output_dir)
+        def load_raw_snapshot(_):
+            raw_snapshot_file = find_file(path.join(output_dir, snapshot_filename))
 
-            if find_file(snapshot_filename) is None:
+            if raw_snapshot_file is None:
                 print()
                 print(f"! Error: Couldn't locate previously created raw snapshot file -> {snapshot_filename}")
                 print()
@@ -415,148 +570,222 @@ def main(tokens_filename, config_filename):
 
                 exit()
 
-            df_snapshot = pd.read_csv(snapshot_filename)
+            df_snapshot = pd.read_csv(raw_snapshot_file)
             df_snapshot.set_index('Wallet', inplace=True)
 
-            if (df_snapshot is not None) and (not df_snapshot.empty):
+            if (df_snapshot is None) or df_snapshot.empty: return None
 
-                print()
-                print("#"*20)
-                print()
-                print("Project ID:", project_id)
+            print()
+            print("#"*20)
+            print()
+            print("Project ID:", project_id)
 
-                # ------------------------------
+            print()
+            print("* Loading KYC data, fetching IDO registration and wallet delegation data")
 
-                print()
-                print("* Loading KYC data")
+            return df_snapshot
 
-                chdir(data_dir)
+        snapshot_stage = pipeline.add("raw_snapshot", load_raw_snapshot, deps=["s3_download"], token=token_name)
 
-                df_kyc = load_kyc_data(kyc_export_filename)
+        # KYC load/de-duplication (disk) runs while registration and wallet delegation data (network) are being fetched
+        def load_kyc(df_snapshot):
+            if df_snapshot is None: return None
 
-                if not df_kyc.index.empty:
-                    df_snapshot = process_kyc_data(df_snapshot, df_kyc)
-                
-                # ------------------------------
+            return load_and_deduplicate_kyc_data(path.join(data_dir, kyc_export_filename))
 
-                print()
-                print("* Fetching IDO registration data")
+        def get_registration_data(df_snapshot):
+            if df_snapshot is None: return None
 
-                df_registered, project_name = fetch_registration_data(project_id, BACKEND_API_URL, BACKEND_GET_API_KEY)
+            return fetch_registration_data(project_id, BACKEND_API_URL, BACKEND_GET_API_KEY, data_dir)
 
-                if project_name is not None:
-                    filename_suffix = project_name
-                else:
-                    filename_suffix = project_id
+        def get_wallet_delegation_data(df_snapshot):
+            if df_snapshot is None: return None
+
+            return fetch_wallet_delegation_data(BACKEND_API_URL, BACKEND_GET_API_KEY, data_dir)
+
+        kyc_stage = pipeline.add("kyc_load", load_kyc, deps=[snapshot_stage], kind=CPU_STAGE)
+        registration_stage = pipeline.add("registration", get_registration_data, deps=[snapshot_stage])
+        wallet_delegation_stage = pipeline.add("wallet_delegation", get_wallet_delegation_data, deps=[snapshot_stage])
+
+        def create_whitelist(df_snapshot, kyc_result, registration_result, df_wallet_delegation):
+            if df_snapshot is None: return
+
+            df_kyc, df_kyc_unique = kyc_result
+
+            if not df_kyc.index.empty:
+                with stage("merge_kyc"):
+                    df_snapshot = merge_kyc_data(df_snapshot, df_kyc_unique)
+                    add_rows(len(df_snapshot))
+
+            # ------------------------------
+
+            df_registered, project_name = registration_result
+
+            if project_name is not None:
+                filename_suffix = project_name
+            else:
+                filename_suffix = project_id
+            
+            project_dir = createDir(output_dir, f"{project_name}_{project_id}")
+            
+            if not df_registered.index.empty:
+                print(f"* Saving IDO registration data ({df_registered.shape[0]} wallets)")
+
+                reg_filename = f"{filename_suffix}_IDO_Registration_Export.csv"
+                df_to_csv(df_registered, path.join(project_dir, reg_filename), 'Wallet', ',')
                 
-                project_dir = createDir(output_dir, f"{project_name}_{project_id}")
-                chdir(project_dir)
+                print(f"** Saved as {reg_filename}")
                 
-                if not df_registered.index.empty:
-                    print(f"* Saving IDO registration data ({df_registered.shape[0]} wallets)")
-
-                    reg_filename = f"{filename_suffix}_IDO_Registration_Export.csv"
-                    df_to_csv(df_registered, reg_filename, 'Wallet', ',')
-                    
-                    print(f"** Saved as {reg_filename}")
-                    
+                with stage("process_registration"):
                     df_snapshot = process_registration_data(df_snapshot, df_registered)
+                    add_rows(len(df_snapshot))
+
+            # ------------------------------
+
+            if not df_wallet_delegation.index.empty:
+                print(f"* Saving wallet delegation data ({df_wallet_delegation.shape[0]} wallets)")
+
+                wallet_delegation_filename = f"{filename_suffix}_Wallet_Delegation_Export.csv"
+                df_to_csv(df_wallet_delegation, path.join(project_dir, wallet_delegation_filename), 'Wallet', ',')
+                
+                print(f"** Saved as {wallet_delegation_filename}")
 
-                # ------------------------------
+                with stage("process_wallet_delegation"):
+                    df_snapshot = process_wallet_delegation_data(df_snapshot, df_wallet_delegation, df_registered, df_kyc)
+                    add_rows(len(df_snapshot))
 
+            # ------------------------------
+            if TIERS is not None:
                 print()
-                print("* Fetching wallet delegation data")
+                print("* Calculating tiers and seed staking points")
 
-                df_wallet_delegation = fetch_wallet_delegation_data(BACKEND_API_URL, BACKEND_GET_API_KEY)
+                with stage("process_tiers", token=token_name):
+                    df_snapshot = process_tiers(df_snapshot, token_name, TIERS, CALCULATE_SSP)
+                    add_rows(len(df_snapshot))
 
-                if not df_wallet_delegation.index.empty:
-                    print(f"* Saving wallet delegation data ({df_wallet_delegation.shape[0]} wallets)")
+            # ------------------------------
 
-                    wallet_delegation_filename = f"{filename_suffix}_Wallet_Delegation_Export.csv"
-                    df_to_csv(df_wallet_delegation, wallet_delegation_filename, 'Wallet', ',')
-                    
-                    print(f"** Saved as {wallet_delegation_filename}")
+            columns_to_move = []
+            
+            if not df_registered.index.empty:
+                columns_to_move.append('Registration')
 
-                    df_snapshot = process_wallet_delegation_data(df_snapshot, df_wallet_delegation, df_registered, df_kyc)
+            if not df_kyc.index.empty:
+                columns_to_move.append('KYC')
+            
 
-                # ------------------------------
-                if TIERS is not None:
-                    print()
-                    print("* Calculating tiers and seed staking points")
+            df_snapshot = move_columns_to_head(df_snapshot, columns_to_move)
 
-                    df_snapshot = process_tiers(df_snapshot, token_name, TIERS, CALCULATE_SSP)
+            # ------------------------------
 
-                # ------------------------------
+            print()
+            print("-"*10)
 
-                columns_to_move = []
-                
-                if not df_registered.index.empty:
-                    columns_to_move.append('Registration')
+            print()
+            print("* Saving combined (kyc + registration + wallet delegation) snapshot")
 
-                if not df_kyc.index.empty:
-                    columns_to_move.append('KYC')
-                
+            combined_snapshot_filename = f"{filename_suffix}_Snapshot.csv"
+            df_to_csv(df_snapshot, path.join(project_dir, combined_snapshot_filename), 'Wallet', ',')
 
-                df_snapshot = move_columns_to_head(df_snapshot, columns_to_move)
+            print("** Saved as:", combined_snapshot_filename)
 
-                # ------------------------------
 
-                print()
-                print("-"*10)
+            # ------------------------------
 
-                print()
-                print("* Saving combined (kyc + registration + wallet delegation) snapshot")
+            print()
+            print("* Saving whitelist")
 
-                combined_snapshot_filename = f"{filename_suffix}_Snapshot.csv"
-                df_to_csv(df_snapshot, combined_snapshot_filename, 'Wallet', ',')
+            if TIERS is not None:
+                df_snapshot["Tier"] = df_snapshot["Tier"].apply(int)
+                df_whitelist = df_snapshot[ ( df_snapshot["Tier"] > 0 ) & ( df_snapshot["Registration"] == "registered" ) & ( df_snapshot["KYC"] == "approved" )]
+            else:
+                df_whitelist = df_snapshot[ ( df_snapshot["Registration"] == "registered" ) & ( df_snapshot["KYC"] == "approved" )]
 
-                print("** Saved as:", combined_snapshot_filename)
+            whitelist_filename = f"{filename_suffix}_Whitelist.csv"
+            df_to_csv(df_whitelist, path.join(project_dir, whitelist_filename), 'Wallet', ',')
 
+            print("** Saved as:", whitelist_filename)
 
-                # ------------------------------
+            # ------------------------------
 
+            if TIERS is not None:
                 print()
-                print("* Saving whitelist")
+                print("* Creating tier files")
 
-                if TIERS is not None:
-                    df_snapshot["Tier"] = df_snapshot["Tier"].apply(int)
-                    df_whitelist = df_snapshot[ ( df_snapshot["Tier"] > 0 ) & ( df_snapshot["Registration"] == "registered" ) & ( df_snapshot["KYC"] == "approved" )]
-                else:
-                    df_whitelist = df_snapshot[ ( df_snapshot["Registration"] == "registered" ) & ( df_snapshot["KYC"] == "approved" )]
+                del TIERS["0"]
+                
+                for tier_num, df_tier in df_whitelist.groupby('Tier'):
+                    tier_filename = f"Tier{tier_num}_{filename_suffix}.csv"
+                    df_tier_index = df_tier.index.str.lower()
+                    df_tier_index.to_frame(index=False).to_csv(path.join(project_dir, tier_filename), header=False, index=False)
+                    print(f"** Saved Tier {tier_num} wallets to {tier_filename}")
 
-                whitelist_filename = f"{filename_suffix}_Whitelist.csv"
-                df_to_csv(df_whitelist, whitelist_filename, 'Wallet', ',')
+        return pipeline.add("whitelist", create_whitelist, deps=[snapshot_stage, kyc_stage, registration_stage, wallet_delegation_stage], kind=CPU_STAGE, token=token_name)
 
-                print("** Saved as:", whitelist_filename)
+    # ------------------------------
 
-                # ------------------------------
+    # stages the S3 upload waits for
+    upload_deps = ["s3_download"]
 
-                if TIERS is not None:
-                    print()
-                    print("* Creating tier files")
-
-                    del TIERS["0"]
-                    
-                    for tier_num, df_tier in df_whitelist.groupby('Tier'):
-                        tier_filename = f"Tier{tier_num}_{filename_suffix}.csv"
-                        df_tier_index = df_tier.index.str.lower()
-                        df_tier_index.to_frame(index=False).to_csv(tier_filename, header=False, index=False)
-                        print(f"** Saved Tier {tier_num} wallets to {tier_filename}")
+    for token_name in target_tokens_list:
+        
+        # Seed Staking Points (SSP) calculations are only required for SFUND token
+        if token_name != "SFUND":
+            CALCULATE_SSP = False
+
+        snapshot_filename = get_snapshot_filename(token_name, target_pools)
+
+        TIERS = None
+
+        if "TIERS" in all_tokens_dict[token_name].keys():
+            TIERS = all_tokens_dict[token_name]["TIERS"]
+        
+        if project_id is None:
+            network_stages = []
+
+            for network in unique_networks_list:
+                write_stage, upload_stage = add_network_stages(token_name, network, CALCULATE_SSP)
+
+                network_stages.append(write_stage)
+                upload_deps.append(upload_stage)
+
+            upload_deps.append(add_token_snapshot_stage(token_name, network_stages, TIERS, CALCULATE_SSP, snapshot_filename))
+
+            # ------------------------------
+
+            # KYC export is only used by whitelists, it is synced while chain data is being fetched
+            if token_name == "SFUND":
+                upload_deps.append(pipeline.add("kyc_sync", lambda _: fetch_kyc_data(settings["KYC"], path.join(data_dir, kyc_export_filename)), deps=["s3_download"]))
+
+        elif project_id is not None and token_name == "SFUND":
+            upload_deps.append(add_whitelist_stages(token_name, TIERS, CALCULATE_SSP, snapshot_filename))
     
     # ------------------------------
 
-    s3_upload_specific_folders(S3_BUCKET, [data_dir, output_dir], "")
+    pipeline.add("s3_upload", lambda *_: s3_upload_specific_folders(S3_BUCKET, [data_dir, output_dir], ""), deps=upload_deps)
 
     if BACKEND_POST_API_KEY is not None:
-        print()
-        print("* Triggering snapshot data update on backend")
+        def trigger_backend_update(_):
+            print()
+            print("* Triggering snapshot data update on backend")
 
-        result = notify_backend(f"{BACKEND_API_URL}/snapshot", BACKEND_POST_API_KEY, settings["SNAPSHOT_TIMESTAMP"])
+            result = notify_backend(f"{BACKEND_API_URL}/snapshot", BACKEND_POST_API_KEY, settings["SNAPSHOT_TIMESTAMP"])
 
-        if result == True:
-            print("** Snapshot data update is complete")
-        else:
-            print("! An error happened while updating the information in seedify-backend, check console logs and seedify-backend API logs for more details.")
+            if result == True:
+                print("** Snapshot data update is complete")
+            else:
+                print("! An error happened while updating the information in seedify-backend, check console logs and seedify-backend API logs for more details.")
+
+        # notify_backend has its own retries, repeating it could trigger the update twice
+        pipeline.add("notify_backend", trigger_backend_update, deps=["s3_upload"], retries=0)
+
+    try:
+        with cache_lock(data_dir):
+            pipeline.run()
+    finally:
+        save_key_usage()
+        close_providers()
+        close_store()
 
     print()
     print("-"*10)
@@ -564,6 +793,8 @@ def main(tokens_filename, config_filename):
     print()
     print("* Snapshot process is complete")
 
+    write_report(output_dir)
+
     end_timer(startTime)
 
 if __name__ == "__main__":
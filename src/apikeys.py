@@ -0,0 +1,200 @@
+import json
+import hashlib
+import threading
+
+from os import path, replace
+from time import monotonic
+from datetime import datetime, timezone
+
+from .ratelimit import RateLimiter
+from .metrics import wait, increment
+from .utils import find_file
+
+
+DEFAULT_KEY_SETTINGS = {
+    # Etherscan free tier: 5 calls per second and 100k calls per day per key
+    "REQUESTS_PER_SECOND": 5,
+    "DAILY_QUOTA": 100000,
+    # seconds a key is skipped after a rate limit response
+    "COOLDOWN": 2,
+}
+
+KEY_USAGE_FILENAME = "Explorer_Key_Usage.json"
+
+# Explorer responses (status "0") that are about the key, not the request
+RATE_LIMIT_MESSAGES = ["max rate limit", "rate limit reached", "max calls per sec", "too many requests"]
+DAILY_LIMIT_MESSAGES = ["daily rate limit", "daily limit"]
+INVALID_KEY_MESSAGES = ["invalid api key", "missing/invalid api key", "api key is invalid"]
+
+KEY_POOLS = {}
+key_pools_lock = threading.Lock()
+
+# Calls of previous runs of the day per key fingerprint, calls of the current run are added on save
+KEY_USAGE = {
+    "FILENAME": None,
+    "DATE": None,
+    "CALLS": {},
+}
+
+
+class ApiKeyError(Exception):
+    pass
+
+
+# "key1,key2" (environment) or ["key1", "key2"] (config) -> ["key1", "key2"]
+def split_api_keys(api_keys):
+    if api_keys is None: return []
+
+    if isinstance(api_keys, str):
+        api_keys = api_keys.split(",")
+
+    return [str(api_key).strip() for api_key in api_keys if str(api_key).strip()]
+
+
+# Keys are stored and reported by fingerprint, never in plain text
+def key_fingerprint(api_key):
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:12]
+
+
+def current_date():
+    return datetime.now(timezone.utc).strftime("%Y-%m-%d")
+
+
+def load_key_usage(data_dir):
+    KEY_USAGE["FILENAME"] = path.join(data_dir, KEY_USAGE_FILENAME)
+    KEY_USAGE["DATE"] = current_date()
+    KEY_USAGE["CALLS"] = {}
+
+    usage_file = find_file(KEY_USAGE["FILENAME"])
+
+    if usage_file is None: return
+
+    try:
+        with open(usage_file, "r") as json_file:
+            usage = json.load(json_file)
+    except ValueError:
+        return
+
+    # daily quotas start over every day (UTC)
+    if usage.get("DATE") == KEY_USAGE["DATE"]:
+        KEY_USAGE["CALLS"] = usage.get("CALLS", {})
+
+
+def save_key_usage():
+    if KEY_USAGE["FILENAME"] is None: return
+
+    date = current_date()
+    calls = dict(KEY_USAGE["CALLS"]) if KEY_USAGE["DATE"] == date else {}
+
+    with key_pools_lock:
+        for key_pool in KEY_POOLS.values():
+            if key_pool.date != date: continue
+
+            for api_key in key_pool.keys:
+                calls[api_key.fingerprint] = calls.get(api_key.fingerprint, 0) + api_key.calls
+
+    temp_filename = KEY_USAGE["FILENAME"] + ".tmp"
+
+    with open(temp_filename, "w") as json_file:
+        json.dump({"DATE": date, "CALLS": calls}, json_file, indent=4)
+
+    replace(temp_filename, KEY_USAGE["FILENAME"])
+
+
+class ApiKey:
+
+    def __init__(self, api_key, requests_per_second, endpoint):
+        self.key = api_key
+        self.fingerprint = key_fingerprint(api_key) if api_key else "no_key"
+        self.limiter = RateLimiter(requests_per_second, endpoint)
+        # calls of the current run (UTC day)
+        self.calls = 0
+        self.cooldown_until = 0
+        self.invalid = False
+
+
+# Round-robin over the keys of an explorer, each key with its own request rate and daily quota
+class ApiKeyPool:
+
+    def __init__(self, endpoint, api_keys, key_settings=None):
+        self.settings = {**DEFAULT_KEY_SETTINGS, **(key_settings or {})}
+        self.endpoint = endpoint
+        self.keys = [ApiKey(api_key, self.settings["REQUESTS_PER_SECOND"], endpoint) for api_key in (api_keys or [""])]
+        self.date = current_date()
+        self.cursor = 0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                if current_date() != self.date:
+                    self.date = current_date()
+
+                    for api_key in self.keys:
+                        api_key.calls = 0
+
+                usable = [api_key for api_key in self.keys if not api_key.invalid and self.daily_calls(api_key) < self.settings["DAILY_QUOTA"]]
+
+                if not usable:
+                    raise ApiKeyError(f"No usable API key left for {self.endpoint} (invalid or daily quota reached)")
+
+                now = monotonic()
+                ready = [api_key for api_key in usable if api_key.cooldown_until <= now]
+
+                if ready:
+                    api_key = ready[self.cursor % len(ready)]
+                    self.cursor += 1
+                    api_key.calls += 1
+                    break
+
+                cooldown = min(api_key.cooldown_until for api_key in usable) - now
+
+            wait(cooldown, self.endpoint, "key_cooldown")
+
+        api_key.limiter.acquire()
+
+        return api_key
+
+    def daily_calls(self, api_key):
+        previous_calls = KEY_USAGE["CALLS"].get(api_key.fingerprint, 0) if KEY_USAGE["DATE"] == self.date else 0
+
+        return previous_calls + api_key.calls
+
+    def report(self, api_key, problem):
+        with self.lock:
+            if problem == "invalid":
+                api_key.invalid = True
+            elif problem == "daily_limit":
+                api_key.calls += max(0, self.settings["DAILY_QUOTA"] - self.daily_calls(api_key))
+            else:
+                api_key.cooldown_until = monotonic() + self.settings["COOLDOWN"]
+
+        increment(f"explorer_key_{problem}")
+
+        print(f"! Error: Explorer API key {api_key.fingerprint} is skipped ({problem.replace('_', ' ')})")
+
+
+# Key pools are shared by all stages that use the same explorer
+def get_key_pool(endpoint, api_keys, key_settings=None):
+    api_keys = split_api_keys(api_keys)
+
+    with key_pools_lock:
+        pool_id = (endpoint, tuple(api_keys))
+
+        if pool_id not in KEY_POOLS:
+            KEY_POOLS[pool_id] = ApiKeyPool(endpoint, api_keys, key_settings)
+
+        return KEY_POOLS[pool_id]
+
+
+# None for a normal response, otherwise the reason the key can't be used right now
+def get_key_problem(json_data):
+    if not isinstance(json_data, dict) or str(json_data.get("status")) != "0": return None
+
+    message = f"{json_data.get('message', '')} {json_data.get('result', '')}".lower()
+
+    if any(text in message for text in INVALID_KEY_MESSAGES): return "invalid"
+    if any(text in message for text in DAILY_LIMIT_MESSAGES): return "daily_limit"
+    if any(text in message for text in RATE_LIMIT_MESSAGES): return "rate_limit"
+
+    return None
@@ -0,0 +1,345 @@
+import json
+import argparse
+
+from os import path, remove, replace
+
+import numpy as np
+
+from .utils import cache_lock, checkAddress, timestamp_to_date_str
+
+
+DEFAULT_ARCHIVE_SETTINGS = {
+    "ENABLED": False,
+    # local directory in the main directory, it isn't uploaded to S3
+    "DIR": "Balance_Archive",
+}
+
+SECONDS_PER_DAY = 86400
+
+# Wallet columns of a new archive, doubled when there are more wallets
+INITIAL_WALLET_CAPACITY = 1024
+
+# Wallet columns of the window built at once while archiving
+WINDOW_BLOCK_COLUMNS = 4096
+
+# Token amounts don't fit into 64 bits, every balance is stored as (high, low) 64-bit halves
+BALANCE_DTYPE = np.dtype([("hi", "<u8"), ("lo", "<u8")])
+
+
+def get_archive_filename(archive_dir, network, pool):
+    return path.join(archive_dir, f"{network}_{pool}.json")
+
+
+def get_day_number(timestamp):
+    return int(timestamp) // SECONDS_PER_DAY
+
+
+def read_archive_header(archive_filename):
+    if not path.isfile(archive_filename): return None
+
+    with open(archive_filename, "r") as json_file:
+        return json.load(json_file)
+
+
+def write_archive_header(archive_filename, header):
+    temp_filename = archive_filename + ".tmp"
+
+    with open(temp_filename, "w") as json_file:
+        json.dump(header, json_file)
+
+    replace(temp_filename, archive_filename)
+
+
+def is_archived(archive_filename, timestamp):
+    header = read_archive_header(archive_filename)
+
+    if header is None: return False
+
+    row = get_day_number(timestamp) - header["FIRST_DAY"]
+
+    return 0 <= row < len(header["TIMESTAMPS"]) and header["TIMESTAMPS"][row] == int(timestamp)
+
+
+# ------------------------------
+
+
+# Daily balances of a pool as a (day, wallet id) matrix in a memory-mapped file: a row per day since FIRST_DAY,
+# a column per wallet id (in the order the wallets were first archived). The JSON header lists the timestamp of each
+# row (None for days that weren't archived), the wallets and the data file.
+# Readers only see the rows the header lists: new days are written in place before the header lists them, changed
+# archived days (late or reorged txns) are written into a new data file that the replaced header switches to.
+def archive_balance_history(archive_filename, balance_history):
+    timestamps = [int(timestamp) for timestamp in balance_history.snapshot_timestamps]
+
+    with cache_lock(archive_filename):
+        header = read_archive_header(archive_filename)
+
+        if header is None:
+            header = {
+                "FIRST_DAY": get_day_number(timestamps[0]),
+                "TIMESTAMPS": [],
+                "WALLETS": [],
+                "WALLET_CAPACITY": 0,
+                "DATA_FILE": None,
+                "DATA_VERSION": 0,
+            }
+
+        # days before the first archived day can't be added anymore
+        timestamps = [timestamp for timestamp in timestamps if get_day_number(timestamp) >= header["FIRST_DAY"]]
+
+        if len(timestamps) == 0:
+            print(f"** Balance archive starts at {timestamp_to_date_str(header['FIRST_DAY'] * SECONDS_PER_DAY, '%d.%m.%Y')}, nothing to archive")
+            return
+
+        old_header = {**header, "TIMESTAMPS": list(header["TIMESTAMPS"]), "WALLETS": list(header["WALLETS"])}
+        wallet_ids = {wallet: wallet_id for wallet_id, wallet in enumerate(header["WALLETS"])}
+
+        for wallet in balance_history.wallets:
+            if wallet not in wallet_ids:
+                wallet_ids[wallet] = len(header["WALLETS"])
+                header["WALLETS"].append(wallet)
+
+        first_row = get_day_number(timestamps[0]) - header["FIRST_DAY"]
+        last_row = get_day_number(timestamps[-1]) - header["FIRST_DAY"]
+
+        day_count = max(len(header["TIMESTAMPS"]), last_row + 1)
+        wallet_capacity = max(header["WALLET_CAPACITY"], INITIAL_WALLET_CAPACITY)
+
+        while wallet_capacity < len(header["WALLETS"]):
+            wallet_capacity *= 2
+
+        # rows of the balance history (the window), relative to first_row
+        history_offset = len(balance_history.snapshot_timestamps) - len(timestamps)
+        row_count = last_row - first_row + 1
+        block_wallets = get_block_wallets(balance_history, wallet_ids)
+
+        archived_rows = [row - first_row for row in range(first_row, min(last_row + 1, len(old_header["TIMESTAMPS"]))) if old_header["TIMESTAMPS"][row] is not None]
+        new_rows = sorted(set(range(row_count)) - set(archived_rows))
+
+        old_balances = None
+
+        if old_header["DATA_FILE"] is not None:
+            old_balances = load_archive_data(path.join(path.dirname(archive_filename), old_header["DATA_FILE"]), len(old_header["TIMESTAMPS"]), old_header["WALLET_CAPACITY"])
+
+        changed_rows = 0
+
+        if old_balances is not None and archived_rows:
+            blocks = window_blocks(balance_history, block_wallets, history_offset, row_count, wallet_capacity)
+            changed_rows = count_changed_rows(old_balances, blocks, first_row, archived_rows)
+
+        rewrite = old_balances is None or changed_rows > 0 or wallet_capacity != old_header["WALLET_CAPACITY"]
+
+        if rewrite:
+            balances = create_archive_data(archive_filename, header, old_balances, day_count, wallet_capacity)
+            write_rows = list(range(row_count))
+        else:
+            balances = extend_archive_data(archive_filename, header, day_count)
+            write_rows = new_rows
+
+        del old_balances
+
+        if write_rows:
+            for first_column, block in window_blocks(balance_history, block_wallets, history_offset, row_count, wallet_capacity):
+                balances[first_row + np.asarray(write_rows), first_column:first_column + block.shape[1]] = block[write_rows]
+
+        balances.flush()
+        del balances
+
+        header["TIMESTAMPS"] += [None] * (day_count - len(header["TIMESTAMPS"]))
+
+        for row, timestamp in enumerate(timestamps, start=first_row):
+            header["TIMESTAMPS"][row] = timestamp
+
+        write_archive_header(archive_filename, header)
+
+        # readers of the old data file keep their mapping, new readers open the new one
+        if old_header["DATA_FILE"] is not None and old_header["DATA_FILE"] != header["DATA_FILE"]:
+            remove(path.join(path.dirname(archive_filename), old_header["DATA_FILE"]))
+
+    print(f"** Archived {len(new_rows)} new days of {len(balance_history.wallets)} wallets, {changed_rows} archived days changed ({day_count} days, {len(header['WALLETS'])} wallets in the archive)")
+
+
+# Wallet ids of the balance history, grouped by their block of wallet columns
+def get_block_wallets(balance_history, wallet_ids):
+    block_wallets = {}
+
+    for wallet in balance_history.wallets:
+        block_wallets.setdefault(wallet_ids[wallet] // WINDOW_BLOCK_COLUMNS, []).append((wallet_ids[wallet], wallet))
+
+    return block_wallets
+
+
+# Balances of the window (history rows x wallet columns) in blocks of columns, so the window is never built at once
+def window_blocks(balance_history, block_wallets, history_offset, row_count, wallet_capacity):
+    for first_column in range(0, wallet_capacity, WINDOW_BLOCK_COLUMNS):
+        block = np.zeros((row_count, min(WINDOW_BLOCK_COLUMNS, wallet_capacity - first_column)), dtype=BALANCE_DTYPE)
+
+        for wallet_id, wallet in block_wallets.get(first_column // WINDOW_BLOCK_COLUMNS, []):
+            for first_index, last_index, balance in balance_history.segments(wallet):
+                first_index = max(first_index - history_offset, 0)
+                last_index = last_index - history_offset
+
+                if last_index < 0: continue
+
+                block[first_index:last_index + 1, wallet_id - first_column] = (balance >> 64, balance & 0xFFFFFFFFFFFFFFFF)
+
+        yield first_column, block
+
+
+# Archived rows of the window whose balances differ from the new ones (columns past the old capacity were 0)
+def count_changed_rows(old_balances, blocks, first_row, archived_rows):
+    old_capacity = old_balances.shape[1]
+    changed = np.zeros(len(archived_rows), dtype=bool)
+
+    for first_column, block in blocks:
+        new_block = block[archived_rows]
+        last_column = first_column + new_block.shape[1]
+
+        old_block = np.zeros(new_block.shape, dtype=BALANCE_DTYPE)
+
+        if first_column < old_capacity:
+            old_block[:, :min(last_column, old_capacity) - first_column] = old_balances[first_row + np.asarray(archived_rows), first_column:min(last_column, old_capacity)]
+
+        changed |= (old_block != new_block).any(axis=1)
+
+    return int(changed.sum())
+
+
+# New days are added to the end of the data file, readers don't see them until the header lists them
+def extend_archive_data(archive_filename, header, day_count):
+    data_filename = path.join(path.dirname(archive_filename), header["DATA_FILE"])
+
+    with open(data_filename, "r+b") as data_file:
+        data_file.truncate(day_count * header["WALLET_CAPACITY"] * BALANCE_DTYPE.itemsize)
+
+    return np.memmap(data_filename, dtype=BALANCE_DTYPE, mode="r+", shape=(day_count, header["WALLET_CAPACITY"]))
+
+
+# A new data file (wider or with changed archived days) with a copy of the old one, the header switches to it
+def create_archive_data(archive_filename, header, old_balances, day_count, wallet_capacity):
+    header["DATA_VERSION"] = header.get("DATA_VERSION", 0) + 1
+
+    data_filename = path.basename(archive_filename)[:-len(".json")] + f"_{header['DATA_VERSION']}.bin"
+
+    balances = np.memmap(path.join(path.dirname(archive_filename), data_filename), dtype=BALANCE_DTYPE, mode="w+", shape=(day_count, wallet_capacity))
+
+    if old_balances is not None:
+        balances[:old_balances.shape[0], :old_balances.shape[1]] = old_balances
+
+    header["DATA_FILE"] = data_filename
+    header["WALLET_CAPACITY"] = wallet_capacity
+
+    return balances
+
+
+def load_archive_data(data_filename, day_count, wallet_capacity):
+    return np.memmap(data_filename, dtype=BALANCE_DTYPE, mode="r", shape=(day_count, wallet_capacity))
+
+
+# ------------------------------
+
+
+# Read-only view of an archive, the balances are mapped from the data file without copying (shared by all readers)
+class BalanceArchive:
+    def __init__(self, archive_filename):
+        for attempt in range(2):
+            header = read_archive_header(archive_filename)
+
+            if header is None:
+                raise FileNotFoundError(archive_filename)
+
+            try:
+                self.balances = load_archive_data(path.join(path.dirname(archive_filename), header["DATA_FILE"]), len(header["TIMESTAMPS"]), header["WALLET_CAPACITY"])
+                break
+            except FileNotFoundError:
+                # the data file was replaced by a wider one while the header was read
+                if attempt == 1: raise
+
+        self.first_day = header["FIRST_DAY"]
+        self.timestamps = header["TIMESTAMPS"]
+        self.wallets = header["WALLETS"]
+        self.wallet_ids = {wallet: wallet_id for wallet_id, wallet in enumerate(self.wallets)}
+
+    def row(self, timestamp):
+        row = get_day_number(timestamp) - self.first_day
+
+        if not 0 <= row < len(self.timestamps) or self.timestamps[row] is None: return None
+
+        return row
+
+    def balance(self, wallet, timestamp):
+        row = self.row(timestamp)
+        wallet_id = self.wallet_ids.get(wallet)
+
+        if row is None or wallet_id is None: return None
+
+        hi, lo = self.balances[row, wallet_id]
+
+        return (int(hi) << 64) | int(lo)
+
+    # (timestamp, balance) of every archived day
+    def wallet_history(self, wallet):
+        wallet_id = self.wallet_ids.get(wallet)
+
+        if wallet_id is None: return []
+
+        return [
+            (timestamp, (int(self.balances[row, wallet_id]["hi"]) << 64) | int(self.balances[row, wallet_id]["lo"]))
+            for row, timestamp in enumerate(self.timestamps) if timestamp is not None
+        ]
+
+    # Balances of all wallets as floats (rows x wallets), for analyses where float precision is enough
+    def float_balances(self, first_row=0, last_row=None):
+        rows = self.balances[first_row:last_row, :len(self.wallets)]
+
+        return rows["hi"].astype(np.float64) * float(2**64) + rows["lo"].astype(np.float64)
+
+    # SSP points (float) of every wallet for another period or multiplier, ratios are the daily LP ratios of farms
+    def ssp_points(self, snapshot_timestamp, ssp_period, pool_multiplier, ratios=None):
+        last_row = self.row(snapshot_timestamp)
+
+        if last_row is None: return None
+
+        first_row = last_row - ssp_period + 1
+
+        if first_row < 0 or None in self.timestamps[first_row:last_row + 1]: return None
+
+        daily_balances = self.float_balances(first_row, last_row + 1)
+
+        if ratios is not None:
+            daily_balances = daily_balances * np.asarray(ratios, dtype=np.float64)[:, None]
+
+        return dict(zip(self.wallets, daily_balances.sum(axis=0) * float(pool_multiplier) / 100))
+
+
+# ------------------------------
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Daily balances of a wallet from a balance archive")
+
+    parser.add_argument("archive", type=str, help="Archive file, e.g. Balance_Archive/BNB_0x....json")
+    parser.add_argument("--wallet", type=str, help="Prints the daily balances of the wallet")
+
+    args = parser.parse_args()
+
+    balance_archive = BalanceArchive(args.archive)
+
+    archived_days = [timestamp for timestamp in balance_archive.timestamps if timestamp is not None]
+
+    print(f"* {args.archive}: {len(archived_days)} days, {len(balance_archive.wallets)} wallets")
+
+    if archived_days:
+        print(f"** From {timestamp_to_date_str(archived_days[0])} to {timestamp_to_date_str(archived_days[-1])}")
+
+    if args.wallet:
+        wallet = checkAddress(args.wallet)
+
+        print()
+
+        for timestamp, balance in balance_archive.wallet_history(wallet):
+            print(f"   {timestamp_to_date_str(timestamp)}   {balance}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+from bisect import bisect_left
+from decimal import Decimal
+
+import numpy as np
+import pandas as pd
+
+
+# Daily balances of the wallets of a pool as change points: (timestamp index, balance) pairs where the balance changed,
+# a balance holds until the next change point of the wallet (0 before the first one)
+class BalanceHistory:
+    def __init__(self, unique_wallets, snapshot_timestamps, change_points):
+        self.wallets = list(unique_wallets)
+        self.snapshot_timestamps = snapshot_timestamps
+        self.change_points = change_points
+
+    def change_count(self):
+        return sum(len(wallet_changes) for wallet_changes in self.change_points.values())
+
+    # (first timestamp index, last timestamp index, balance) of the non-zero balances of a wallet
+    def segments(self, wallet):
+        wallet_changes = self.change_points.get(wallet, [])
+
+        for i, (first_index, balance) in enumerate(wallet_changes):
+            last_index = wallet_changes[i + 1][0] - 1 if i + 1 < len(wallet_changes) else len(self.snapshot_timestamps) - 1
+
+            if balance != 0:
+                yield first_index, last_index, balance
+
+    def final_balances(self):
+        return pd.Series(
+            [self.change_points[wallet][-1][1] if self.change_points.get(wallet) else 0 for wallet in self.wallets],
+            index=self.wallets, dtype=np.object_
+        )
+
+    # wallets x snapshot timestamps, only built for the daily balances export
+    def to_dense(self):
+        dense_balances = []
+
+        for wallet in self.wallets:
+            wallet_balances = [0] * len(self.snapshot_timestamps)
+
+            for first_index, last_index, balance in self.segments(wallet):
+                wallet_balances[first_index:last_index + 1] = [balance] * (last_index - first_index + 1)
+
+            dense_balances.append(wallet_balances)
+
+        return pd.DataFrame(dense_balances, index=self.wallets, columns=self.snapshot_timestamps, dtype=np.object_)
+
+
+# Clamped running balance of each wallet (never below 0), txn_rows are (wallet, timestamp, value) grouped by wallet and in txn order
+def build_balance_history(txn_rows, unique_wallets, snapshot_timestamps):
+    timestamps = [int(timestamp) for timestamp in snapshot_timestamps]
+    change_points = {}
+
+    current_wallet = None
+
+    for wallet, timestamp, value in txn_rows:
+        if wallet != current_wallet:
+            current_wallet = wallet
+            wallet_changes = change_points.setdefault(wallet, [])
+
+            balance = 0
+            index = 0
+
+        # txns after the snapshot
+        if timestamp > timestamps[-1]: continue
+
+        # first snapshot timestamp at or after the txn
+        if timestamp > timestamps[index]:
+            index = bisect_left(timestamps, timestamp, index)
+
+        balance = max(0, balance + int(value))
+
+        if wallet_changes and wallet_changes[-1][0] == index:
+            wallet_changes[-1] = (index, balance)
+        else:
+            wallet_changes.append((index, balance))
+
+    # only the timestamps the balance changed at are kept
+    for wallet, wallet_changes in change_points.items():
+        last_balance = 0
+        kept_changes = []
+
+        for index, balance in wallet_changes:
+            if balance != last_balance:
+                kept_changes.append((index, balance))
+                last_balance = balance
+
+        change_points[wallet] = kept_changes
+
+    return BalanceHistory(unique_wallets, snapshot_timestamps, change_points)
+
+
+# SSP of each wallet: sum of (balance x multiplier / 100) x weight over its balance segments,
+# the weight of a segment is its number of days, or the sum of the daily LP ratios for LP balances
+def calculate_ssp(balance_history, pool_multiplier, ratios=None):
+    if ratios is None:
+        cumulative_weights = list(range(len(balance_history.snapshot_timestamps) + 1))
+    else:
+        cumulative_weights = [Decimal(0)]
+
+        for ratio in ratios:
+            cumulative_weights.append(cumulative_weights[-1] + ratio)
+
+    zero_points = Decimal(0) * pool_multiplier / Decimal("100")
+    ssp_values = []
+
+    for wallet in balance_history.wallets:
+        wallet_ssp = zero_points
+
+        for first_index, last_index, balance in balance_history.segments(wallet):
+            daily_points = Decimal(balance) * pool_multiplier / Decimal("100")
+            wallet_ssp += daily_points * (cumulative_weights[last_index + 1] - cumulative_weights[first_index])
+
+        ssp_values.append(wallet_ssp)
+
+    return pd.Series(ssp_values, index=balance_history.wallets, dtype=np.object_)
@@ -0,0 +1,62 @@
+import json
+import threading
+
+from os import path, replace
+from time import time
+
+from .utils import find_file
+
+
+BLOCK_CACHE_FILENAME = "Snapshot_Blocks.json"
+
+# Seconds after which the first block at or after a timestamp can't change anymore
+DEFAULT_FINALITY_SECONDS = 120
+
+# Snapshot blocks per network ({network: {timestamp: block number}}), resolved once and reused by every later run
+BLOCK_CACHE = {
+    "FILENAME": None,
+    "BLOCKS": {},
+}
+
+block_cache_lock = threading.Lock()
+
+
+def load_block_cache(data_dir):
+    with block_cache_lock:
+        BLOCK_CACHE["FILENAME"] = path.join(data_dir, BLOCK_CACHE_FILENAME)
+        BLOCK_CACHE["BLOCKS"] = read_block_cache(data_dir)
+
+
+def read_block_cache(data_dir):
+    block_cache_file = find_file(path.join(data_dir, BLOCK_CACHE_FILENAME))
+
+    if block_cache_file is None: return {}
+
+    try:
+        with open(block_cache_file, "r") as json_file:
+            return json.load(json_file)
+    except ValueError:
+        return {}
+
+
+def get_cached_block(network, timestamp):
+    with block_cache_lock:
+        return BLOCK_CACHE["BLOCKS"].get(network, {}).get(str(int(timestamp)))
+
+
+def is_final(timestamp, finality_seconds=DEFAULT_FINALITY_SECONDS):
+    return int(timestamp) <= time() - finality_seconds
+
+
+def save_cached_block(network, timestamp, block_number):
+    with block_cache_lock:
+        if BLOCK_CACHE["FILENAME"] is None: return
+
+        BLOCK_CACHE["BLOCKS"].setdefault(network, {})[str(int(timestamp))] = int(block_number)
+
+        temp_filename = BLOCK_CACHE["FILENAME"] + ".tmp"
+
+        with open(temp_filename, "w") as json_file:
+            json.dump(BLOCK_CACHE["BLOCKS"], json_file, indent=4, sort_keys=True)
+
+        replace(temp_filename, BLOCK_CACHE["FILENAME"])
@@ -1,9 +1,12 @@
 import pandas as pd
 import numpy as np
 
-from decimal import Decimal, InvalidOperation
+from decimal import Decimal
 
-from src.utils import find_file, generate_tier_function, move_columns_to_head
+from src.utils import find_file, generate_tier_function, move_columns_to_head, df_to_csv
+from src.metrics import stage, add_rows
+from src.balances import build_balance_history, calculate_ssp
+from src.archive import archive_balance_history
 
 
 def filter_txns(df_pool_txns, exclude_list):
@@ -54,45 +57,17 @@ def process_txns(df_pool_txns_filtered, unique_wallets, snapshot_timestamps):
     
     print("* Processing", number_of_txns_to_process, "transactions for", len(unique_wallets), "unique wallets")
 
-    df_pool_snapshot = pd.DataFrame(int(0), index=unique_wallets, columns=snapshot_timestamps, dtype=np.object_)
+    # txns of each wallet in their filtered order
+    wallets = df_pool_txns_filtered.index.values
+    wallet_order = np.argsort(wallets, kind="stable")
 
-    prev_stmp = 0
+    txn_rows = zip(wallets[wallet_order], df_pool_txns_filtered["timeStamp"].values[wallet_order], df_pool_txns_filtered["value"].values[wallet_order])
 
-    def positive_cumulative_sum(iterable):
-        total = int(0)
-        for item in iterable:
-            total = max(0, total + int(item))
-        
-        return total
-
-    def positive_cumulative_sum_2(x):
-        initial = df_pool_snapshot.loc[x.name, prev_stmp]
-        iterable = x.values
-
-        total = int(initial)
-        for item in iterable:
-            total = max(0, total + int(item))
-
-        return total
-
-    for i in range(len(snapshot_timestamps)):
-        
-        cur_stamp = snapshot_timestamps[i]
+    balance_history = build_balance_history(txn_rows, unique_wallets, snapshot_timestamps)
 
-        timestamp_condition = (prev_stmp < df_pool_txns_filtered["timeStamp"]) & (df_pool_txns_filtered["timeStamp"] <= cur_stamp)
+    print("**", balance_history.change_count(), "balance changes")
 
-        if i == 0:
-            merged_cumulative_sum = df_pool_txns_filtered[timestamp_condition].groupby("wallet")["value"].apply(positive_cumulative_sum)
-            
-        else:
-            merged_cumulative_sum = df_pool_txns_filtered[timestamp_condition].groupby("wallet")["value"].apply(positive_cumulative_sum_2)
-            df_pool_snapshot.loc[df_pool_snapshot.index.difference(merged_cumulative_sum.index), cur_stamp] = df_pool_snapshot.loc[df_pool_snapshot.index.difference(merged_cumulative_sum.index), prev_stmp]
-
-        df_pool_snapshot.loc[merged_cumulative_sum.index, cur_stamp] = merged_cumulative_sum.values
-
-        prev_stmp = cur_stamp
-
-    return df_pool_snapshot
+    return balance_history
 
 
 def calculate_balance(df_pool_txns, unique_wallets, snapshot_timestamp):
@@ -116,55 +91,84 @@ def calculate_balance(df_pool_txns, unique_wallets, snapshot_timestamp):
     return df_pool_snapshot
 
 
-def calculate(token_name, df_pool_txns, pool, snapshot_timestamps, exclude_list, CALCULATE_SSP, df_lp_history=None):
-    
+def calculate(token_name, df_pool_txns, pool, snapshot_timestamps, exclude_list, CALCULATE_SSP, df_lp_history=None, store=None, network=None, daily_balances_filename=None, balance_archive_filename=None):
+
     pool_name, pool_contract, pool_multiplier, pool_contract_owner, target_token, lp_history = pool
 
-    df_pool_txns_filtered, unique_wallets = filter_txns(df_pool_txns, exclude_list)
+    if store is not None and df_pool_txns is not None and len(df_pool_txns) > 0:
+        # balance change points of the pool are aggregated in the store while the txns are synced
+        with stage("store_balances"):
+            balance_history = store.pool_balances(network, pool_contract, snapshot_timestamps, exclude_list, int(df_pool_txns["blockNumber"].max()))
+            add_rows(len(df_pool_txns))
 
-    df_pool_snapshot = process_txns(df_pool_txns_filtered, unique_wallets, snapshot_timestamps)
+        store.save_balances(network, pool_contract, balance_history)
+    else:
+        with stage("filter_txns"):
+            df_pool_txns_filtered, unique_wallets = filter_txns(df_pool_txns, exclude_list)
+            add_rows(0 if df_pool_txns is None else len(df_pool_txns))
+
+        with stage("process_txns"):
+            balance_history = process_txns(df_pool_txns_filtered, unique_wallets, snapshot_timestamps)
+            add_rows(0 if df_pool_txns_filtered is None else len(df_pool_txns_filtered))
+
+    # daily balances are kept for later runs and other processes (tier history, SSP with another period)
+    if balance_archive_filename is not None:
+        with stage("archive_balances"):
+            archive_balance_history(balance_archive_filename, balance_history)
+            add_rows(len(balance_history.wallets))
+
+    # the dense daily balances (wallets x snapshot timestamps) are only built for the debug export
+    if daily_balances_filename is not None:
+        print("* Saving daily balances")
+
+        df_to_csv(balance_history.to_dense(), daily_balances_filename, 'Wallet', ',')
+
+    final_balances = balance_history.final_balances()
+
+    total_column_name = f"{token_name} ({pool_name})"
+
+    # LP ratio of each snapshot timestamp, None before the LP contract was created
+    ratios = None
 
-    final_snapshot_timestamp = df_pool_snapshot.columns.values[-1]
-    
     if (df_lp_history is not None) and (not df_lp_history.empty):
         print("* Converting LP token amounts to SFUND token amounts")
 
-        copy_column = df_pool_snapshot[final_snapshot_timestamp].copy()
+        with stage("lp_conversion"):
+            df_lp_history["ratio"] = df_lp_history["tokenAmount"].apply(int) / df_lp_history["lpAmount"].apply(int)
+            df_lp_history["ratio"] = df_lp_history["ratio"].apply(Decimal)
 
-        df_lp_history["ratio"] = df_lp_history["tokenAmount"].apply(int) / df_lp_history["lpAmount"].apply(int)
-        df_lp_history["ratio"] = df_lp_history["ratio"].apply(Decimal)
+            ratios = [df_lp_history["ratio"].get(timestamp) for timestamp in balance_history.snapshot_timestamps]
 
-        df_pool_snapshot = df_pool_snapshot.apply(lambda row: row * df_lp_history["ratio"].T.apply(Decimal), axis=1)
+            final_ratio = ratios[-1] if ratios[-1] is not None else np.nan
 
-    total_column_name = f"{token_name} ({pool_name})"
-    df_pool_snapshot.rename(columns={final_snapshot_timestamp: total_column_name}, inplace=True)
+            df_pool_snapshot = pd.DataFrame({ total_column_name: final_balances * final_ratio }, dtype=np.object_)
+            add_rows(len(df_pool_snapshot))
+    else:
+        df_pool_snapshot = pd.DataFrame({ total_column_name: final_balances }, dtype=np.object_)
 
-    def convert_to_decimal(x):
-        try:
-            return Decimal(str(x))
-        except (ValueError, TypeError, InvalidOperation):
-            return None
-        
-    # Convert to Decimal using DataFrame.map
-    df_pool_snapshot_decimal = df_pool_snapshot.map(convert_to_decimal).dropna()
+    with stage("ssp"):
+        # Ensure pool_multiplier is Decimal
+        pool_multiplier = Decimal(str(pool_multiplier))
 
-    # Ensure pool_multiplier is Decimal
-    pool_multiplier = Decimal(str(pool_multiplier))
+        # Add new SSP column
+        if CALCULATE_SSP:
+            ssp_column_name = f"SSP ({pool_name})"
 
-    # Add new SSP column
-    if CALCULATE_SSP:
-        ssp_column_name = f"SSP ({pool_name})"
-        df_pool_snapshot[ssp_column_name] = (
-            df_pool_snapshot_decimal.mul(pool_multiplier).div(Decimal("100")).sum(axis=1)
-        )
+            # SSP can't be calculated for the days before the LP contract was created
+            if ratios is not None and None in ratios:
+                df_pool_snapshot[ssp_column_name] = np.nan
+            else:
+                df_pool_snapshot[ssp_column_name] = calculate_ssp(balance_history, pool_multiplier, ratios)
+
+        add_rows(len(df_pool_snapshot))
 
     column_order = [ total_column_name ]
     
-    if (df_lp_history is not None) and (not df_lp_history.empty):
+    if ratios is not None:
         print("* Adding LP column to results dataframe")
 
         LP_column_name = f"LP ({pool_name})"
-        df_pool_snapshot[LP_column_name] = copy_column
+        df_pool_snapshot[LP_column_name] = final_balances
 
         column_order += [ LP_column_name ]
 
@@ -196,8 +200,8 @@ def select_row(group):
     # pick the first found row, if there is no "approved" one
     return group.iloc[0]
 
-def process_kyc_data(df_snapshot, df_kyc):
-    print("* Processing KYC data")
+def deduplicate_kyc_data(df_kyc):
+    print("* De-duplicating KYC data")
 
     df_kyc = df_kyc.rename(columns={'status': 'KYC'})
     df_kyc.dropna(subset=['KYC'], inplace=True)
@@ -220,6 +224,27 @@ def process_kyc_data(df_snapshot, df_kyc):
     # Now, group by wallet to resolve duplicates in wallet column
     df_kyc = df_kyc.groupby('wallet', group_keys=False).apply(select_row)
 
+    return df_kyc
+
+
+def load_and_deduplicate_kyc_data(kyc_filename):
+    with stage("load_kyc"):
+        df_kyc = load_kyc_data(kyc_filename)
+        add_rows(len(df_kyc))
+
+    if df_kyc.index.empty:
+        return df_kyc, df_kyc
+
+    with stage("deduplicate_kyc"):
+        df_kyc_unique = deduplicate_kyc_data(df_kyc)
+        add_rows(len(df_kyc))
+
+    return df_kyc, df_kyc_unique
+
+
+def merge_kyc_data(df_snapshot, df_kyc):
+    print("* Processing KYC data")
+
     missing_wallets_kyc = df_kyc.index.difference(df_snapshot.index)
     df_missing_wallets_kyc = pd.DataFrame(Decimal("0"), index=missing_wallets_kyc, columns=df_snapshot.columns)
 
@@ -236,6 +261,10 @@ def process_kyc_data(df_snapshot, df_kyc):
     return df_snapshot
 
 
+def process_kyc_data(df_snapshot, df_kyc):
+    return merge_kyc_data(df_snapshot, deduplicate_kyc_data(df_kyc))
+
+
 def process_registration_data(df_snapshot, df_registered):
     if df_snapshot is None: return None
     if df_registered is None: return df_snapshot
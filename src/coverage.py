@@ -0,0 +1,88 @@
+import json
+
+from os import path, replace
+
+from .utils import find_file
+
+
+COVERAGE_SUFFIX = "_Coverage.json"
+
+
+# Block ranges ([first, last], both included) that a txn cache has all txns of, sorted and merged
+def add_interval(intervals, first_block, last_block):
+    if last_block < first_block: return intervals
+
+    merged = []
+
+    for start, end in sorted(intervals + [[first_block, last_block]]):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+
+    return merged
+
+
+def union_intervals(intervals, other_intervals):
+    for start, end in other_intervals:
+        intervals = add_interval(intervals, start, end)
+
+    return intervals
+
+
+def clip_intervals(intervals, last_block):
+    return [[start, min(end, last_block)] for start, end in intervals if start <= last_block]
+
+
+def missing_intervals(intervals, first_block, last_block):
+    gaps = []
+    next_block = first_block
+
+    for start, end in intervals:
+        if end < next_block: continue
+        if start > last_block: break
+
+        if start > next_block:
+            gaps.append([next_block, start - 1])
+
+        next_block = end + 1
+
+    if next_block <= last_block:
+        gaps.append([next_block, last_block])
+
+    return gaps
+
+
+def in_intervals(block_number, intervals):
+    return any(start <= block_number <= end for start, end in intervals)
+
+
+def coverage_filename(txn_export_file_name):
+    return txn_export_file_name[:-len(".csv")] + COVERAGE_SUFFIX
+
+
+# None when the cache has no manifest yet
+def load_coverage(txn_export_file_name):
+    manifest_file = find_file(coverage_filename(txn_export_file_name))
+
+    if manifest_file is None: return None
+
+    try:
+        with open(manifest_file, "r") as json_file:
+            return [[int(start), int(end)] for start, end in json.load(json_file)["COVERED_BLOCKS"]]
+    except (ValueError, KeyError, TypeError):
+        return None
+
+
+def save_coverage(txn_export_file_name, intervals):
+    manifest_filename = coverage_filename(txn_export_file_name)
+    temp_filename = manifest_filename + ".tmp"
+
+    with open(temp_filename, "w") as json_file:
+        json.dump({"COVERED_BLOCKS": intervals}, json_file)
+
+    replace(temp_filename, manifest_filename)
+
+
+def format_intervals(intervals):
+    return ", ".join(f"{start}-{end}" for start, end in intervals)
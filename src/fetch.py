@@ -1,26 +1,51 @@
-from time import sleep, time
-from web3 import Web3
+from time import time
 
 import json
 
 import requests
+import numpy as np
 import pandas as pd
 from urllib.parse import urlparse
+from os import path, remove, replace
 from sys import exit
 
-from tqdm import tqdm
+from concurrent.futures import ThreadPoolExecutor
 
-from .utils import find_file, df_to_csv, checkAddress, download_file_again
+from .utils import find_file, df_to_csv, checkAddress
+from .replay import create_http_adapter
+from .metrics import wait, record_response, record_error, add_rows, increment, lazy_import
+from .ratelimit import RateLimiter
+from .jsonstream import iter_json_array
+from .journal import Journal
+from .apikeys import get_key_pool, get_key_problem
+from .hedge import HedgedRpc
+from .providers import get_provider, get_contract, is_provider_connected, set_provider_connected
+from .retry import RetryPolicy, CircuitOpenError, parse_retry_after, backoff_delay, get_retry_policy
+from .blocks import get_cached_block, save_cached_block, is_final, DEFAULT_FINALITY_SECONDS
+from .coverage import (
+    add_interval, union_intervals, clip_intervals, missing_intervals, in_intervals,
+    load_coverage, save_coverage, format_intervals
+)
+
+
+# Backend exports are parsed while they are downloaded
+BACKEND_STREAM_CHUNK_SIZE = 64 * 1024
+BACKEND_STREAM_BATCH_SIZE = 5000
+
+# Txns with fewer confirmations (config: CONFIRMATIONS per network) are kept out of the txn cache
+DEFAULT_CONFIRMATIONS = 64
 
 
 def createRequestSession():
     max_retries = 3
 
     request_session = requests.Session()
-    adapter = requests.adapters.HTTPAdapter(max_retries=max_retries)
+    adapter = create_http_adapter(max_retries)
     request_session.mount("http://", adapter)
     request_session.mount("https://", adapter)
 
+    request_session.hooks["response"].append(record_response)
+
     return request_session
 
 
@@ -35,22 +60,20 @@ def getContractABI(contractAddress_, temp_settings):
     address = contractAddress_
     
     chainid = temp_settings["CHAIN_ID"]
-    apikey = temp_settings["API_KEY"]
     
     params = {
         "chainid": chainid,
-        "apikey": apikey,
         "module": module,
         "action": action,
         "address": address,
     }
 
     while retry <= max_retries:
-        sleep(delay)
+        if retry > 0: wait(delay, temp_settings["API_URL"], "retry")
         retry += 1
 
         try:
-            response = make_http_request(temp_settings["API_URL"], target_key="result", parameters=params, headers=None)
+            response = call_explorer_api(params, temp_settings)
 
             if not response: return None
 
@@ -72,44 +95,87 @@ def getContractABI(contractAddress_, temp_settings):
     return None
 
 
+# Explorer calls are spread over the API keys of the explorer, keys that hit a limit or are rejected are skipped
+def call_explorer_api(params, temp_settings):
+    key_pool = get_key_pool(temp_settings["API_URL"], temp_settings["API_KEY"], temp_settings.get("EXPLORER_KEYS"))
+
+    while True:
+        api_key = key_pool.acquire()
+
+        response = make_http_request(temp_settings["API_URL"], target_key=None, parameters={**params, "apikey": api_key.key or None}, headers=None)
+
+        if not response: return None
+
+        problem = get_key_problem(response["data"])
+
+        if problem is None: break
+
+        key_pool.report(api_key, problem)
+
+    json_data = response["data"]
+
+    if isinstance(json_data, dict) and "result" in json_data:
+        return {
+            "status_code": response["status_code"],
+            "data": json_data["result"],
+        }
+
+    return response
+
+
 def epochToBlockNumber(targetEpoch_, temp_settings, closest_ = "after"):
     if not targetEpoch_: return 0
 
-    delay = 3
-
     module = "block"
     action = "getblocknobytime"
     timestamp = int(targetEpoch_)
     closest = closest_
     
     chainid = temp_settings["CHAIN_ID"]
-    apikey = temp_settings["API_KEY"]
     
     params = {
         "chainid": chainid,
-        "apikey": apikey,
         "module": module,
         "action": action,
         "timestamp": timestamp,
         "closest": closest,
     }
 
+    retry_policy = RetryPolicy(temp_settings["API_URL"])
+
     while True:
         try:
-            response = make_http_request(temp_settings["API_URL"], target_key="result", parameters=params, headers=None)["data"]
+            response = call_explorer_api(params, temp_settings)["data"]
 
             if not response:
-                continue
+                raise ValueError(f"Empty block number for epoch timestamp {targetEpoch_}")
 
-            response = int(response)
-            break
-        except (ConnectionError, TimeoutError, ValueError):
-            # API request failed, wait and try again
-            # print()
-            # print(f"! Error: Failed to get block number for epoch timestamp {targetEpoch_}. Retrying in {delay} seconds...")
-            sleep(delay)
+            return int(response)
+        except CircuitOpenError:
+            raise
+        except (ConnectionError, TimeoutError, ValueError, TypeError) as ex:
+            # the explorer answered without a usable block number, wait and try again
+            if not retry_policy.failed(host_failure=False):
+                print(f"! Error: Failed to get block number for epoch timestamp {targetEpoch_}: {ex}")
+                raise
 
-    return response
+
+# Block of a snapshot timestamp, looked up once and reused by later runs (only when it can't change anymore)
+def get_snapshot_block_number(timestamp, temp_settings):
+    network = temp_settings.get("NETWORK")
+
+    cached_block = get_cached_block(network, timestamp) if network else None
+
+    if cached_block is not None:
+        increment("snapshot_blocks_cached")
+        return cached_block
+
+    block_number = epochToBlockNumber(timestamp, temp_settings)
+
+    if network and block_number and is_final(timestamp, temp_settings.get("FINALITY_SECONDS") or DEFAULT_FINALITY_SECONDS):
+        save_cached_block(network, timestamp, block_number)
+
+    return block_number
 
 
 def web3Connection(rpcURL, delay=3):
@@ -117,26 +183,32 @@ def web3Connection(rpcURL, delay=3):
     conn = None
 
     max_retries = 3
-    r = 1
-    while True:
-        conn = Web3(Web3.HTTPProvider(rpcURL))
+    retry_policy = RetryPolicy(rpcURL, max_retries=max_retries - 1)
 
-        if conn.is_connected(): return conn
+    while True:
+        # a node that is down is skipped at once, setRPC moves on to the next node
+        if not retry_policy.breaker.allow():
+            print("! Error: RPC node", urlparse(rpcURL).netloc, "is skipped (circuit open)")
+            return None
+
+        # one provider per node for the whole run, a node that answered before is used without another probe call
+        conn = get_provider(rpcURL)
+        connected = is_provider_connected(rpcURL) and not retry_policy.breaker.is_open()
+
+        if connected or conn.is_connected():
+            set_provider_connected(rpcURL)
+            retry_policy.success()
+            return conn
         
-        print("! Error: Connection attempt to", rpcURL, "failed. Retry count:", f"{r}/{max_retries}")
-        sleep(delay)
+        print("! Error: Connection attempt to", rpcURL, "failed. Retry count:", f"{retry_policy.retry + 1}/{max_retries}")
 
-        r += 1
-
-        if r > max_retries: return None
+        if not retry_policy.failed(): return None
 
 def get_contract_creation_timestamp(ofThisContract, temp_settings):
 
     if ofThisContract is None: return None
 
     ofThisContract = checkAddress(ofThisContract)
-    
-    sleep(temp_settings["API_CALL_DELAY"])
 
     module = "account"
     action = "txlistinternal"
@@ -145,11 +217,9 @@ def get_contract_creation_timestamp(ofThisContract, temp_settings):
     sort = "asc"
 
     chainid = temp_settings["CHAIN_ID"]
-    apikey = temp_settings["API_KEY"]
     
     params = {
         "chainid": chainid,
-        "apikey": apikey,
         "module": module,
         "action": action,
         "address": address,
@@ -157,7 +227,7 @@ def get_contract_creation_timestamp(ofThisContract, temp_settings):
         "sort": sort,
     }
 
-    result = make_http_request(temp_settings["API_URL"], target_key="result", parameters=params, headers=None)
+    result = call_explorer_api(params, temp_settings)
 
     if not result: return None
 
@@ -179,7 +249,7 @@ def fetch_lp_history(lp_contract, token_contract, base_snapshot_timestamps, temp
 
     print(f"** Checking historical LP values for {lp_contract}")
 
-    lp_history_file_name = f"LP_HISTORY_{lp_contract}.csv"
+    lp_history_file_name = path.join(temp_settings.get("TOKEN_DIR", ""), f"LP_HISTORY_{lp_contract}.csv")
     lp_history_csv = find_file(lp_history_file_name)
 
     DF_LP_HISTORY_OLD = None
@@ -197,6 +267,19 @@ def fetch_lp_history(lp_contract, token_contract, base_snapshot_timestamps, temp
         DF_LP_HISTORY = pd.concat([DF_LP_HISTORY_OLD, DF_LP_HISTORY_NEW[~DF_LP_HISTORY_NEW.index.isin(DF_LP_HISTORY_OLD.index)]]).loc[filtered_snapshot_timestamps,:]
     else:
         DF_LP_HISTORY = DF_LP_HISTORY_NEW
+
+    # values fetched by an interrupted run
+    lp_journal = Journal(lp_history_file_name)
+    journaled_records = lp_journal.read()
+    journaled_values = [record for record in journaled_records if record["timeStamp"] in DF_LP_HISTORY.index]
+
+    for record in journaled_values:
+        DF_LP_HISTORY.loc[record["timeStamp"], 'lpAmount'] = record["lpAmount"]
+        DF_LP_HISTORY.loc[record["timeStamp"], 'tokenAmount'] = record["tokenAmount"]
+
+    if journaled_values:
+        print(f"*** Resuming with {len(journaled_values)} journaled LP values for {lp_contract}")
+        increment("journal_replayed_records", len(journaled_values))
     
     timestamps_of_missing_values = None
     timestamps_of_missing_values = DF_LP_HISTORY[DF_LP_HISTORY.isnull().any(axis=1)].index
@@ -218,13 +301,25 @@ def fetch_lp_history(lp_contract, token_contract, base_snapshot_timestamps, temp
         token1 = None
         reserve_index = None
 
+        # historical calls are duplicated to another node when the active node is slow
+        hedged_rpc = None
+        hedge_settings = temp_settings.get("RPC_HEDGING") or {}
+
+        if hedge_settings.get("ENABLED") and len(RPC_NODES) > 1:
+            def connect_contract(rpc_url):
+                hedge_web3 = web3Connection(rpc_url)
+
+                return createContractInstance(hedge_web3, lp_contract, contract_abi) if hedge_web3 is not None else None
+
+            hedged_rpc = HedgedRpc(RPC_NODES, connect_contract, hedge_settings)
+
         while True:
             CUR_RPC_TRY += 1
 
             if CUR_RPC_TRY > MAX_RPC_TRY:
                 raise Exception(f"*** !!! --- All RPC nodes failed after {MAX_RPC_TRY} attempts --- !!!")
 
-            sleep(temp_settings["API_CALL_DELAY"])
+            wait(temp_settings["API_CALL_DELAY"], RPC_NODES[(CURRENT_RPC_INDEX + 1) % len(RPC_NODES)])
 
             print()
             print("*** Connecting to RPC node")
@@ -238,6 +333,9 @@ def fetch_lp_history(lp_contract, token_contract, base_snapshot_timestamps, temp
 
             print(f"*** Creating contract instance for {lp_contract}")
             contract_instance = createContractInstance(web3, lp_contract, contract_abi)
+
+            if hedged_rpc is not None:
+                hedged_rpc.set_contract(CURRENT_RPC_INDEX, contract_instance)
             
             if token0 is None:
                 print(f"*** Getting contract of first token in LP ({lp_contract})")
@@ -248,7 +346,7 @@ def fetch_lp_history(lp_contract, token_contract, base_snapshot_timestamps, temp
                     print(f"**** ! Error: contract address of token0 is invalid - RPC node: {CUR_RPC_NODE}, Result: {token0}, switching to another RPC node...")
                     continue
             
-            sleep(temp_settings["API_CALL_DELAY"])
+            wait(temp_settings["API_CALL_DELAY"], RPC_NODES[CURRENT_RPC_INDEX])
 
             if token1 is None:
                 print(f"*** Getting contract of second token in LP ({lp_contract})")
@@ -260,7 +358,7 @@ def fetch_lp_history(lp_contract, token_contract, base_snapshot_timestamps, temp
                     print(f"**** ! Error: contract address of token1 is invalid - RPC node: {CUR_RPC_NODE}, Result: {token1}, switching to another RPC node...")
                     continue
             
-            sleep(temp_settings["API_CALL_DELAY"])
+            wait(temp_settings["API_CALL_DELAY"], RPC_NODES[CURRENT_RPC_INDEX])
             
             if reserve_index is None:
                 if token0 == token_contract:
@@ -269,6 +367,10 @@ def fetch_lp_history(lp_contract, token_contract, base_snapshot_timestamps, temp
                     reserve_index = 1
                 else:
                     print(f"**** Skipping LP token ({lp_contract}), target token is not a part of the pair")
+
+                    if hedged_rpc is not None:
+                        hedged_rpc.close()
+
                     return None
             
             timestamps_of_missing_values = None
@@ -280,25 +382,35 @@ def fetch_lp_history(lp_contract, token_contract, base_snapshot_timestamps, temp
                 print(f"*** Found {missing_values_count} missing LP values for {lp_contract}")
                 print(f"*** Fetching missing historical LP pair amounts for {lp_contract}")
                 
+                tqdm = lazy_import("tqdm").tqdm
+
                 for NEXT_LP_TIMESTAMP in tqdm(timestamps_of_missing_values, unit="values"): #, colour="green"
-                    NEXT_LP_BLOCK = epochToBlockNumber(NEXT_LP_TIMESTAMP, temp_settings)
+                    NEXT_LP_BLOCK = get_snapshot_block_number(NEXT_LP_TIMESTAMP, temp_settings)
 
                     # -----------------------------------------------------------------------------
 
-                    sleep(temp_settings["API_CALL_DELAY"])
+                    wait(temp_settings["API_CALL_DELAY"], RPC_NODES[CURRENT_RPC_INDEX])
 
                     try:
                         # totalSupply() call
-                        totalSupply = contract_instance.functions.totalSupply().call({'from': lp_contract}, block_identifier=NEXT_LP_BLOCK)
-                    except:
+                        if hedged_rpc is not None:
+                            totalSupply = hedged_rpc.call(lambda contract, block=NEXT_LP_BLOCK: contract.functions.totalSupply().call({'from': lp_contract}, block_identifier=block), CURRENT_RPC_INDEX)
+                        else:
+                            totalSupply = contract_instance.functions.totalSupply().call({'from': lp_contract}, block_identifier=NEXT_LP_BLOCK)
+                    except Exception as ex:
+                        record_rpc_error(RPC_NODES[CURRENT_RPC_INDEX], ex)
                         continue
 
-                    sleep(temp_settings["API_CALL_DELAY"])
+                    wait(temp_settings["API_CALL_DELAY"], RPC_NODES[CURRENT_RPC_INDEX])
 
                     try:
                         # getReserves() call
-                        getReserves = contract_instance.functions.getReserves().call({'from': lp_contract}, block_identifier=NEXT_LP_BLOCK)[reserve_index]
-                    except:
+                        if hedged_rpc is not None:
+                            getReserves = hedged_rpc.call(lambda contract, block=NEXT_LP_BLOCK: contract.functions.getReserves().call({'from': lp_contract}, block_identifier=block), CURRENT_RPC_INDEX)[reserve_index]
+                        else:
+                            getReserves = contract_instance.functions.getReserves().call({'from': lp_contract}, block_identifier=NEXT_LP_BLOCK)[reserve_index]
+                    except Exception as ex:
+                        record_rpc_error(RPC_NODES[CURRENT_RPC_INDEX], ex)
                         continue
 
                     # -----------------------------------------------------------------------------
@@ -309,8 +421,11 @@ def fetch_lp_history(lp_contract, token_contract, base_snapshot_timestamps, temp
                     DF_LP_HISTORY.loc[NEXT_LP_TIMESTAMP, 'lpAmount'] = total_lp_amount
                     DF_LP_HISTORY.loc[NEXT_LP_TIMESTAMP, 'tokenAmount'] = total_tokens_in_lps
 
-                    df_to_csv(DF_LP_HISTORY, lp_history_file_name, 'timeStamp', ',')
+                    lp_journal.append({"timeStamp": NEXT_LP_TIMESTAMP, "lpAmount": total_lp_amount, "tokenAmount": total_tokens_in_lps})
                 
+                if hedged_rpc is not None:
+                    print(f"*** Hedge rate for {lp_contract}: {hedged_rpc.hedge_rate():.1%} ({hedged_rpc.hedges} of {hedged_rpc.calls} RPC calls)")
+
                 timestamps_of_missing_values = None
                 timestamps_of_missing_values = DF_LP_HISTORY[DF_LP_HISTORY.isnull().any(axis=1)].index
 
@@ -318,6 +433,9 @@ def fetch_lp_history(lp_contract, token_contract, base_snapshot_timestamps, temp
 
                 if missing_values_count > 0:
                     print(f"**** {missing_values_count} values are still missing, switching to another RPC node...")
+
+                    # the node is probed again before it is used next time
+                    set_provider_connected(RPC_NODES[CURRENT_RPC_INDEX], False)
                     continue
                 else:
                     break
@@ -326,23 +444,38 @@ def fetch_lp_history(lp_contract, token_contract, base_snapshot_timestamps, temp
                 print(f"*** We already have the most up-to-date data")
                 break
         
-        df_to_csv(DF_LP_HISTORY, lp_history_file_name, 'timeStamp', ',')
+        if hedged_rpc is not None:
+            hedged_rpc.close()
+
+        lp_journal.compact(DF_LP_HISTORY, 'timeStamp')
     else:
         print(f"*** We already have the most up-to-date data")
 
+        if journaled_records:
+            lp_journal.compact(DF_LP_HISTORY, 'timeStamp')
+
     return DF_LP_HISTORY
 
 
+# error statuses are already counted by the response hook, everything else (timeouts, reverts, bad results) here
+def record_rpc_error(endpoint, ex):
+    if not isinstance(ex, requests.exceptions.HTTPError):
+        record_error(endpoint)
+
+
 def make_http_request(target_url, target_key="result", parameters=None, headers=None):
     session = createRequestSession()
     session.keep_alive = 5
 
     timeout = 30
-    retry_delay = 10
-    max_retries = 5
-    retry = 0
+    retry_policy = RetryPolicy(target_url)
     
-    while retry < max_retries:
+    while True:
+        retry_after = None
+
+        # fails at once while the host is down
+        retry_policy.check()
+
         try:
             response = session.get(target_url, params=parameters, headers=headers, timeout=timeout)
             
@@ -355,6 +488,8 @@ def make_http_request(target_url, target_key="result", parameters=None, headers=
 
             response.raise_for_status()  # Will raise an HTTPError for bad responses (4xx or 5xx)
 
+            retry_policy.success()
+
             try:
                 # Attempt to parse JSON and access the target key
                 json_data = response.json()
@@ -381,34 +516,44 @@ def make_http_request(target_url, target_key="result", parameters=None, headers=
                     "data": response.content,  # Return raw content if JSON parsing fails
                 }
 
+        except requests.exceptions.HTTPError as ex:
+            if not retry_policy.is_retryable_status(ex.response.status_code):
+                # the request itself is rejected (e.g. 400, 401, 404), repeating it won't help
+                print(f"Error: {ex}. Not retrying.")
+                retry_policy.fatal()
+                raise
+
+            retry_after = parse_retry_after(ex.response.headers.get("Retry-After"))
+            print(f"Error: {ex}. Retrying... ({retry_policy.retry + 1}/{retry_policy.max_retries})")
         except requests.exceptions.Timeout:
-            print(f"Timeout occurred. Retrying in {retry_delay} seconds... ({retry + 1}/{max_retries})")
+            record_error(target_url)
+            print(f"Timeout occurred. Retrying... ({retry_policy.retry + 1}/{retry_policy.max_retries})")
         except requests.exceptions.TooManyRedirects:
-            print("Error: Too many redirects. Check the URL. Retrying in {retry_delay} seconds... ({retry + 1}/{max_retries})")
+            record_error(target_url)
+            print("Error: Too many redirects. Check the URL.")
+            retry_policy.fatal()
             break  # Stop retrying if this error occurs
         except requests.exceptions.RequestException as ex:
-            print(f"Error: {type(ex).__name__} occurred: {ex}. Retrying in {retry_delay} seconds... ({retry + 1}/{max_retries})")
+            record_error(target_url)
+            print(f"Error: {type(ex).__name__} occurred: {ex}. Retrying... ({retry_policy.retry + 1}/{retry_policy.max_retries})")
             # Handle specific errors or fall back to a general case
         except KeyError as ke:
             # Handle KeyError specifically if the target key is not in the JSON
-            print(f"Key error: {ke}. Returning raw content. Retrying in {retry_delay} seconds... ({retry + 1}/{max_retries})")
+            print(f"Key error: {ke}. Returning raw content.")
             return {
                 "status_code": response.status_code,
                 "data": response.content,
             }
         except Exception as ex:
             # Catch any other exceptions not anticipated
-            print(f"Unexpected error: {type(ex).__name__} occurred: {ex}. Retrying in {retry_delay} seconds... ({retry + 1}/{max_retries})")
+            print(f"Unexpected error: {type(ex).__name__} occurred: {ex}.")
             raise  # Re-raise unexpected exceptions to avoid silent failures
 
-        # Check if max retries reached
-        if retry >= max_retries - 1:
+        # backoff with jitter (or the server's Retry-After) before the next attempt
+        if not retry_policy.failed(retry_after):
             print("Max retries reached. Halting script.")
             raise requests.exceptions.RequestException("Max retries reached. Cannot fetch data.")
 
-        retry += 1
-        sleep(retry_delay)
-
 def getContractOwner(ofThisContract, temp_settings):
     if not ofThisContract: return None
 
@@ -418,21 +563,19 @@ def getContractOwner(ofThisContract, temp_settings):
     sort = "asc"
 
     chainid = temp_settings["CHAIN_ID"]
-    apikey = temp_settings["API_KEY"]
     
     params = {
         "chainid": chainid,
-        "apikey": apikey,
         "module": module,
         "action": action,
         "contractaddresses": contractaddresses,
         "sort": sort,
     }
 
-    result = make_http_request(temp_settings["API_URL"], target_key="result", parameters=params, headers=None)
+    result = call_explorer_api(params, temp_settings)
 
     if not result:
-        result = make_http_request(temp_settings["API_URL"], target_key="result", parameters=params, headers=None)
+        result = call_explorer_api(params, temp_settings)
 
         if not result: return None
 
@@ -454,9 +597,19 @@ def fetch_pool_txns( pool, temp_settings ):
 
     END_BLOCK_NUMBER = temp_settings["SNAPSHOT_BLOCK_NUMBER"]
 
-    txn_export_file_name = f"{pool_contract}.csv"
+    CONFIRMATIONS = temp_settings.get("CONFIRMATIONS")
+
+    if CONFIRMATIONS is None: CONFIRMATIONS = DEFAULT_CONFIRMATIONS
+
+    txn_export_file_name = path.join(temp_settings.get("TOKEN_DIR", ""), f"{pool_contract}.csv")
     txn_export_csv = find_file(txn_export_file_name)
 
+    # txns that could still be reorged, they are fetched again (from the last confirmed block) and compared by the next run
+    unconfirmed_file_name = path.join(temp_settings.get("TOKEN_DIR", ""), f"{pool_contract}_Unconfirmed.csv")
+    unconfirmed_csv = find_file(unconfirmed_file_name)
+
+    DF_UNCONFIRMED_OLD = pd.read_csv(unconfirmed_csv, dtype=str) if unconfirmed_csv else pd.DataFrame()
+
     column_names = ["blockNumber", "timeStamp", "from", "to", "value"]
 
     if txn_export_csv:
@@ -464,66 +617,160 @@ def fetch_pool_txns( pool, temp_settings ):
     else:
         DF_POOL_TXN_HISTORY = pd.DataFrame()
 
-    if DF_POOL_TXN_HISTORY.empty:
-        START_BLOCK_NUMBER = 0
+    # block ranges the cache has all txns of, caches without a manifest are trusted up to their last block
+    OLD_COVERED_BLOCKS = load_coverage(txn_export_file_name)
+
+    if OLD_COVERED_BLOCKS is not None:
+        COVERED_BLOCKS = OLD_COVERED_BLOCKS
+    elif DF_POOL_TXN_HISTORY.empty:
+        COVERED_BLOCKS = []
     else:
-        START_BLOCK_NUMBER = int(DF_POOL_TXN_HISTORY.iloc[-1]["blockNumber"])
+        COVERED_BLOCKS = add_interval([], 0, int(DF_POOL_TXN_HISTORY.iloc[-1]["blockNumber"]) - 1)
     
     print("* Checking transactions")
 
     LIST_DF_PARTIAL_TXNS = [DF_POOL_TXN_HISTORY]
 
-    if START_BLOCK_NUMBER <= END_BLOCK_NUMBER:
-        print("* Fetching new transactions")
-    
-    while START_BLOCK_NUMBER <= END_BLOCK_NUMBER:
+    # pages fetched by an interrupted run, only the blocks they don't cover are fetched
+    txn_journal = Journal(txn_export_file_name)
+    journaled_pages = txn_journal.read()
 
-        txn_list = getTokenTxnList(pool_contract, target_token, temp_settings, START_BLOCK_NUMBER, END_BLOCK_NUMBER)
+    FETCHED_BLOCKS = []
 
-        if (txn_list is None) or (len(txn_list) == 0): break
+    for page in journaled_pages:
+        LIST_DF_PARTIAL_TXNS.append(pd.DataFrame(page["txns"]))
 
-        DF_PARTIAL_TXNS = pd.DataFrame(txn_list)
+        # pages journaled without their block range are fetched again
+        if "firstBlock" in page:
+            FETCHED_BLOCKS = add_interval(FETCHED_BLOCKS, page["firstBlock"], page["lastBlock"])
 
-        LIST_DF_PARTIAL_TXNS.append(DF_PARTIAL_TXNS)
+    if journaled_pages:
+        journaled_txns = sum(len(page["txns"]) for page in journaled_pages)
+        print(f"** Resuming with {journaled_txns} journaled transactions")
+        increment("journal_replayed_records", len(journaled_pages))
 
-        if len(txn_list) < batch_size: break
+    MISSING_BLOCKS = missing_intervals(union_intervals(COVERED_BLOCKS, FETCHED_BLOCKS), 0, END_BLOCK_NUMBER)
 
-        START_BLOCK_NUMBER = int(DF_PARTIAL_TXNS.iloc[-1]["blockNumber"])
+    if MISSING_BLOCKS:
+        print(f"* Fetching new transactions (blocks {format_intervals(MISSING_BLOCKS)})")
+
+    for FIRST_MISSING_BLOCK, LAST_MISSING_BLOCK in MISSING_BLOCKS:
+        START_BLOCK_NUMBER = FIRST_MISSING_BLOCK
+
+        while START_BLOCK_NUMBER <= LAST_MISSING_BLOCK:
+
+            txn_list = getTokenTxnList(pool_contract, target_token, temp_settings, START_BLOCK_NUMBER, LAST_MISSING_BLOCK)
 
-        sleep(temp_settings["API_CALL_DELAY"])
+            # the rest of the range stays uncovered and is fetched by the next run
+            if not isinstance(txn_list, list):
+                print(f"** ! Couldn't fetch the transactions of blocks {START_BLOCK_NUMBER}-{LAST_MISSING_BLOCK}, they are left as a gap for the next run")
+                increment("txn_cache_gaps_left")
+                break
+
+            # a full page can end in the middle of a block, the next page starts with that block
+            if len(txn_list) < batch_size:
+                LAST_FETCHED_BLOCK = LAST_MISSING_BLOCK
+            else:
+                LAST_FETCHED_BLOCK = int(txn_list[-1]["blockNumber"]) - 1
+
+            txn_journal.append({"firstBlock": START_BLOCK_NUMBER, "lastBlock": LAST_FETCHED_BLOCK, "txns": txn_list})
+            FETCHED_BLOCKS = add_interval(FETCHED_BLOCKS, START_BLOCK_NUMBER, LAST_FETCHED_BLOCK)
+
+            if txn_list:
+                LIST_DF_PARTIAL_TXNS.append(pd.DataFrame(txn_list))
 
-    if len(LIST_DF_PARTIAL_TXNS) == 0: return DF_POOL_TXN_HISTORY
+            if len(txn_list) < batch_size: break
+
+            if LAST_FETCHED_BLOCK < START_BLOCK_NUMBER:
+                print(f"** ! Block {START_BLOCK_NUMBER} has more than {batch_size} transactions, it is left as a gap for the next run")
+                increment("txn_cache_gaps_left")
+                break
+
+            START_BLOCK_NUMBER = LAST_FETCHED_BLOCK + 1
 
     old_txn_count = DF_POOL_TXN_HISTORY.shape[0]
 
     DF_POOL_TXN_HISTORY = pd.concat(LIST_DF_PARTIAL_TXNS)
+
+    if DF_POOL_TXN_HISTORY.empty:
+        DF_POOL_TXN_HISTORY = pd.DataFrame(columns=column_names)
     
     if 'input' in DF_POOL_TXN_HISTORY.columns:
         DF_POOL_TXN_HISTORY = DF_POOL_TXN_HISTORY.drop(['input'], axis=1)
-    
+
+    # cached txns have no confirmations, they were confirmed when they were cached
     if 'confirmations' in DF_POOL_TXN_HISTORY.columns:
+        txn_confirmations = pd.to_numeric(DF_POOL_TXN_HISTORY['confirmations'], errors="coerce").fillna(CONFIRMATIONS).to_numpy()
         DF_POOL_TXN_HISTORY = DF_POOL_TXN_HISTORY.drop(['confirmations'], axis=1)
+    else:
+        txn_confirmations = np.full(DF_POOL_TXN_HISTORY.shape[0], CONFIRMATIONS)
     
     DF_POOL_TXN_HISTORY = DF_POOL_TXN_HISTORY.astype(str)
     DF_POOL_TXN_HISTORY["from"] = DF_POOL_TXN_HISTORY["from"].apply(checkAddress)
     DF_POOL_TXN_HISTORY["to"] = DF_POOL_TXN_HISTORY["to"].apply(checkAddress)
-    DF_POOL_TXN_HISTORY = DF_POOL_TXN_HISTORY.drop_duplicates(keep="first")
 
-    new_txn_count = DF_POOL_TXN_HISTORY.shape[0]
+    unique_txns = ~DF_POOL_TXN_HISTORY.duplicated(keep="first").to_numpy()
+    DF_POOL_TXN_HISTORY = DF_POOL_TXN_HISTORY[unique_txns]
+    txn_confirmations = txn_confirmations[unique_txns]
+
+    # txns of filled gaps are appended after the cached ones
+    txn_order = np.argsort(DF_POOL_TXN_HISTORY["blockNumber"].apply(int).to_numpy(), kind="stable")
+    DF_POOL_TXN_HISTORY = DF_POOL_TXN_HISTORY.iloc[txn_order]
+    txn_confirmations = txn_confirmations[txn_order]
+
+    # everything from the first block with an unconfirmed txn is kept out of the txn cache
+    txn_blocks = DF_POOL_TXN_HISTORY["blockNumber"].apply(int).to_numpy()
+    unconfirmed_blocks = txn_blocks[txn_confirmations < CONFIRMATIONS]
+
+    NEW_COVERED_BLOCKS = union_intervals(COVERED_BLOCKS, FETCHED_BLOCKS)
+
+    if len(unconfirmed_blocks) > 0:
+        is_confirmed = txn_blocks < unconfirmed_blocks.min()
+        NEW_COVERED_BLOCKS = clip_intervals(NEW_COVERED_BLOCKS, int(unconfirmed_blocks.min()) - 1)
+    else:
+        is_confirmed = np.full(len(txn_blocks), True)
+
+    DF_CONFIRMED = DF_POOL_TXN_HISTORY[is_confirmed]
+    DF_UNCONFIRMED = DF_POOL_TXN_HISTORY[~is_confirmed]
+
+    verify_unconfirmed_txns(DF_UNCONFIRMED_OLD, DF_POOL_TXN_HISTORY, FETCHED_BLOCKS)
+
+    # unconfirmed txns of the previous run that weren't fetched again (e.g. after the snapshot block) are kept
+    if not DF_UNCONFIRMED_OLD.empty:
+        old_unconfirmed_blocks = DF_UNCONFIRMED_OLD["blockNumber"].apply(int)
+        is_kept = old_unconfirmed_blocks.apply(lambda block: not in_intervals(block, FETCHED_BLOCKS) and not in_intervals(block, NEW_COVERED_BLOCKS))
+
+        if is_kept.any():
+            DF_UNCONFIRMED = pd.concat([DF_UNCONFIRMED, DF_UNCONFIRMED_OLD[is_kept]])
+            DF_UNCONFIRMED = DF_UNCONFIRMED.iloc[DF_UNCONFIRMED["blockNumber"].apply(int).argsort(kind="stable")]
+
+    new_txn_count = DF_CONFIRMED.shape[0]
 
     fetched_txns = new_txn_count - old_txn_count
 
     if fetched_txns > 0:
         print("** Fetched", fetched_txns, "new transactions" if fetched_txns > 1 else "new transaction")
-        df_to_csv(DF_POOL_TXN_HISTORY, txn_export_file_name, None, ',')
+        txn_journal.compact(DF_CONFIRMED, None)
     else:
         print(f"** We already have the most up-to-date data")
+        txn_journal.remove()
+
+    if not DF_UNCONFIRMED.empty:
+        print(f"** {DF_UNCONFIRMED.shape[0]} unconfirmed transactions (less than {CONFIRMATIONS} confirmations) are kept apart until the next run")
+
+    save_unconfirmed_txns(DF_UNCONFIRMED, unconfirmed_file_name)
+
+    if NEW_COVERED_BLOCKS != OLD_COVERED_BLOCKS:
+        save_coverage(txn_export_file_name, NEW_COVERED_BLOCKS)
     
     DF_POOL_TXN_HISTORY = DF_POOL_TXN_HISTORY[column_names]
 
     DF_POOL_TXN_HISTORY['blockNumber'] = DF_POOL_TXN_HISTORY['blockNumber'].apply(int)
     DF_POOL_TXN_HISTORY['timeStamp'] = DF_POOL_TXN_HISTORY['timeStamp'].apply(int)
     DF_POOL_TXN_HISTORY['value'] = DF_POOL_TXN_HISTORY['value'].apply(int)
+
+    # the cache can go beyond the snapshot block (follow mode, later snapshots), only txns up to it are used
+    DF_POOL_TXN_HISTORY = DF_POOL_TXN_HISTORY[DF_POOL_TXN_HISTORY['blockNumber'] <= END_BLOCK_NUMBER]
     
     return DF_POOL_TXN_HISTORY
 
@@ -538,7 +785,7 @@ def fetch_token_txns( target_token, temp_settings ):
 
     # ------------------------------------------------------------------
 
-    txn_export_file_name = f"{target_token}.csv"
+    txn_export_file_name = path.join(temp_settings.get("TOKEN_DIR", ""), f"{target_token}.csv")
     txn_export_csv = find_file(txn_export_file_name)
 
     column_names = ["blockNumber", "timeStamp", "from", "to", "value"]
@@ -587,8 +834,6 @@ def fetch_token_txns( target_token, temp_settings ):
         if len(txn_list) < batch_size: break
 
         START_BLOCK_NUMBER = int(DF_PARTIAL_TXNS.iloc[-1]["blockNumber"])
-
-        sleep(temp_settings["API_CALL_DELAY"])
     
     print()
 
@@ -622,8 +867,6 @@ def getTokenTxnList(ofThisWallet, forThisToken, temp_settings, startBlock, endBl
     if not forThisToken: return None
     
     forThisToken = checkAddress(forThisToken)
-    
-    sleep(temp_settings["API_CALL_DELAY"])
 
     module = "account"
     action = "tokentx"
@@ -633,7 +876,6 @@ def getTokenTxnList(ofThisWallet, forThisToken, temp_settings, startBlock, endBl
     sort = "asc"
     
     chainid = temp_settings["CHAIN_ID"]
-    apikey = temp_settings["API_KEY"]
     
     params = {
         "chainid": chainid,
@@ -643,22 +885,55 @@ def getTokenTxnList(ofThisWallet, forThisToken, temp_settings, startBlock, endBl
         "startblock": startblock,
         "endblock": endblock,
         "sort": sort,
-        "apikey": apikey,
     }
 
     if ofThisWallet is not None: params["address"] = ofThisWallet
 
-    result = make_http_request(temp_settings["API_URL"], target_key="result", parameters=params, headers=None)
+    result = call_explorer_api(params, temp_settings)
 
     if not result: return None
 
     return result["data"]
 
 
+# Txns of the previous unconfirmed tail that are missing from the fetched txns (same txn hash, block hash and transfer) were reorged
+def verify_unconfirmed_txns(df_unconfirmed_old, df_txns, fetched_blocks):
+    if df_unconfirmed_old.empty: return
+
+    # only the part of the tail that was fetched again can be verified
+    df_unconfirmed_old = df_unconfirmed_old[df_unconfirmed_old["blockNumber"].apply(lambda block: in_intervals(int(block), fetched_blocks))]
+
+    if df_unconfirmed_old.empty: return
+
+    key_columns = [col for col in ["blockNumber", "hash", "blockHash", "from", "to", "value"] if col in df_unconfirmed_old.columns and col in df_txns.columns]
+
+    old_keys = df_unconfirmed_old[key_columns].astype(str).apply(tuple, axis=1)
+    new_keys = set(df_txns[key_columns].astype(str).apply(tuple, axis=1))
+
+    reorged_txns = int((~old_keys.isin(new_keys)).sum())
+
+    if reorged_txns > 0:
+        print(f"** ! {reorged_txns} of {len(old_keys)} unconfirmed transactions of the previous run were reorged, they are replaced with the fetched ones")
+        increment("reorged_txns", reorged_txns)
+    else:
+        print(f"** {len(old_keys)} unconfirmed transactions of the previous run are verified")
+
+
+def save_unconfirmed_txns(df_unconfirmed, unconfirmed_file_name):
+    if df_unconfirmed.empty:
+        if path.isfile(unconfirmed_file_name):
+            remove(unconfirmed_file_name)
+
+        return
+
+    temp_filename = unconfirmed_file_name + ".tmp"
+
+    df_to_csv(df_unconfirmed, temp_filename, None, ',')
+    replace(temp_filename, unconfirmed_file_name)
+
+
 def query_pool(pool, temp_settings):
     pool_name, pool_contract, pool_multiplier = pool
-
-    sleep(temp_settings["API_CALL_DELAY"])
     
     pool_contract = checkAddress(pool_contract)
 
@@ -666,8 +941,6 @@ def query_pool(pool, temp_settings):
         print()
         print(f"! Error: pool contract address is empty - pool: {pool}")
         print()
-    
-    sleep(temp_settings["API_CALL_DELAY"])
 
     pool_contract_owner = checkAddress(getContractOwner(pool_contract, temp_settings))
     
@@ -679,6 +952,156 @@ def query_pool(pool, temp_settings):
     return pool_name, pool_contract, pool_multiplier, pool_contract_owner
 
 
+KYC_RAW_COLUMNS = ['refId', 'wallet', 'status', 'recordId', 'blockPassID', 'inreviewDate', 'waitingDate', 'approvedDate']
+
+
+def normalize_kyc_records(df_records):
+    df_records = df_records.fillna('')
+
+    if "identities" in df_records.columns:
+        df_records['wallet'] = df_records["identities"].apply(lambda x: x.get('crypto_address_eth', {}).get("value", '') if isinstance(x, dict) else '')
+
+    for col in KYC_RAW_COLUMNS:
+        if col not in df_records.columns:
+            df_records[col] = ''
+
+    return df_records[KYC_RAW_COLUMNS].astype(str)
+
+
+# Pages of the list from start_skip until a page comes back short (or page_count pages)
+def fetch_kyc_pages(kyc_settings, rate_limiter, status_="", start_skip=0, page_count=None):
+    batch_size = kyc_settings.get("BATCH_SIZE", 20)
+    concurrency = kyc_settings.get("MAX_CONCURRENCY", 4)
+
+    def fetch_page(skip):
+        rate_limiter.acquire()
+        page = getRecords(kyc_settings["CLIENT_ID"], kyc_settings["API_URL"], kyc_settings["API_KEY"], status_, batch_size, skip)
+
+        # a failed page isn't the last page, the sync fails and the previous KYC export is kept
+        if page is None:
+            raise ValueError(f"KYC page could not be fetched (status: '{status_}', skip: {skip})")
+
+        return page
+
+    list_df_pages = []
+    skip = start_skip
+    fetched_pages = 0
+    fetched_records = 0
+    last_page_found = False
+
+    # pages are requested in waves of "concurrency" pages, until a page comes back short
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        while not last_page_found:
+            wave_size = concurrency if page_count is None else min(concurrency, page_count - fetched_pages)
+            pages = executor.map(fetch_page, [skip + i * batch_size for i in range(wave_size)])
+
+            for page in pages:
+                fetched_pages += 1
+
+                if page:
+                    list_df_pages.append(pd.DataFrame(page))
+                    fetched_records += len(page)
+                    add_rows(len(page))
+
+                if len(page) < batch_size:
+                    last_page_found = True
+                    break
+
+            skip += wave_size * batch_size
+
+            if page_count is not None and fetched_pages >= page_count:
+                last_page_found = True
+
+            print("** Fetched", fetched_records, "records", end='\r')
+
+    if len(list_df_pages) == 0:
+        return pd.DataFrame(columns=KYC_RAW_COLUMNS)
+
+    return normalize_kyc_records(pd.concat(list_df_pages, ignore_index=True))
+
+
+# New applicants are appended to the end of the list. The fetch starts one page before the known end of the list and
+# must contain the last known record, otherwise records before it were deleted (positions moved) and the overlap grows
+def fetch_kyc_tail(kyc_settings, rate_limiter, list_size, last_record_id):
+    overlap = kyc_settings.get("BATCH_SIZE", 20)
+
+    while True:
+        start_skip = max(0, list_size - overlap)
+        df_tail = fetch_kyc_pages(kyc_settings, rate_limiter, "", start_skip)
+
+        if last_record_id is None or start_skip == 0 or last_record_id in df_tail["recordId"].values:
+            return df_tail, start_skip + len(df_tail)
+
+        print()
+        print(f"** Last known KYC record isn't in the last {overlap} records anymore, fetching more of the list")
+
+        overlap *= 4
+
+
+# Decided records (e.g. approvals) can still be revoked, a slice of the whole list is fetched again on each sync
+# and the next sync continues after it, so every record is checked again within (records / slice) syncs
+def fetch_kyc_recheck_slice(kyc_settings, rate_limiter, recheck_skip):
+    batch_size = kyc_settings.get("BATCH_SIZE", 20)
+    page_count = kyc_settings.get("RECHECK_PAGES", 10)
+
+    if page_count <= 0: return pd.DataFrame(columns=KYC_RAW_COLUMNS), 0
+
+    df_slice = fetch_kyc_pages(kyc_settings, rate_limiter, "", recheck_skip, page_count)
+
+    # the end of the list was reached, the next slice starts from the beginning
+    next_skip = recheck_skip + len(df_slice) if len(df_slice) == page_count * batch_size else 0
+
+    return df_slice, next_skip
+
+
+def fetch_kyc_records_by_refid(kyc_settings, rate_limiter, ref_ids):
+    concurrency = kyc_settings.get("MAX_CONCURRENCY", 4)
+
+    def fetch_record(ref_id):
+        rate_limiter.acquire()
+
+        # a failed lookup keeps the local record, it is retried on the next sync
+        try:
+            return getRecordByRefId(kyc_settings["CLIENT_ID"], kyc_settings["API_URL"], kyc_settings["API_KEY"], ref_id)
+        except requests.exceptions.RequestException:
+            return None
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        records = [record for record in executor.map(fetch_record, ref_ids) if record]
+
+    if len(records) == 0:
+        return pd.DataFrame(columns=KYC_RAW_COLUMNS)
+
+    return normalize_kyc_records(pd.DataFrame(records))
+
+
+def load_kyc_sync_state(kyc_state_filename):
+    kyc_state_file = find_file(kyc_state_filename)
+
+    if kyc_state_file is None: return {}
+
+    try:
+        with open(kyc_state_file, "r") as json_file:
+            return json.load(json_file)
+    except ValueError:
+        return {}
+
+
+def load_raw_kyc_export(raw_kyc_export_filename):
+    raw_kyc_export_file = find_file(raw_kyc_export_filename)
+
+    if raw_kyc_export_file is None: return None
+
+    df_raw_kyc = pd.read_csv(raw_kyc_export_file, dtype=str, keep_default_na=False)
+
+    # older exports were saved with an unnamed index column
+    df_raw_kyc = df_raw_kyc.loc[:, ~df_raw_kyc.columns.str.startswith("Unnamed")]
+
+    if "recordId" not in df_raw_kyc.columns: return None
+
+    return normalize_kyc_records(df_raw_kyc)
+
+
 def fetch_kyc_data(kyc_settings, kyc_export_filename):
     api_url = kyc_settings["API_URL"]
     api_key = kyc_settings["API_KEY"]
@@ -692,55 +1115,85 @@ def fetch_kyc_data(kyc_settings, kyc_export_filename):
     print()
     print("* Checking KYC data")
 
-    kyc_export_file = find_file(kyc_export_filename)
+    raw_kyc_export_filename = path.join(path.dirname(kyc_export_filename), f"Raw_{path.basename(kyc_export_filename)}")
+    kyc_state_filename = kyc_export_filename.replace(".csv", "_SYNC_STATE.json")
 
-    depreciation_period_in_hours = 12
-    kyc_data_is_old = download_file_again(kyc_export_file, depreciation_period_in_hours)
+    full_sync_period_in_hours = kyc_settings.get("FULL_SYNC_HOURS", 168)
+    pending_statuses = kyc_settings.get("PENDING_STATUSES", ["waiting", "inreview"])
 
-    if kyc_data_is_old:
-        print(f"** Last KYC data download was more than {depreciation_period_in_hours} hours ago, need to download again")
-        print("** Fetching KYC data from provider")
-    else:
-        print(f"** Last KYC data download was less than {depreciation_period_in_hours} hours ago, no need to download again")
-        return
+    rate_limiter = RateLimiter(kyc_settings.get("REQUESTS_PER_SECOND", 5), api_url)
 
-    df_kyc = pd.DataFrame(index=None)
+    sync_state = load_kyc_sync_state(kyc_state_filename)
+    df_raw_kyc = load_raw_kyc_export(raw_kyc_export_filename)
 
-    batchSize = 20
-    skippedRecords = 0
+    sync_time = int(time())
+    last_full_sync = sync_state.get("LAST_FULL_SYNC", 0)
 
-    while True:
-        try:
-            userBatch = getRecords(client_ID, api_url, api_key, "", batchSize, skippedRecords)
-            if not userBatch or userBatch is None: break
-        except:
-            break
+    # end of the provider's list (position and last record) and the start of the next recheck slice
+    list_size = sync_state.get("LIST_SIZE", 0 if df_raw_kyc is None else len(df_raw_kyc))
+    last_record_id = sync_state.get("LAST_RECORD_ID")
+    recheck_skip = sync_state.get("RECHECK_SKIP", 0)
 
-        df_userBatch = pd.DataFrame(userBatch, index=None)
-        
-        df_kyc = pd.concat([df_kyc, df_userBatch], ignore_index=True)
-        skippedRecords += len(df_userBatch)
+    full_sync = df_raw_kyc is None or df_raw_kyc.empty or (sync_time - last_full_sync) > full_sync_period_in_hours * 3600
 
-        print("** Fetched", skippedRecords, "records", end='\r')
-    
-    df_kyc.fillna('', inplace=True)
+    try:
+        if full_sync:
+            print("** Fetching all KYC records from provider")
 
-    if "identities" in df_kyc.columns:
-        necessary_kyc_columns = ['refId', 'wallet', 'status', 'recordId', 'blockPassID', 'inreviewDate', 'waitingDate', 'approvedDate']
-        
-        df_kyc['wallet'] = df_kyc["identities"].apply(lambda x: x.get('crypto_address_eth').get("value"))
-    else:
-        necessary_kyc_columns = ['refId', 'status', 'recordId', 'blockPassID', 'inreviewDate', 'waitingDate', 'approvedDate']
-    
-    df_kyc = df_kyc[necessary_kyc_columns]
-    
-    df_to_csv(df_kyc, f"Raw_{kyc_export_filename}", '', ',')
+            df_raw_kyc = fetch_kyc_pages(kyc_settings, rate_limiter)
+            last_full_sync = sync_time
+
+            list_size = len(df_raw_kyc)
+            last_record_id = df_raw_kyc["recordId"].iloc[-1] if list_size > 0 else None
+            recheck_skip = 0
+
+            print()
+            print(f"** Fetched {len(df_raw_kyc)} records")
+        else:
+            print("** Fetching new and changed KYC records from provider")
+
+            df_tail, list_size = fetch_kyc_tail(kyc_settings, rate_limiter, list_size, last_record_id)
+
+            if len(df_tail) > 0:
+                last_record_id = df_tail["recordId"].iloc[-1]
+
+            df_recheck, recheck_skip = fetch_kyc_recheck_slice(kyc_settings, rate_limiter, recheck_skip)
+
+            list_df_changes = [df_tail, df_recheck]
+
+            # records that can still change status
+            for status in pending_statuses:
+                list_df_changes.append(fetch_kyc_pages(kyc_settings, rate_limiter, status))
+
+            df_changes = pd.concat(list_df_changes, ignore_index=True)
+
+            # locally pending records that are not pending anymore, fetch their current state one by one
+            locally_pending = df_raw_kyc[df_raw_kyc["status"].str.lower().str.strip().isin(pending_statuses)]
+            resolved_ref_ids = locally_pending.loc[~locally_pending["recordId"].isin(df_changes["recordId"]), "refId"]
+            resolved_ref_ids = [x for x in resolved_ref_ids.unique() if x]
+
+            if len(resolved_ref_ids) > 0:
+                df_changes = pd.concat([df_changes, fetch_kyc_records_by_refid(kyc_settings, rate_limiter, resolved_ref_ids)], ignore_index=True)
+
+            print()
+            print(f"** Fetched {len(df_changes)} new or changed records")
+
+            df_raw_kyc = pd.concat([df_raw_kyc, df_changes], ignore_index=True)
+    except Exception as err:
+        print()
+        print(f"! Error: KYC sync failed, keeping the previous KYC export -> {err}")
+        return
+
+    # latest version of each record wins
+    df_raw_kyc = df_raw_kyc.drop_duplicates(subset=["recordId"], keep="last").set_index("recordId")
+
+    df_to_csv(df_raw_kyc, raw_kyc_export_filename, 'recordId', ',')
+
+    df_kyc = df_raw_kyc.reset_index()[KYC_RAW_COLUMNS]
 
     df_kyc['status'] = df_kyc['status'].str.lower().str.strip()
     df_kyc["refId"] = df_kyc["refId"].apply(checkAddress)
-
-    if "wallet" in df_kyc.columns:
-        df_kyc["wallet"] = df_kyc["wallet"].apply(checkAddress)
+    df_kyc["wallet"] = df_kyc["wallet"].apply(checkAddress)
 
     print()
 
@@ -762,90 +1215,253 @@ def fetch_kyc_data(kyc_settings, kyc_export_filename):
     df_to_csv(df_kyc, kyc_export_filename, 'refId', ',')
     print("*** Saved as:", kyc_export_filename)
 
+    with open(kyc_state_filename, "w") as json_file:
+        json.dump({
+            "LAST_SYNC": sync_time, "LAST_FULL_SYNC": last_full_sync, "RECORD_COUNT": len(df_kyc),
+            "LIST_SIZE": list_size, "LAST_RECORD_ID": last_record_id, "RECHECK_SKIP": recheck_skip,
+        }, json_file, indent=4)
 
-def call_backend_api(api_url, api_key):
 
-    headers = {
+def backend_headers(api_key):
+    return {
         "x-seedify-api-header": api_key,
         'Origin': "https://seedify.fund",
         # 'Origin': "https://stage.develophub.network",
+        "Accept-Encoding": "gzip",
     }
 
-    result = make_http_request(api_url, target_key=None, parameters=None, headers=headers)
+# Validators of a previous response, sent back to get a 304 when the export didn't change
+def conditional_headers(validators):
+    headers = {}
 
-    if not result: return None
+    if not validators: return headers
 
-    return result["data"]
+    if validators.get("ETag"):
+        headers["If-None-Match"] = validators["ETag"]
+
+    if validators.get("Last-Modified"):
+        headers["If-Modified-Since"] = validators["Last-Modified"]
+
+    return headers
+
+def response_validators(response):
+    return {key: response.headers[key] for key in ("ETag", "Last-Modified") if response.headers.get(key)}
+
+def append_export_batch(columns, batch, address_fields, unique_field, seen_values):
+    fields = list(columns)
+
+    # canonicalize each distinct address of the batch once
+    for field in address_fields:
+        index = fields.index(field)
+        canonical = {value: checkAddress(value) for value in set(row[index] for row in batch)}
+
+        batch = [row[:index] + (canonical[row[index]],) + row[index + 1:] for row in batch]
+
+    unique_index = fields.index(unique_field) if unique_field else None
+
+    for row in batch:
+        if unique_index is not None:
+            if row[unique_index] in seen_values: continue
+            seen_values.add(row[unique_index])
 
-def fetch_registration_data(project_id, api_url, api_key):
+        for field, value in zip(fields, row):
+            columns[field].append(value)
+
+# Streams the "data" records of a backend export and keeps only the given fields, without loading the whole response
+# Records with a missing required field are skipped, only the first record of each unique_field value is kept
+# Returns (None, None, validators) when the server confirms that the export didn't change since the given validators
+def stream_backend_export(api_url, api_key, fields, required_fields=(), address_fields=(), unique_field=None, validators=None):
+    session = createRequestSession()
+
+    headers = {**backend_headers(api_key), **conditional_headers(validators)}
+
+    timeout = 30
+    retry_policy = RetryPolicy(api_url)
+
+    while True:
+        columns = {field: [] for field in fields}
+        top_level_values = {}
+        seen_values = set()
+        batch = []
+        retry_after = None
+
+        retry_policy.check()
+
+        try:
+            with session.get(api_url, headers=headers, timeout=timeout, stream=True) as response:
+                if response.status_code == 304:
+                    retry_policy.success()
+                    return None, None, validators
+
+                response.raise_for_status()
+
+                chunks = response.iter_content(chunk_size=BACKEND_STREAM_CHUNK_SIZE)
+
+                for record in iter_json_array(chunks, "data", top_level_values):
+                    if any(record.get(field) is None for field in required_fields): continue
+
+                    batch.append(tuple(record.get(field) for field in fields))
+
+                    if len(batch) >= BACKEND_STREAM_BATCH_SIZE:
+                        append_export_batch(columns, batch, address_fields, unique_field, seen_values)
+                        batch = []
+
+                append_export_batch(columns, batch, address_fields, unique_field, seen_values)
+
+                retry_policy.success()
+
+                return columns, top_level_values, response_validators(response)
+        except requests.exceptions.HTTPError as ex:
+            if not retry_policy.is_retryable_status(ex.response.status_code):
+                print(f"Error: {ex}. Not retrying.")
+                retry_policy.fatal()
+                raise
+
+            retry_after = parse_retry_after(ex.response.headers.get("Retry-After"))
+            print(f"Error: {ex}. Retrying... ({retry_policy.retry + 1}/{retry_policy.max_retries})")
+        except (requests.exceptions.RequestException, ValueError) as ex:
+            record_error(api_url)
+            print(f"Error: {type(ex).__name__} occurred: {ex}. Retrying... ({retry_policy.retry + 1}/{retry_policy.max_retries})")
+
+        if not retry_policy.failed(retry_after):
+            print("Max retries reached. Halting script.")
+            raise requests.exceptions.RequestException("Max retries reached. Cannot fetch data.")
+
+def backend_cache_filenames(cache_dir, export_name):
+    return path.join(cache_dir, f"{export_name}.csv"), path.join(cache_dir, f"{export_name}_Validators.json")
+
+# Previously parsed copy of a backend export and the validators of the response it was parsed from
+def load_backend_export_cache(cache_dir, export_name, api_url):
+    if cache_dir is None: return None, {}
+
+    cache_filename, validators_filename = backend_cache_filenames(cache_dir, export_name)
+
+    if find_file(validators_filename) is None or find_file(cache_filename) is None: return None, {}
+
+    try:
+        with open(validators_filename, "r") as json_file:
+            cache_state = json.load(json_file)
+    except ValueError:
+        return None, {}
+
+    if cache_state.get("URL") != api_url: return None, {}
+
+    return cache_filename, cache_state
+
+def save_backend_export_cache(cache_dir, export_name, api_url, df_export, index_label, validators, top_level_values):
+    if cache_dir is None: return
+    if not validators: return
+
+    cache_filename, validators_filename = backend_cache_filenames(cache_dir, export_name)
+
+    df_to_csv(df_export, cache_filename, index_label, ',')
+
+    cache_state = {
+        "URL": api_url,
+        **validators,
+        "TOP_LEVEL": {key: value for key, value in top_level_values.items() if not isinstance(value, (dict, list))},
+        "ROWS": len(df_export),
+    }
+
+    with open(validators_filename, "w") as json_file:
+        json.dump(cache_state, json_file, indent=4)
+
+def fetch_registration_data(project_id, api_url, api_key, cache_dir=None):
     if api_url is None: return pd.DataFrame(), None
 
-    registered_wallets = None
-    project_name = None  
+    print("* Fetching IDO registration data")
 
     full_api_url = f"{api_url}/igo/{project_id}/interest/export?type=json"
+    export_name = f"Backend_Registration_Export_{project_id}"
 
-    json_registered = call_backend_api(full_api_url, api_key)
+    cache_filename, cache_state = load_backend_export_cache(cache_dir, export_name, full_api_url)
 
-    registered_wallets = json_registered["data"]
+    registered_wallets, top_level_values, validators = stream_backend_export(
+        full_api_url, api_key,
+        fields=["primaryWallet"],
+        address_fields=["primaryWallet"],
+        unique_field="primaryWallet",
+        validators=cache_state if cache_filename else None,
+    )
 
-    if "idoName" in json_registered.keys():
-        project_name = json_registered["idoName"]
+    if registered_wallets is None:
+        print(f"** Registration data didn't change, using {cache_filename}")
+        increment("backend_exports_not_modified")
 
-    # project_id = json_registered["igoId"]
+        df_registered_unique = pd.read_csv(cache_filename, dtype=object).set_index('primaryWallet')
+        add_rows(len(df_registered_unique))
 
-    df_registered = pd.DataFrame(registered_wallets)
+        return df_registered_unique, cache_state.get("TOP_LEVEL", {}).get("idoName")
 
-    if df_registered.empty: return pd.DataFrame()
-    
-    df_registered["primaryWallet"] = df_registered["primaryWallet"].apply(checkAddress)
-    # df_registered["delegatedWallet"] = df_registered["delegatedWallet"].apply(checkAddress)
-    
-    unique_wallets = df_registered['primaryWallet'] \
+    project_name = top_level_values.get("idoName")
+
+    # project_id = top_level_values["igoId"]
+
+    add_rows(len(registered_wallets["primaryWallet"]))
+
+    if not registered_wallets["primaryWallet"]: return pd.DataFrame(), project_name
+
+    unique_wallets = pd.Series(registered_wallets["primaryWallet"], dtype=object) \
                          .replace('', pd.NA) \
                          .dropna() \
-                         .drop_duplicates() \
                          .reset_index(drop=True)
-                        #  .str.lower().str.strip() \
-    
+
     df_registered_unique = pd.DataFrame(unique_wallets, columns=['primaryWallet'])
 
     # Set primaryWallet as index
     df_registered_unique.set_index('primaryWallet', inplace=True)
 
+    save_backend_export_cache(cache_dir, export_name, full_api_url, df_registered_unique, 'primaryWallet', validators, top_level_values)
+
     return df_registered_unique, project_name
 
-def fetch_wallet_delegation_data(api_url, api_key):
+def fetch_wallet_delegation_data(api_url, api_key, cache_dir=None):
     if api_url is None: return pd.DataFrame()
 
+    print("* Fetching wallet delegation data")
+
     full_api_url = f"{api_url}/user/export?type=json"
+    export_name = "Backend_User_Export"
 
-    json_wallet_delegation = call_backend_api(full_api_url, api_key)
-    wallet_delegation = json_wallet_delegation["data"]
+    cache_filename, cache_state = load_backend_export_cache(cache_dir, export_name, full_api_url)
 
-    df_wallet_delegation = pd.DataFrame(wallet_delegation)
+    # the user export holds every platform user, only the wallet pairs are kept
+    wallet_delegation, top_level_values, validators = stream_backend_export(
+        full_api_url, api_key,
+        fields=["primaryWallet", "delegatedWallet"],
+        required_fields=["primaryWallet", "delegatedWallet"],
+        address_fields=["primaryWallet", "delegatedWallet"],
+        unique_field="primaryWallet",
+        validators=cache_state if cache_filename else None,
+    )
 
-    if df_wallet_delegation.empty: return pd.DataFrame()
+    if wallet_delegation is None:
+        print(f"** Wallet delegation data didn't change, using {cache_filename}")
+        increment("backend_exports_not_modified")
 
-    df_wallet_delegation.dropna(subset=['delegatedWallet'], inplace=True)
-    df_wallet_delegation.dropna(subset=['primaryWallet'], inplace=True)
+        df_wallet_delegation = pd.read_csv(cache_filename, dtype=object).set_index('primaryWallet')
+        add_rows(len(df_wallet_delegation))
 
-    df_wallet_delegation["primaryWallet"] = df_wallet_delegation["primaryWallet"].apply(checkAddress)
-    df_wallet_delegation["delegatedWallet"] = df_wallet_delegation["delegatedWallet"].apply(checkAddress)
+        return df_wallet_delegation
 
-    df_wallet_delegation.drop_duplicates(subset=['primaryWallet'], keep='first', inplace=True)
+    add_rows(len(wallet_delegation["primaryWallet"]))
+
+    if not wallet_delegation["primaryWallet"]: return pd.DataFrame()
+
+    df_wallet_delegation = pd.DataFrame(wallet_delegation, dtype=object)
 
     df_wallet_delegation.set_index('primaryWallet', inplace=True)
 
+    save_backend_export_cache(cache_dir, export_name, full_api_url, df_wallet_delegation, 'primaryWallet', validators, top_level_values)
+
     return df_wallet_delegation
 
 
 def getRecords(CLIENT_ID_, API_URL_, API_KEY_, status_="", batchSize_=20, skip_=0):
 
     apiURL = f"{API_URL_}/{CLIENT_ID_}/applicants/{status_}"
-    # apiURL = f"{API_URL_}/{CLIENT_ID_}/refId/{wallet}"}
 
-    header = {"Authorization":API_KEY_, "cache-control":"no-cache"}
+    header = {"Authorization":API_KEY_, "cache-control":"no-cache", "Accept-Encoding":"gzip"}
     params = {"limit":batchSize_, "skip":skip_}
 
     result = make_http_request(apiURL, target_key="data", parameters=params, headers=header)
@@ -857,8 +1473,22 @@ def getRecords(CLIENT_ID_, API_URL_, API_KEY_, status_="", batchSize_=20, skip_=
     return result_data
 
 
+def getRecordByRefId(CLIENT_ID_, API_URL_, API_KEY_, refId_):
+
+    apiURL = f"{API_URL_}/{CLIENT_ID_}/refId/{refId_}"
+
+    header = {"Authorization":API_KEY_, "cache-control":"no-cache", "Accept-Encoding":"gzip"}
+
+    result = make_http_request(apiURL, target_key="data", parameters=None, headers=header)
+
+    if result is None or not isinstance(result["data"], dict): return None
+
+    return result["data"]
+
+
 def setRPC(RPC_LIST, LAST_RPC_INDEX):
     CURRENT_RPC_INDEX = LAST_RPC_INDEX
+    failed_nodes = 0
 
     while True:
         CURRENT_RPC_INDEX = (CURRENT_RPC_INDEX + 1) % len(RPC_LIST)
@@ -866,20 +1496,27 @@ def setRPC(RPC_LIST, LAST_RPC_INDEX):
 
         web3 = web3Connection(CURRENT_RPC)
 
-        if web3 is None: continue
+        if web3 is None:
+            failed_nodes += 1
+
+            # all nodes are down, back off before the next round
+            if failed_nodes % len(RPC_LIST) == 0:
+                wait(backoff_delay(get_retry_policy(CURRENT_RPC), failed_nodes // len(RPC_LIST)), CURRENT_RPC, "retry")
+
+            continue
 
         return web3, CURRENT_RPC_INDEX
     
 
 def createContractInstance(web3, contract_address, contract_abi):
-    contract_instance = web3.eth.contract(address=contract_address, abi=contract_abi)
+    contract_instance = get_contract(web3, contract_address, contract_abi)
     return contract_instance
 
 
-def delay_retry(error_count, delay):
+def delay_retry(error_count, delay, endpoint=None):
     if error_count > 0:
         print(f"Retrying in {delay / 1000} seconds.")
-        sleep(delay / 1000)
+        wait(delay / 1000, endpoint, "poll")
     else:
         print("Max attemps to retry reached, aborting")
 
@@ -890,8 +1527,11 @@ def notify_backend(target_url, snapshot_api_key, timestamp):
     session.keep_alive = 5
 
     retries_left = 60
-    critical_error_retries_left = 3
+    critical_error_retries = 3
     default_delay_retries_ms = 60000
+
+    # errors are retried with backoff (or the server's Retry-After), polls wait as long as the backend asks
+    retry_policy = RetryPolicy(target_url, max_retries=critical_error_retries - 1)
     
     headers = {
         "api-key": snapshot_api_key,
@@ -899,14 +1539,21 @@ def notify_backend(target_url, snapshot_api_key, timestamp):
     }
 
     success = False
-    while retries_left > 0 and critical_error_retries_left > 0 and not success:
+    while retries_left > 0 and not success:
+        response = None
+        retry_after = None
+
         try:
+            retry_policy.check()
+
             response = session.post(f"{target_url}/{timestamp}", params={}, headers=headers, timeout=60)
             
             response.raise_for_status()
             status = response.status_code
 
             if status in [200, 202]:
+                retry_policy.success()
+
                 data = response.json()
                 if status == 200 and data["status"] == "DONE":
                     success = True
@@ -918,28 +1565,37 @@ def notify_backend(target_url, snapshot_api_key, timestamp):
                     
                     suggested_delay_ms = data["checkAgainMs"] if data["checkAgainMs"] != None else default_delay_retries_ms
                     retries_left -= 1
-                    delay_retry(retries_left, suggested_delay_ms)
+                    delay_retry(retries_left, suggested_delay_ms, target_url)
+
+                continue
             else:
                 print(f"Error while saving snapshot information, response code: {status}")
                 data = response.json()
                 if data["msg"] != None:
                     print(f"Error details: {data['msg']}")
 
-                critical_error_retries_left -= 1
-                delay_retry(critical_error_retries_left, default_delay_retries_ms)
-            
+        except CircuitOpenError as ex:
+            print(f"\n! Error: {ex}, the backend is not notified")
+            break
         except requests.exceptions.RequestException as ex:
             print(f"\nAn exception of type {type(ex).__name__} occurred: {ex}")
 
             if response is not None:
                 print(f"Request response: {response.content}")
+
+                if not retry_policy.is_retryable_status(response.status_code):
+                    # the request is rejected (e.g. wrong API key), repeating it won't help
+                    retry_policy.fatal()
+                    break
+
+                retry_after = parse_retry_after(response.headers.get("Retry-After"))
             else:
                 print("No response received.")
 
-
-            critical_error_retries_left -= 1
-            delay_retry(critical_error_retries_left, default_delay_retries_ms)
+        if not retry_policy.failed(retry_after):
+            print("Max attemps to retry reached, aborting")
+            break
     
     session.close()
     
-    return success
\ No newline at end of file
+    return success
@@ -0,0 +1,288 @@
+from os import path
+from time import sleep, time
+
+from .utils import (
+    initialize_token, checkAddress, set_snapshot_timestamps, adjust_snapshot_date,
+    current_datetime_in_utc, date_to_str, timestamp_to_date_str, create_network_settings,
+    cache_lock, get_required_s3_prefixes
+)
+from .fetch import fetch_pool_txns, fetch_lp_history, fetch_kyc_data, epochToBlockNumber, get_snapshot_block_number
+from .s3 import s3_download_all, s3_download_selected, s3_upload_files, s3_upload_specific_folders, enable_lazy_hydration
+from .apikeys import load_key_usage, save_key_usage
+from .providers import close_providers
+from .blocks import load_block_cache, is_final, DEFAULT_FINALITY_SECONDS
+from .coverage import load_coverage, missing_intervals, format_intervals
+
+
+DEFAULT_FOLLOW_SETTINGS = {
+    "INTERVAL_MINUTES": 10,
+    # txns and LP values are fetched up to the block of (now - FINALITY_SECONDS)
+    "FINALITY_SECONDS": DEFAULT_FINALITY_SECONDS,
+    "KYC_SYNC": True,
+}
+
+
+# Cache files of the target tokens (the rest is fetched on demand), explorer key usage and snapshot blocks
+def download_caches(settings, main_dir, data_dir, output_dir, all_tokens_dict, target_tokens_list, network_list, target_pools, s3_bucket):
+    if settings.get("S3_FULL_DOWNLOAD"):
+        s3_download_all(s3_bucket, main_dir)
+    else:
+        s3_prefixes = get_required_s3_prefixes(main_dir, data_dir, output_dir, None, target_tokens_list, all_tokens_dict, network_list, target_pools)
+        s3_download_selected(s3_bucket, main_dir, s3_prefixes)
+
+    enable_lazy_hydration(s3_bucket, main_dir)
+
+    load_key_usage(data_dir)
+    load_block_cache(data_dir)
+
+
+# (pool, target token) pairs of a network, in the same order as the snapshot run
+def get_follow_pools(all_tokens_dict, all_tokens_list, token_name, network, token_contract, lp_contract, stakes, farms, target_pools):
+    pools = []
+
+    if target_pools == "farm" or target_pools == "all":
+        pools += [(pool, lp_contract) for pool in farms]
+
+    if target_pools == "stake" or target_pools == "all":
+        pools += [(pool, token_contract) for pool in stakes]
+
+    if target_pools == "farm" or target_pools == "all":
+        for other_token_name in all_tokens_list:
+            if other_token_name == token_name: continue
+            if not network in all_tokens_dict[other_token_name].keys(): continue
+
+            other_token_details = all_tokens_dict[other_token_name][network]
+            other_lp_contract = checkAddress(other_token_details["lp_contract"])
+
+            if other_lp_contract is None: continue
+
+            pools += [(pool, other_lp_contract) for pool in other_token_details["farm"]]
+
+    return pools
+
+
+def follow_network(settings, data_dir, all_tokens_dict, all_tokens_list, token_name, network, target_pools, snapshot_timestamps, finality_seconds):
+    print()
+    print("-"*10)
+    print()
+    print(f"* Refreshing {token_name} caches on {network} chain")
+
+    temp_settings = create_network_settings(settings, network)
+
+    token_dir, token_contract, lp_contract, stakes, farms = initialize_token(data_dir, all_tokens_dict, token_name, network)
+
+    temp_settings["TOKEN_DIR"] = token_dir
+    temp_settings["FINALITY_SECONDS"] = finality_seconds
+
+    token_contract = checkAddress(token_contract)
+    lp_contract = checkAddress(lp_contract)
+
+    # ------------------------------
+
+    # last block that won't be reorganized anymore, txns after it are fetched in the next cycle
+    final_timestamp = int(time()) - finality_seconds
+    final_block = epochToBlockNumber(final_timestamp, temp_settings, "before")
+
+    temp_settings["SNAPSHOT_BLOCK_NUMBER"] = final_block
+
+    print(f"** Final block: {final_block} ({timestamp_to_date_str(final_timestamp)})")
+
+    # block of the latest snapshot is cached as soon as it is final
+    snapshot_timestamp = int(snapshot_timestamps[-1])
+
+    if is_final(snapshot_timestamp, finality_seconds):
+        temp_settings["SNAPSHOT_TIMESTAMP"] = snapshot_timestamp
+        snapshot_block = get_snapshot_block_number(snapshot_timestamp, temp_settings)
+
+        print(f"** Snapshot block: {snapshot_block} ({timestamp_to_date_str(snapshot_timestamp)})")
+
+    # ------------------------------
+
+    pools = get_follow_pools(all_tokens_dict, all_tokens_list, token_name, network, token_contract, lp_contract, stakes, farms, target_pools)
+
+    # LP values of the snapshot timestamps that are already final
+    final_snapshot_timestamps = snapshot_timestamps[snapshot_timestamps <= final_timestamp]
+
+    if len(final_snapshot_timestamps) > 0:
+        for target_lp_contract in dict.fromkeys(target_token for pool, target_token in pools if target_token != token_contract):
+            fetch_lp_history(target_lp_contract, token_contract, final_snapshot_timestamps, temp_settings)
+
+    txn_count = 0
+
+    for pool, target_token in pools:
+        pool_name, pool_contract, pool_multiplier = pool
+
+        print()
+        print("Pool:", pool_name)
+
+        df_pool_txns = fetch_pool_txns((pool_name, checkAddress(pool_contract), pool_multiplier, None, target_token, None), temp_settings)
+
+        if df_pool_txns is not None:
+            txn_count += len(df_pool_txns)
+
+    print()
+    print(f"** {token_name} caches on {network} chain are up to date until block {final_block} ({txn_count} pool txns)")
+
+
+def follow_cycle(settings, data_dir, all_tokens_dict, target_tokens_list, all_tokens_list, network_list, target_pools, snapshot_time, s3_bucket, kyc_export_filename, follow_settings):
+    # the latest snapshot moves on to the next day once its time has passed
+    snapshot_datetime = adjust_snapshot_date(current_datetime_in_utc(), snapshot_time)
+    snapshot_timestamps = set_snapshot_timestamps(snapshot_datetime, settings["DAILY_EPOCH_DIFF"], settings["SSP_PERIOD"])
+
+    print("** Latest snapshot:", date_to_str(snapshot_datetime))
+
+    failed_networks = []
+
+    for token_name in target_tokens_list:
+        for network in network_list:
+            if not network in all_tokens_dict[token_name].keys(): continue
+
+            # a failing network doesn't keep the other networks from being refreshed
+            try:
+                follow_network(settings, data_dir, all_tokens_dict, all_tokens_list, token_name, network, target_pools, snapshot_timestamps, follow_settings["FINALITY_SECONDS"])
+            except Exception as ex:
+                print(f"! Error: Couldn't refresh {token_name} caches on {network} chain, trying again in the next cycle -> {ex}")
+                failed_networks.append(f"{token_name}:{network}")
+
+    if follow_settings["KYC_SYNC"] and "SFUND" in target_tokens_list:
+        print()
+        print("-"*10)
+        print()
+
+        fetch_kyc_data(settings["KYC"], kyc_export_filename)
+
+    s3_upload_specific_folders(s3_bucket, [data_dir], "")
+
+    return failed_networks
+
+
+def follow(settings, main_dir, data_dir, output_dir, all_tokens_dict, target_tokens_list, all_tokens_list, network_list, target_pools, snapshot_time, s3_bucket, kyc_export_filename):
+    follow_settings = {**DEFAULT_FOLLOW_SETTINGS, **settings.get("FOLLOW", {})}
+    interval = follow_settings["INTERVAL_MINUTES"] * 60
+
+    print()
+    print(f"* Follow mode: refreshing caches every {follow_settings['INTERVAL_MINUTES']} minutes, stop with Ctrl+C")
+
+    download_caches(settings, main_dir, data_dir, output_dir, all_tokens_dict, target_tokens_list, network_list, target_pools, s3_bucket)
+
+    cycle = 0
+
+    try:
+        while True:
+            cycle += 1
+            cycle_start = time()
+
+            print()
+            print("#"*20)
+            print()
+            print(f"* Follow cycle {cycle} ({date_to_str(current_datetime_in_utc())} UTC)")
+
+            # the snapshot run waits for the cycle to finish (and the other way round)
+            try:
+                with cache_lock(data_dir):
+                    failed_networks = follow_cycle(
+                        settings, data_dir, all_tokens_dict, target_tokens_list, all_tokens_list, network_list,
+                        target_pools, snapshot_time, s3_bucket, kyc_export_filename, follow_settings
+                    )
+
+                if failed_networks:
+                    print(f"! Error: Follow cycle {cycle} couldn't refresh {', '.join(failed_networks)}")
+            except Exception as ex:
+                print(f"! Error: Follow cycle {cycle} failed, trying again in the next cycle -> {ex}")
+
+            save_key_usage()
+
+            cycle_seconds = time() - cycle_start
+
+            print()
+            print(f"** Follow cycle {cycle} took {cycle_seconds:.1f} seconds, next one in {max(0, interval - cycle_seconds) / 60:.1f} minutes")
+
+            sleep(max(0, interval - cycle_seconds))
+    except KeyboardInterrupt:
+        print()
+        print("* Follow mode stopped")
+    finally:
+        save_key_usage()
+        close_providers()
+
+
+# Covered and missing block ranges of the txn caches up to the snapshot block, only the missing ranges are fetched
+def verify_caches(settings, main_dir, data_dir, output_dir, all_tokens_dict, target_tokens_list, all_tokens_list, network_list, target_pools, snapshot_timestamp, s3_bucket):
+    print()
+    print("* Verifying txn caches")
+
+    download_caches(settings, main_dir, data_dir, output_dir, all_tokens_dict, target_tokens_list, network_list, target_pools, s3_bucket)
+
+    checked_pools = 0
+    found_gaps = 0
+    left_gaps = 0
+
+    try:
+        for token_name in target_tokens_list:
+            for network in network_list:
+                if not network in all_tokens_dict[token_name].keys(): continue
+
+                print()
+                print("-"*10)
+                print()
+                print(f"* {token_name} txn caches on {network} chain")
+
+                temp_settings = create_network_settings(settings, network)
+
+                token_dir, token_contract, lp_contract, stakes, farms = initialize_token(data_dir, all_tokens_dict, token_name, network)
+
+                temp_settings["TOKEN_DIR"] = token_dir
+                temp_settings["SNAPSHOT_TIMESTAMP"] = snapshot_timestamp
+                temp_settings["SNAPSHOT_BLOCK_NUMBER"] = get_snapshot_block_number(snapshot_timestamp, temp_settings)
+
+                end_block = temp_settings["SNAPSHOT_BLOCK_NUMBER"]
+
+                print(f"** Snapshot block: {end_block} ({timestamp_to_date_str(snapshot_timestamp)})")
+
+                pools = get_follow_pools(all_tokens_dict, all_tokens_list, token_name, network, checkAddress(token_contract), checkAddress(lp_contract), stakes, farms, target_pools)
+
+                for pool, target_token in pools:
+                    pool_name, pool_contract, pool_multiplier = pool
+                    pool_contract = checkAddress(pool_contract)
+
+                    txn_export_file_name = path.join(token_dir, f"{pool_contract}.csv")
+
+                    print()
+                    print("Pool:", pool_name)
+
+                    covered_blocks = load_coverage(txn_export_file_name)
+
+                    if covered_blocks is None:
+                        print("** No coverage manifest, the cache is trusted up to its last block")
+                    else:
+                        gaps = [gap for gap in missing_intervals(covered_blocks, 0, end_block) if covered_blocks and gap[1] < covered_blocks[-1][1]]
+
+                        print(f"** Covered blocks: {format_intervals(covered_blocks) or 'none'}")
+
+                        if gaps:
+                            print(f"** ! Gaps: {format_intervals(gaps)}")
+                            found_gaps += len(gaps)
+
+                    fetch_pool_txns((pool_name, pool_contract, pool_multiplier, None, target_token, None), temp_settings)
+
+                    covered_blocks = load_coverage(txn_export_file_name) or []
+                    missing_blocks = missing_intervals(covered_blocks, 0, end_block)
+
+                    # blocks after the cache are unconfirmed txns (or a failed page, reported by the fetch)
+                    gaps = [gap for gap in missing_blocks if covered_blocks and gap[1] < covered_blocks[-1][1]]
+
+                    if gaps:
+                        print(f"** ! Gaps left: {format_intervals(gaps)}")
+                        left_gaps += len(gaps)
+
+                    checked_pools += 1
+
+                s3_upload_files(s3_bucket, main_dir, [token_dir])
+    finally:
+        save_key_usage()
+        close_providers()
+
+    print()
+    print("-"*10)
+    print()
+    print(f"* Verified {checked_pools} txn caches: {found_gaps} gaps found, {left_gaps} gaps left")
@@ -0,0 +1,201 @@
+import threading
+
+from math import ceil
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait as wait_futures
+from time import perf_counter
+
+from .metrics import increment, endpoint_name
+from .retry import get_circuit_breaker
+
+
+DEFAULT_HEDGE_SETTINGS = {
+    "ENABLED": False,
+    # a call is sent to a second node when it takes longer than this percentile of the previous calls
+    "PERCENTILE": 90,
+    # threshold (seconds) until MIN_SAMPLES latencies are known, and the lowest threshold after that
+    "DEFAULT_DELAY": 3,
+    "MIN_DELAY": 0.5,
+    "MIN_SAMPLES": 20,
+    # max. duplicate calls as a share of all calls (at least one)
+    "MAX_DUPLICATE_RATIO": 0.1,
+}
+
+# Latencies kept per node
+LATENCY_WINDOW = 200
+
+
+def percentile(values, p):
+    values = sorted(values)
+
+    return values[max(0, ceil(p / 100 * len(values)) - 1)]
+
+
+class RpcNode:
+
+    def __init__(self, url):
+        self.url = url
+        self.name = endpoint_name(url)
+        self.contract = None
+        self.breaker = get_circuit_breaker(url)
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.failures = 0
+        self.lock = threading.Lock()
+
+
+# Read-only RPC calls that are duplicated to the next-best node when the first node is slow,
+# the first valid answer is used and the other call is cancelled (or its answer discarded when it already started)
+class HedgedRpc:
+
+    def __init__(self, rpc_nodes, connect, hedge_settings=None):
+        self.settings = {**DEFAULT_HEDGE_SETTINGS, **(hedge_settings or {})}
+        self.nodes = [RpcNode(url) for url in rpc_nodes]
+        # connect(url) -> contract instance on that node, or None
+        self.connect = connect
+        self.executor = ThreadPoolExecutor(max_workers=2 * len(self.nodes), thread_name_prefix="hedge")
+        # time until the first valid answer of the previous calls
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.calls = 0
+        self.hedges = 0
+        self.lock = threading.Lock()
+
+    # contract instance of a node that is already connected
+    def set_contract(self, node_index, contract):
+        self.nodes[node_index % len(self.nodes)].contract = contract
+
+    def threshold(self):
+        with self.lock:
+            latencies = list(self.latencies)
+
+        if len(latencies) < self.settings["MIN_SAMPLES"]:
+            return self.settings["DEFAULT_DELAY"]
+
+        return max(self.settings["MIN_DELAY"], percentile(latencies, self.settings["PERCENTILE"]))
+
+    # median latency, nodes that failed recently come last
+    def score(self, node):
+        with node.lock:
+            latencies = list(node.latencies)
+            failures = node.failures
+
+        latency = percentile(latencies, 50) if latencies else self.settings["DEFAULT_DELAY"]
+
+        return (failures, latency)
+
+    # nodes with an open circuit are only used when no other node is left
+    def next_node(self, tried):
+        candidates = [node for node in self.nodes if node not in tried]
+        available = [node for node in candidates if not node.breaker.is_open()] or candidates
+
+        return min(available, key=self.score) if available else None
+
+    def run(self, node, func):
+        if node.contract is None:
+            with node.lock:
+                if node.contract is None:
+                    node.contract = self.connect(node.url)
+
+            if node.contract is None:
+                raise ConnectionError(f"RPC node {node.name} is not reachable")
+
+        start = perf_counter()
+
+        try:
+            result = func(node.contract)
+        except Exception:
+            with node.lock:
+                node.failures += 1
+
+            node.breaker.record_failure()
+            raise
+
+        with node.lock:
+            node.latencies.append(perf_counter() - start)
+            node.failures = 0
+
+        node.breaker.record_success()
+
+        if result is None:
+            raise ValueError(f"Empty result from RPC node {node.name}")
+
+        return result
+
+    def can_hedge(self):
+        with self.lock:
+            if self.hedges >= max(1, self.settings["MAX_DUPLICATE_RATIO"] * self.calls): return False
+
+            self.hedges += 1
+
+        return True
+
+    # func(contract) -> value, called on the primary node (index in rpc_nodes) and, if it is slow or fails, on the next-best node
+    def call(self, func, primary_index=0):
+        with self.lock:
+            self.calls += 1
+
+        increment("rpc_hedgeable_calls")
+
+        start = perf_counter()
+        primary = self.nodes[primary_index % len(self.nodes)]
+
+        if primary.breaker.is_open():
+            primary = self.next_node([primary]) or primary
+        tried = [primary]
+        futures = {self.executor.submit(self.run, primary, func): primary}
+        hedging = True
+        last_error = None
+
+        while futures:
+            timeout = self.threshold() if hedging and len(tried) < len(self.nodes) else None
+            done, _ = wait_futures(futures, timeout=timeout, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                node = futures.pop(future)
+
+                try:
+                    result = future.result()
+                except Exception as ex:
+                    last_error = ex
+                    continue
+
+                with self.lock:
+                    self.latencies.append(perf_counter() - start)
+
+                if node is not primary:
+                    increment("rpc_hedge_wins")
+
+                for other_future in futures:
+                    if other_future.cancel():
+                        increment("rpc_hedges_cancelled")
+                    else:
+                        increment("rpc_hedges_discarded")
+
+                return result
+
+            if len(tried) == len(self.nodes): continue
+
+            if not done:
+                # a slow call is duplicated only within the budget
+                if not self.can_hedge():
+                    increment("rpc_hedges_over_cap")
+                    hedging = False
+                    continue
+
+                increment("rpc_hedges")
+            elif futures:
+                # a call failed while another one is still running
+                continue
+
+            node = self.next_node(tried)
+            tried.append(node)
+            futures[self.executor.submit(self.run, node, func)] = node
+
+        raise last_error or ConnectionError("All RPC nodes failed")
+
+    def hedge_rate(self):
+        with self.lock:
+            return self.hedges / self.calls if self.calls else 0
+
+    def close(self):
+        # calls whose answers were discarded are left to finish in the background
+        self.executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,99 @@
+import json
+
+from os import path, remove, replace, fsync, truncate
+from time import monotonic
+
+from .utils import df_to_csv
+
+
+JOURNAL_EXTENSION = ".journal"
+
+# Records are flushed to the OS on every append (a killed process loses nothing),
+# fsync (power loss) happens once per this many records or seconds
+JOURNAL_SYNC_RECORDS = 50
+JOURNAL_SYNC_SECONDS = 5
+
+
+# Append-only log (JSON lines) of fetched records next to a cache file
+# Records are replayed by the next run when the journal wasn't compacted into the cache file
+class Journal:
+
+    def __init__(self, store_filename, sync_records=JOURNAL_SYNC_RECORDS, sync_seconds=JOURNAL_SYNC_SECONDS):
+        self.store_filename = store_filename
+        self.filename = store_filename + JOURNAL_EXTENSION
+        self.sync_records = sync_records
+        self.sync_seconds = sync_seconds
+        self.file = None
+        self.valid_size = None
+        self.unsynced = 0
+        self.last_sync = monotonic()
+
+    def read(self):
+        records = []
+        self.valid_size = 0
+
+        if not path.isfile(self.filename): return records
+
+        with open(self.filename, "rb") as f:
+            for line in f:
+                # a record cut off by a crash, everything before it is intact
+                if not line.endswith(b"\n"): break
+
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    break
+
+                self.valid_size += len(line)
+
+        return records
+
+    def append(self, record):
+        if self.file is None:
+            if self.valid_size is None: self.read()
+
+            # new records must not follow a partially written one
+            if path.isfile(self.filename) and path.getsize(self.filename) > self.valid_size:
+                truncate(self.filename, self.valid_size)
+
+            self.file = open(self.filename, "ab")
+
+        self.file.write(json.dumps(record, separators=(",", ":"), default=int).encode("utf-8") + b"\n")
+        self.file.flush()
+
+        self.unsynced += 1
+
+        if self.unsynced >= self.sync_records or monotonic() - self.last_sync >= self.sync_seconds:
+            self.sync()
+
+    def sync(self):
+        if self.file is None or self.unsynced == 0: return
+
+        fsync(self.file.fileno())
+
+        self.unsynced = 0
+        self.last_sync = monotonic()
+
+    def close(self):
+        if self.file is None: return
+
+        self.sync()
+        self.file.close()
+        self.file = None
+
+    def remove(self):
+        self.close()
+
+        if path.isfile(self.filename):
+            remove(self.filename)
+
+        self.valid_size = 0
+
+    # Writes the cache file in one step (a crash while writing leaves the old file and the journal), then drops the journal
+    def compact(self, df, index_label):
+        temp_filename = self.store_filename + ".tmp"
+
+        df_to_csv(df, temp_filename, index_label, ',')
+        replace(temp_filename, self.store_filename)
+
+        self.remove()
@@ -0,0 +1,104 @@
+import json
+import codecs
+
+
+JSON_DECODER = json.JSONDecoder()
+JSON_WHITESPACE = " \t\n\r"
+JSON_DELIMITERS = JSON_WHITESPACE + ",:]}"
+
+
+# Incremental reader of a JSON document that arrives in byte chunks (e.g. a streamed HTTP response)
+# Only the part of the document that wasn't consumed yet is kept in memory
+class JsonStreamReader:
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.decoder = codecs.getincrementaldecoder("utf-8")()
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+
+    def fill(self):
+        if self.eof: return False
+
+        chunk = next(self.chunks, None)
+
+        if chunk is None:
+            text = self.decoder.decode(b"", final=True)
+            self.eof = True
+        else:
+            text = self.decoder.decode(chunk)
+
+        self.buffer = self.buffer[self.pos:] + text
+        self.pos = 0
+
+        return True
+
+    def peek(self):
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in JSON_WHITESPACE:
+                self.pos += 1
+
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+
+            if not self.fill():
+                raise ValueError("Unexpected end of JSON stream")
+
+    def expect(self, chars):
+        char = self.peek()
+
+        if char not in chars:
+            raise ValueError(f"Unexpected '{char}' in JSON stream, expected one of '{chars}'")
+
+        self.pos += 1
+
+        return char
+
+    def value(self):
+        self.peek()
+
+        while True:
+            try:
+                value, end = JSON_DECODER.raw_decode(self.buffer, self.pos)
+
+                # a number at the end of the buffer may continue in the next chunk (e.g. "1" of "1.5e10")
+                if (end < len(self.buffer) and self.buffer[end] in JSON_DELIMITERS) or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof: raise
+
+            self.fill()
+
+
+# Yields the items of the array under array_key of a top level JSON object one by one
+# Other top level values are collected into top_level_values
+def iter_json_array(chunks, array_key, top_level_values=None):
+    reader = JsonStreamReader(chunks)
+
+    reader.expect("{")
+
+    if reader.peek() == "}": return
+
+    while True:
+        key = reader.value()
+        reader.expect(":")
+
+        if key == array_key and reader.peek() == "[":
+            reader.expect("[")
+
+            if reader.peek() == "]":
+                reader.expect("]")
+            else:
+                while True:
+                    yield reader.value()
+
+                    if reader.expect(",]") == "]": break
+        else:
+            value = reader.value()
+
+            if top_level_values is not None:
+                top_level_values[key] = value
+
+        if reader.expect(",}") == "}": return
@@ -0,0 +1,105 @@
+from functools import lru_cache
+
+
+# Keccak-256 (the pre-standard SHA-3 variant used by Ethereum), web3 is only needed for RPC calls
+
+KECCAK_ROUND_CONSTANTS = [
+    0x0000000000000001, 0x0000000000008082, 0x800000000000808A, 0x8000000080008000,
+    0x000000000000808B, 0x0000000080000001, 0x8000000080008081, 0x8000000000008009,
+    0x000000000000008A, 0x0000000000000088, 0x0000000080008009, 0x000000008000000A,
+    0x000000008000808B, 0x800000000000008B, 0x8000000000008089, 0x8000000000008003,
+    0x8000000000008002, 0x8000000000000080, 0x000000000000800A, 0x800000008000000A,
+    0x8000000080008081, 0x8000000000008080, 0x0000000080000001, 0x8000000080008008,
+]
+
+# Rotation offsets, indexed by x + 5 * y
+KECCAK_ROTATIONS = [
+    0, 1, 62, 28, 27,
+    36, 44, 6, 55, 20,
+    3, 10, 43, 25, 39,
+    41, 45, 15, 21, 8,
+    18, 2, 61, 56, 14,
+]
+
+KECCAK_256_RATE = 136
+LANE_MASK = (1 << 64) - 1
+
+
+def rotate_lane(lane, offset):
+    return ((lane << offset) | (lane >> (64 - offset))) & LANE_MASK if offset else lane
+
+
+def keccak_f1600(state):
+    for round_constant in KECCAK_ROUND_CONSTANTS:
+        # theta
+        columns = [state[x] ^ state[x + 5] ^ state[x + 10] ^ state[x + 15] ^ state[x + 20] for x in range(5)]
+        for x in range(5):
+            d = columns[(x - 1) % 5] ^ rotate_lane(columns[(x + 1) % 5], 1)
+            for y in range(0, 25, 5):
+                state[x + y] ^= d
+
+        # rho and pi
+        moved = [0] * 25
+        for x in range(5):
+            for y in range(5):
+                moved[y + 5 * ((2 * x + 3 * y) % 5)] = rotate_lane(state[x + 5 * y], KECCAK_ROTATIONS[x + 5 * y])
+
+        # chi
+        for y in range(0, 25, 5):
+            for x in range(5):
+                state[x + y] = moved[x + y] ^ (~moved[(x + 1) % 5 + y] & moved[(x + 2) % 5 + y])
+
+        # iota
+        state[0] ^= round_constant
+
+    return state
+
+
+def keccak256_pure(data):
+    # Keccak padding (0x01 ... 0x80), SHA-3 uses 0x06 instead
+    padded = bytearray(data)
+    padded.append(0x01)
+    padded.extend(b"\x00" * (-len(padded) % KECCAK_256_RATE))
+    padded[-1] |= 0x80
+
+    state = [0] * 25
+
+    for offset in range(0, len(padded), KECCAK_256_RATE):
+        block = padded[offset:offset + KECCAK_256_RATE]
+
+        for i in range(KECCAK_256_RATE // 8):
+            state[i] ^= int.from_bytes(block[i * 8:(i + 1) * 8], "little")
+
+        keccak_f1600(state)
+
+    return b"".join(lane.to_bytes(8, "little") for lane in state[:4])
+
+
+try:
+    # pycryptodome is installed with web3, its C implementation is used when available
+    from Crypto.Hash import keccak as _crypto_keccak
+
+    def keccak256(data):
+        return _crypto_keccak.new(digest_bits=256, data=data).digest()
+except ImportError:
+    keccak256 = keccak256_pure
+
+
+HEX_DIGITS = frozenset("0123456789abcdef")
+
+
+# EIP-55 mixed case checksum of an address (with or without 0x), same result as Web3.to_checksum_address
+@lru_cache(maxsize=1 << 16)
+def to_checksum_address(address):
+    address = address.lower()
+
+    if len(address) == 40:
+        address = "0x" + address
+
+    if len(address) != 42 or not address.startswith("0x") or not HEX_DIGITS.issuperset(address[2:]):
+        raise ValueError(f"Invalid address: {address}")
+
+    hex_address = address[2:]
+    address_hash = keccak256(hex_address.encode("ascii")).hex()
+
+    return "0x" + "".join(char.upper() if int(hash_char, 16) >= 8 else char for char, hash_char in zip(hex_address, address_hash))
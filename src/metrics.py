@@ -0,0 +1,362 @@
+# -*- coding: UTF-8 -*-
+
+import sys
+import json
+import pstats
+import cProfile
+import importlib
+import platform
+import threading
+
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from os import path, makedirs
+from time import perf_counter, sleep, time
+from urllib.parse import urlparse
+
+
+metrics_lock = threading.Lock()
+import_lock = threading.Lock()
+stage_stack = threading.local()
+
+RUN_METRICS = {
+    "start_time": None,
+    "meta": {},
+    "stages": [],
+    "endpoints": {},
+    "counters": {},
+}
+
+# Import times are process wide, startup imports happen before the run starts
+IMPORT_TIMES = {}
+
+PROFILE_SETTINGS = {
+    "ENABLED": False,
+    "PROFILES": {},
+}
+
+
+def start_run(meta=None, profile=False):
+    RUN_METRICS["start_time"] = time()
+    RUN_METRICS["meta"] = meta or {}
+    RUN_METRICS["stages"] = []
+    RUN_METRICS["endpoints"] = {}
+    RUN_METRICS["counters"] = {}
+
+    PROFILE_SETTINGS["ENABLED"] = profile
+    PROFILE_SETTINGS["PROFILES"] = {}
+
+
+def current_stages():
+    if not hasattr(stage_stack, "stages"):
+        stage_stack.stages = []
+
+    return stage_stack.stages
+
+
+def endpoint_name(endpoint):
+    if not endpoint: return "unknown"
+
+    endpoint = str(endpoint)
+    netloc = urlparse(endpoint).netloc
+
+    return netloc if netloc else endpoint
+
+
+def endpoint_metrics(endpoint):
+    name = endpoint_name(endpoint)
+
+    if name not in RUN_METRICS["endpoints"]:
+        RUN_METRICS["endpoints"][name] = {
+            "calls": 0,
+            "errors": 0,
+            "retries": 0,
+            "bytes": 0,
+            "request_seconds": 0.0,
+            "waits": {},
+            "status_codes": {},
+        }
+
+    return RUN_METRICS["endpoints"][name]
+
+
+@contextmanager
+def stage(name, **labels):
+    stages = current_stages()
+    parent = stages[-1] if stages else None
+
+    # nested stages inherit token/network/pool labels of their parent
+    labels = {**(parent["labels"] if parent else {}), **{k: v for k, v in labels.items() if v is not None}}
+
+    record = {
+        "name": name,
+        "labels": labels,
+        "path": f"{parent['path']}/{name}" if parent else name,
+        "started": time(),
+        "seconds": None,
+        "rows": 0,
+        "status": "ok",
+    }
+
+    stages.append(record)
+
+    # each thread profiles its own stages, a nested stage pauses the profiler of its parent
+    profilers = start_stage_profile()
+
+    start = perf_counter()
+
+    try:
+        yield record
+    except BaseException:
+        record["status"] = "failed"
+        raise
+    finally:
+        record["seconds"] = round(perf_counter() - start, 4)
+
+        if profilers is not None:
+            stop_stage_profile(stage_id(record), profilers)
+
+        stages.pop()
+
+        with metrics_lock:
+            RUN_METRICS["stages"].append(record)
+
+
+def current_profilers():
+    if not hasattr(stage_stack, "profilers"):
+        stage_stack.profilers = []
+
+    return stage_stack.profilers
+
+
+def enable_profiler(profiler):
+    try:
+        profiler.enable()
+    except ValueError:
+        # Python 3.12+ allows one cProfile profiler per process, stages of other threads aren't profiled meanwhile
+        return False
+
+    return True
+
+
+# Profilers of a stage (its own first, then the ones of its nested stages), None when the stage isn't profiled
+def start_stage_profile():
+    if not PROFILE_SETTINGS["ENABLED"]: return None
+
+    profiler_stack = current_profilers()
+
+    if profiler_stack:
+        profiler_stack[-1][0].disable()
+
+    profiler = cProfile.Profile()
+
+    if not enable_profiler(profiler):
+        if profiler_stack: enable_profiler(profiler_stack[-1][0])
+        return None
+
+    profilers = [profiler]
+    profiler_stack.append(profilers)
+
+    return profilers
+
+
+def stop_stage_profile(profile_name, profilers):
+    profilers[0].disable()
+
+    profiler_stack = current_profilers()
+    profiler_stack.pop()
+
+    # the profile of a stage includes its nested stages
+    if profiler_stack:
+        profiler_stack[-1].extend(profilers)
+        enable_profiler(profiler_stack[-1][0])
+
+    with metrics_lock:
+        PROFILE_SETTINGS["PROFILES"][profile_name] = profilers
+
+
+def stage_id(record):
+    label_str = "_".join(str(v) for v in record["labels"].values())
+    stage_str = record["path"].replace("/", "__")
+
+    return f"{stage_str}__{label_str}" if label_str else stage_str
+
+
+def add_rows(row_count):
+    stages = current_stages()
+
+    if stages and row_count:
+        stages[-1]["rows"] += int(row_count)
+
+
+def increment(counter_name, value=1):
+    with metrics_lock:
+        RUN_METRICS["counters"][counter_name] = RUN_METRICS["counters"].get(counter_name, 0) + value
+
+
+def wait(seconds, endpoint=None, reason="rate_limit"):
+    if not seconds or seconds <= 0: return
+
+    sleep(seconds)
+
+    with metrics_lock:
+        waits = endpoint_metrics(endpoint)["waits"]
+        waits[reason] = round(waits.get(reason, 0) + seconds, 4)
+
+
+def record_retry(endpoint):
+    with metrics_lock:
+        endpoint_metrics(endpoint)["retries"] += 1
+
+
+def record_error(endpoint):
+    with metrics_lock:
+        endpoint_metrics(endpoint)["errors"] += 1
+
+
+def record_response(response, *args, **kwargs):
+    request = response.request
+
+    # replayed requests are sent to the stand-in server, count them under the original host
+    endpoint = request.headers.get("X-Replay-Host") or request.url
+
+    with metrics_lock:
+        metrics = endpoint_metrics(endpoint)
+        metrics["calls"] += 1
+
+        # streamed bodies are consumed by the caller, reading them here would load them into memory
+        if kwargs.get("stream"):
+            metrics["bytes"] += int(response.headers.get("Content-Length") or 0)
+        else:
+            metrics["bytes"] += len(response.content or b"")
+        metrics["request_seconds"] = round(metrics["request_seconds"] + response.elapsed.total_seconds(), 4)
+
+        status_code = str(response.status_code)
+        metrics["status_codes"][status_code] = metrics["status_codes"].get(status_code, 0) + 1
+
+        if response.status_code >= 400:
+            metrics["errors"] += 1
+
+    return response
+
+
+@contextmanager
+def measure_import(name):
+    start = perf_counter()
+
+    try:
+        yield
+    finally:
+        with metrics_lock:
+            IMPORT_TIMES[name] = round(IMPORT_TIMES.get(name, 0) + perf_counter() - start, 4)
+
+
+# Heavy dependencies (web3, boto3, tqdm) are imported by the stages that use them
+# (stages that need a module at the same time wait for the first one, its import time is recorded once)
+def lazy_import(module_name):
+    if module_name in sys.modules:
+        return importlib.import_module(module_name)
+
+    with import_lock:
+        if module_name in sys.modules:
+            return importlib.import_module(module_name)
+
+        with measure_import(module_name):
+            return importlib.import_module(module_name)
+
+
+def summarize_stages(stages):
+    summary = {}
+
+    for record in stages:
+        item = summary.setdefault(record["name"], {"count": 0, "seconds": 0.0, "rows": 0})
+        item["count"] += 1
+        item["seconds"] = round(item["seconds"] + record["seconds"], 4)
+        item["rows"] += record["rows"]
+
+    return dict(sorted(summary.items(), key=lambda x: x[1]["seconds"], reverse=True))
+
+
+def summarize_waits(endpoints):
+    waits = {}
+
+    for metrics in endpoints.values():
+        for reason, seconds in metrics["waits"].items():
+            waits[reason] = round(waits.get(reason, 0) + seconds, 4)
+
+    return waits
+
+
+def summarize_retries(endpoints, counters):
+    return {
+        "retries": sum(metrics["retries"] for metrics in endpoints.values()),
+        "errors": sum(metrics["errors"] for metrics in endpoints.values()),
+        "wait_seconds": round(sum(metrics["waits"].get(reason, 0) for metrics in endpoints.values() for reason in ("retry", "retry_after")), 4),
+        "fatal_errors": counters.get("fatal_request_errors", 0),
+        "circuits_opened": counters.get("circuits_opened", 0),
+        "circuit_rejections": counters.get("circuit_rejections", 0),
+    }
+
+
+def summarize_hedging(counters):
+    calls = counters.get("rpc_hedgeable_calls", 0)
+
+    if not calls: return None
+
+    hedges = counters.get("rpc_hedges", 0)
+
+    return {
+        "calls": calls,
+        "hedges": hedges,
+        "hedge_rate": round(hedges / calls, 4),
+        "hedge_wins": counters.get("rpc_hedge_wins", 0),
+        "over_cap": counters.get("rpc_hedges_over_cap", 0),
+    }
+
+
+def write_report(output_dir):
+    if RUN_METRICS["start_time"] is None: return None
+
+    end_time = time()
+    started = datetime.fromtimestamp(RUN_METRICS["start_time"], tz=timezone.utc)
+
+    stages = sorted(RUN_METRICS["stages"], key=lambda x: x["started"])
+
+    report = {
+        "meta": {
+            **RUN_METRICS["meta"],
+            "started": started.isoformat(),
+            "python": platform.python_version(),
+        },
+        "total_seconds": round(end_time - RUN_METRICS["start_time"], 2),
+        "import_seconds": round(sum(IMPORT_TIMES.values()), 4),
+        "imports": dict(IMPORT_TIMES),
+        "waits": summarize_waits(RUN_METRICS["endpoints"]),
+        "retries": summarize_retries(RUN_METRICS["endpoints"], RUN_METRICS["counters"]),
+        "stage_totals": summarize_stages(stages),
+        "stages": stages,
+        "endpoints": RUN_METRICS["endpoints"],
+        "counters": RUN_METRICS["counters"],
+        "hedging": summarize_hedging(RUN_METRICS["counters"]),
+    }
+
+    report_filename = f"Run_Report_{started.strftime('%Y%m%d_%H%M%S')}.json"
+    report_path = path.join(output_dir, report_filename)
+
+    with open(report_path, "w") as json_file:
+        json.dump(report, json_file, indent=4, default=str)
+
+    print()
+    print("* Run report saved as:", report_path)
+
+    if PROFILE_SETTINGS["PROFILES"]:
+        profile_dir = path.join(output_dir, "Profiles", started.strftime('%Y%m%d_%H%M%S'))
+        makedirs(profile_dir, exist_ok=True)
+
+        for profile_name, profilers in PROFILE_SETTINGS["PROFILES"].items():
+            profile_stats = pstats.Stats(*profilers)
+            profile_stats.dump_stats(path.join(profile_dir, f"{profile_name}.prof"))
+
+        print("** Stage profiles saved to:", profile_dir)
+
+    return report_path
@@ -0,0 +1,129 @@
+import threading
+
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait as wait_futures
+
+from .metrics import stage, wait, increment
+
+
+# Stage kinds, I/O stages (network, disk, S3) and CPU stages (calculations) run on separate worker pools.
+# Both are thread pools: CPU stages don't run in parallel with each other (GIL), the CPU pool only keeps
+# calculations in order and off the I/O workers. More CPU workers only help where pandas/numpy release the GIL.
+IO_STAGE = "io"
+CPU_STAGE = "cpu"
+
+DEFAULT_PIPELINE_SETTINGS = {
+    "IO_WORKERS": 4,
+    "CPU_WORKERS": 1,
+    "STAGE_RETRIES": 2,
+    "RETRY_DELAY": 10,
+}
+
+
+class PipelineError(Exception):
+    pass
+
+
+# A stage runs func with the results of its dependencies (in the given order) as arguments
+class Stage:
+
+    def __init__(self, name, func, deps=(), kind=IO_STAGE, retries=0, labels=None):
+        self.name = name
+        self.func = func
+        self.deps = list(deps)
+        self.kind = kind
+        self.retries = retries
+        self.labels = labels or {}
+
+
+# Dependency graph of stages, independent stages run at the same time so the wall time approaches the critical path
+class Pipeline:
+
+    def __init__(self, pipeline_settings=None):
+        self.settings = {**DEFAULT_PIPELINE_SETTINGS, **(pipeline_settings or {})}
+        self.stages = {}
+        self.results = {}
+        self.lock = threading.Lock()
+
+    def add(self, name, func, deps=(), kind=IO_STAGE, retries=None, **labels):
+        if name in self.stages:
+            raise PipelineError(f"Stage {name} is already defined")
+
+        for dep in deps:
+            if dep not in self.stages:
+                raise PipelineError(f"Stage {name} depends on unknown stage {dep}")
+
+        if retries is None:
+            retries = self.settings["STAGE_RETRIES"] if kind == IO_STAGE else 0
+
+        self.stages[name] = Stage(name, func, deps, kind, retries, labels)
+
+        return name
+
+    def result(self, name):
+        return self.results[name]
+
+    def run_stage(self, pipeline_stage):
+        args = [self.results[dep] for dep in pipeline_stage.deps]
+
+        attempt = 0
+
+        while True:
+            try:
+                with stage(pipeline_stage.name.split(":")[0], **pipeline_stage.labels):
+                    return pipeline_stage.func(*args)
+            except Exception as err:
+                if attempt >= pipeline_stage.retries: raise
+
+                attempt += 1
+                increment("stage_retries")
+
+                print(f"! Error: Stage {pipeline_stage.name} failed -> {err}. Retrying in {self.settings['RETRY_DELAY']} seconds... ({attempt}/{pipeline_stage.retries})")
+
+                wait(self.settings["RETRY_DELAY"], "pipeline", "retry")
+
+    def run(self):
+        pending = dict(self.stages)
+        running = {}
+        failure = None
+
+        executors = {
+            IO_STAGE: ThreadPoolExecutor(max_workers=self.settings["IO_WORKERS"], thread_name_prefix="io"),
+            CPU_STAGE: ThreadPoolExecutor(max_workers=self.settings["CPU_WORKERS"], thread_name_prefix="cpu"),
+        }
+
+        try:
+            while pending or running:
+                # stages are submitted in the order they were added once their dependencies are done
+                if failure is None:
+                    for name, pipeline_stage in list(pending.items()):
+                        if all(dep in self.results for dep in pipeline_stage.deps):
+                            running[executors[pipeline_stage.kind].submit(self.run_stage, pipeline_stage)] = name
+                            del pending[name]
+
+                if not running:
+                    if failure is None and pending:
+                        raise PipelineError(f"Stages can't be scheduled: {', '.join(pending)}")
+                    break
+
+                done, _ = wait_futures(running, return_when=FIRST_COMPLETED)
+
+                for future in done:
+                    name = running.pop(future)
+
+                    try:
+                        self.results[name] = future.result()
+                    except Exception as err:
+                        # running stages are allowed to finish, nothing new is started
+                        if failure is None:
+                            failure = (name, err)
+        finally:
+            for executor in executors.values():
+                executor.shutdown(wait=True)
+
+        if failure is not None:
+            name, err = failure
+            print()
+            print(f"! Error: Stage {name} failed -> {err}")
+            raise err
+
+        return self.results
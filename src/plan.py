@@ -0,0 +1,504 @@
+import csv
+import json
+
+from glob import glob
+from math import ceil
+from os import path
+from datetime import datetime, timezone, timedelta
+
+from .utils import checkAddress, get_snapshot_filename, get_required_s3_prefixes
+from .metrics import endpoint_name
+from .pipeline import DEFAULT_PIPELINE_SETTINGS, IO_STAGE, CPU_STAGE
+from .fetch import backend_cache_filenames
+from .journal import Journal
+from .apikeys import DEFAULT_KEY_SETTINGS, split_api_keys
+from .blocks import read_block_cache
+
+
+# Request latency (seconds) of endpoints that don't appear in previous run reports
+DEFAULT_LATENCY = 0.5
+
+# Number of previous run reports used for latencies and stage timings
+PLAN_HISTORY_REPORTS = 10
+
+# Max. number of txns in a single explorer API call (same as fetch_pool_txns)
+EXPLORER_PAGE_SIZE = 10000
+
+# Bytes read from the end of a txn cache to find its last row
+CSV_TAIL_BYTES = 64 * 1024
+
+
+# Average latency per endpoint and average duration per stage of the previous runs
+def load_run_history(output_dir, max_reports=PLAN_HISTORY_REPORTS):
+    endpoints = {}
+    stages = {}
+
+    report_files = sorted(glob(path.join(output_dir, "Run_Report_*.json")))[-max_reports:]
+
+    for report_file in report_files:
+        try:
+            with open(report_file, "r") as json_file:
+                report = json.load(json_file)
+        except ValueError:
+            continue
+
+        for name, metrics in report.get("endpoints", {}).items():
+            item = endpoints.setdefault(name, {"calls": 0, "seconds": 0.0})
+            item["calls"] += metrics.get("calls", 0)
+            item["seconds"] += metrics.get("request_seconds", 0.0)
+
+        for name, totals in report.get("stage_totals", {}).items():
+            item = stages.setdefault(name, {"count": 0, "seconds": 0.0})
+            item["count"] += totals.get("count", 0)
+            item["seconds"] += totals.get("seconds", 0.0)
+
+    return {
+        "REPORTS": len(report_files),
+        "LATENCIES": {name: item["seconds"] / item["calls"] for name, item in endpoints.items() if item["calls"]},
+        "STAGE_SECONDS": {name: item["seconds"] / item["count"] for name, item in stages.items() if item["count"]},
+    }
+
+
+# Row count, first and last row of a CSV file, without parsing the whole file
+def read_csv_summary(filename):
+    if not path.isfile(filename): return None
+
+    newlines = 0
+    last_byte = b""
+
+    with open(filename, "rb") as f:
+        header = f.readline()
+        first_line = f.readline()
+
+        f.seek(0)
+
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            newlines += chunk.count(b"\n")
+            last_byte = chunk[-1:]
+
+        f.seek(max(0, f.tell() - CSV_TAIL_BYTES))
+        tail_lines = [line for line in f.read().splitlines() if line.strip()]
+
+    if not first_line.strip(): return {"rows": 0, "first": None, "last": None}
+
+    columns = next(csv.reader([header.decode("utf-8")]))
+
+    def parse_row(line):
+        return dict(zip(columns, next(csv.reader([line.decode("utf-8")]))))
+
+    return {
+        "rows": newlines - 1 + (0 if last_byte == b"\n" else 1),
+        "first": parse_row(first_line),
+        "last": parse_row(tail_lines[-1]),
+    }
+
+
+def count_missing_lp_values(lp_history_filename, snapshot_timestamps):
+    complete = set()
+
+    if path.isfile(lp_history_filename):
+        with open(lp_history_filename, "r", newline="") as f:
+            for row in csv.DictReader(f):
+                if row.get("lpAmount") not in (None, "", "nan") and row.get("tokenAmount") not in (None, "", "nan"):
+                    complete.add(int(float(row["timeStamp"])))
+
+    # values of an interrupted run are replayed from the journal
+    for record in Journal(lp_history_filename).read():
+        complete.add(int(record["timeStamp"]))
+
+    return len([t for t in snapshot_timestamps if int(t) not in complete])
+
+
+# Expected number of new txns, from the txn rate of the cached history
+def estimate_new_txns(txn_summary, snapshot_timestamp):
+    if txn_summary is None or txn_summary["rows"] == 0: return None
+
+    first_timestamp = int(txn_summary["first"]["timeStamp"])
+    last_timestamp = int(txn_summary["last"]["timeStamp"])
+
+    if last_timestamp >= snapshot_timestamp: return 0
+    if last_timestamp <= first_timestamp: return 0
+
+    txns_per_second = (txn_summary["rows"] - 1) / (last_timestamp - first_timestamp)
+
+    return int(txns_per_second * (snapshot_timestamp - last_timestamp))
+
+
+# Work list of a run with the expected calls per endpoint, built from config and local files only
+class RunPlan:
+
+    def __init__(self, settings, history):
+        self.settings = settings
+        self.history = history
+        self.pipeline_settings = {**DEFAULT_PIPELINE_SETTINGS, **(settings.get("PIPELINE") or {})}
+        self.items = []
+        # requests per second of all keys of an explorer
+        self.explorer_rates = {}
+
+    def latency(self, endpoint):
+        return self.history["LATENCIES"].get(endpoint, DEFAULT_LATENCY)
+
+    def request_seconds(self, endpoint, calls, delay=0):
+        return calls * (delay + self.latency(endpoint))
+
+    # explorer calls are spaced out by the request rate of the keys instead of a fixed delay
+    def explorer_seconds(self, endpoint, calls):
+        rate = self.explorer_rates.get(endpoint)
+
+        return calls * max(self.latency(endpoint), 1 / rate if rate else 0)
+
+    def stage_seconds(self, stage_name):
+        return self.history["STAGE_SECONDS"].get(stage_name, 0.0)
+
+    def add(self, stage_name, calls, seconds, kind=IO_STAGE, detail=None, **labels):
+        item = {
+            "stage": stage_name,
+            "labels": labels,
+            "kind": kind,
+            "calls": {endpoint: count for endpoint, count in calls.items() if count},
+            "seconds": round(seconds, 2),
+            "detail": detail,
+        }
+
+        self.items.append(item)
+
+        return item
+
+    def endpoint_totals(self):
+        totals = {}
+
+        for item in self.items:
+            for endpoint, count in item["calls"].items():
+                total = totals.setdefault(endpoint, {"calls": 0, "latency": round(self.latency(endpoint), 4), "historical": endpoint in self.history["LATENCIES"]})
+                total["calls"] += count
+
+        return dict(sorted(totals.items(), key=lambda x: x[1]["calls"], reverse=True))
+
+
+def get_explorer_url(settings, network):
+    if settings["NETWORK"][network]["CHAIN_ID"] == "":
+        return settings["NETWORK"][network]["API_URL"]
+
+    return settings["NETWORK"]["MULTICHAIN_API_URL"]
+
+
+def get_explorer_rate(settings, network):
+    if settings["NETWORK"][network]["CHAIN_ID"] == "":
+        api_keys = settings["NETWORK"][network].get("API_KEY")
+    else:
+        api_keys = settings["NETWORK"]["MULTICHAIN_API_KEY"]
+
+    key_settings = {**DEFAULT_KEY_SETTINGS, **(settings["NETWORK"].get("EXPLORER_KEYS") or {})}
+
+    return max(1, len(split_api_keys(api_keys))) * key_settings["REQUESTS_PER_SECOND"]
+
+
+# Longest chain of dependent stages of a network, stages that don't depend on each other overlap
+def plan_network(run_plan, settings, data_dir, all_tokens_dict, all_tokens_list, token_name, network, target_pools, snapshot_timestamps):
+    labels = {"token": token_name, "network": network}
+
+    explorer = endpoint_name(get_explorer_url(settings, network))
+    rpc = endpoint_name(settings["NETWORK"][network]["RPC_NODES"][0])
+    delay = settings["NETWORK"]["API_CALL_DELAY"]
+
+    run_plan.explorer_rates[explorer] = get_explorer_rate(settings, network)
+
+    token_dir = path.join(data_dir, f"{token_name}_{network}")
+    token_details = all_tokens_dict[token_name][network]
+
+    token_contract = checkAddress(token_details["contract"])
+    lp_contract = checkAddress(token_details["lp_contract"])
+
+    snapshot_timestamp = int(snapshot_timestamps[-1])
+
+    # snapshot block resolved by an earlier run or the follow mode
+    if str(snapshot_timestamp) in read_block_cache(data_dir).get(network, {}):
+        block_item = run_plan.add("snapshot_block", {}, 0, detail="cached", **labels)
+    else:
+        block_item = run_plan.add("snapshot_block", {explorer: 1}, run_plan.explorer_seconds(explorer, 1), **labels)
+
+    lp_items = {}
+
+    def plan_lp_history(target_lp_contract):
+        if target_lp_contract in lp_items: return lp_items[target_lp_contract]
+
+        missing = count_missing_lp_values(path.join(token_dir, f"LP_HISTORY_{target_lp_contract}.csv"), snapshot_timestamps)
+
+        # contract creation lookup, ABI, then a block number and 2 archive calls (totalSupply, getReserves) per missing value
+        explorer_calls = 1 + (1 + missing if missing else 0)
+        rpc_calls = 3 + 2 * missing if missing else 0
+
+        seconds = run_plan.explorer_seconds(explorer, explorer_calls) + run_plan.request_seconds(rpc, rpc_calls, delay)
+
+        calls = {explorer: explorer_calls}
+        calls[rpc] = calls.get(rpc, 0) + rpc_calls
+
+        lp_items[target_lp_contract] = run_plan.add("lp_history", calls, seconds, detail=f"{missing} of {len(snapshot_timestamps)} LP values missing", **labels, lp=target_lp_contract)
+
+        return lp_items[target_lp_contract]
+
+    pool_entries = []
+
+    if target_pools == "farm" or target_pools == "all":
+        lp_item = plan_lp_history(lp_contract)
+
+        for pool in token_details["farm"]:
+            pool_entries.append((pool, lp_contract, lp_item))
+
+    if target_pools == "stake" or target_pools == "all":
+        for pool in token_details["stake"]:
+            pool_entries.append((pool, token_contract, None))
+
+    if target_pools == "farm" or target_pools == "all":
+        for other_token_name in all_tokens_list:
+            if other_token_name == token_name: continue
+            if not network in all_tokens_dict[other_token_name].keys(): continue
+
+            other_token_details = all_tokens_dict[other_token_name][network]
+            other_lp_contract = checkAddress(other_token_details["lp_contract"])
+
+            if other_lp_contract is None: continue
+
+            other_lp_item = plan_lp_history(other_lp_contract)
+
+            for pool in other_token_details["farm"]:
+                pool_entries.append((pool, other_lp_contract, other_lp_item))
+
+    pool_paths = []
+
+    for pool, target_token, lp_item in pool_entries:
+        pool_name, pool_contract, pool_multiplier = pool
+        pool_contract = checkAddress(pool_contract)
+
+        metadata_item = run_plan.add("pool_metadata", {explorer: 1}, run_plan.explorer_seconds(explorer, 1), **labels, pool=pool_name)
+
+        txn_filename = path.join(token_dir, f"{pool_contract}.csv")
+        txn_summary = read_csv_summary(txn_filename)
+
+        # pagination of an interrupted run continues after the last journaled page
+        journaled_pages = Journal(txn_filename).read()
+
+        if journaled_pages:
+            if txn_summary is None or txn_summary["rows"] == 0:
+                txn_summary = {"rows": 0, "first": journaled_pages[0]["txns"][0], "last": None}
+
+            txn_summary["rows"] += sum(len(page["txns"]) for page in journaled_pages)
+            txn_summary["last"] = journaled_pages[-1]["txns"][-1]
+        new_txns = estimate_new_txns(txn_summary, snapshot_timestamp)
+
+        if txn_summary is None or txn_summary["rows"] == 0:
+            pages = 1
+            detail = "no cached txns, at least 1 page"
+        else:
+            pages = 1 + new_txns // EXPLORER_PAGE_SIZE if new_txns > 0 or int(txn_summary["last"]["timeStamp"]) < snapshot_timestamp else 0
+            detail = f"{txn_summary['rows']} cached txns up to block {txn_summary['last']['blockNumber']}, ~{new_txns} new"
+
+        txns_item = run_plan.add("pool_txns", {explorer: pages}, run_plan.explorer_seconds(explorer, pages), detail=detail, **labels, pool=pool_name)
+
+        calculate_item = run_plan.add("calculate", {}, run_plan.stage_seconds("calculate"), kind=CPU_STAGE, **labels, pool=pool_name)
+
+        lp_seconds = lp_item["seconds"] if lp_item else 0
+        pool_paths.append((lp_seconds + metadata_item["seconds"], txns_item["seconds"], calculate_item["seconds"]))
+
+    finalize_item = run_plan.add("finalize", {}, run_plan.stage_seconds("finalize"), kind=CPU_STAGE, **labels)
+
+    if not pool_paths: return block_item["seconds"] + finalize_item["seconds"]
+
+    # calculations wait for the exclude list, which needs the metadata of all pools
+    metadata_done = max(metadata_seconds for metadata_seconds, _, _ in pool_paths)
+
+    return max(max(max(metadata_seconds, block_item["seconds"]) + txns_seconds, metadata_done) + calculate_seconds for metadata_seconds, txns_seconds, calculate_seconds in pool_paths) + finalize_item["seconds"]
+
+
+def count_kyc_pages(records, batch_size, concurrency):
+    # pages are requested in waves of "concurrency" pages until a page comes back short
+    pages = records // batch_size + 1
+
+    return ceil(pages / concurrency) * concurrency
+
+
+def plan_kyc_sync(run_plan, kyc_settings, kyc_export_filename, plan_time):
+    kyc = endpoint_name(kyc_settings.get("API_URL")) if kyc_settings.get("API_URL") else "kyc"
+
+    batch_size = kyc_settings.get("BATCH_SIZE", 20)
+    concurrency = kyc_settings.get("MAX_CONCURRENCY", 4)
+    requests_per_second = kyc_settings.get("REQUESTS_PER_SECOND", 5)
+    pending_statuses = kyc_settings.get("PENDING_STATUSES", ["waiting", "inreview"])
+
+    raw_kyc_export_filename = path.join(path.dirname(kyc_export_filename), f"Raw_{path.basename(kyc_export_filename)}")
+    kyc_state_filename = kyc_export_filename.replace(".csv", "_SYNC_STATE.json")
+
+    status_counts = {}
+    records = 0
+
+    if path.isfile(raw_kyc_export_filename):
+        with open(raw_kyc_export_filename, "r", newline="") as f:
+            for row in csv.DictReader(f):
+                status = str(row.get("status", "")).lower().strip()
+                status_counts[status] = status_counts.get(status, 0) + 1
+                records += 1
+
+    last_full_sync = 0
+
+    if path.isfile(kyc_state_filename):
+        try:
+            with open(kyc_state_filename, "r") as json_file:
+                last_full_sync = json.load(json_file).get("LAST_FULL_SYNC", 0)
+        except ValueError:
+            pass
+
+    full_sync = records == 0 or (plan_time.timestamp() - last_full_sync) > kyc_settings.get("FULL_SYNC_HOURS", 168) * 3600
+
+    if full_sync:
+        calls = count_kyc_pages(records, batch_size, concurrency)
+        detail = f"full sync of ~{records} records" if records else "full sync, no local export (record count unknown)"
+    else:
+        pending = sum(status_counts.get(status, 0) for status in pending_statuses)
+
+        # one wave from the end of the known records, the recheck slice, pending statuses, and at most one lookup per locally pending record
+        calls = concurrency + kyc_settings.get("RECHECK_PAGES", 10) + sum(count_kyc_pages(status_counts.get(status, 0), batch_size, concurrency) for status in pending_statuses) + pending
+        detail = f"incremental sync of {records} records, {pending} pending"
+
+    seconds = calls * max(1 / requests_per_second if requests_per_second else 0, run_plan.latency(kyc) / concurrency)
+
+    return run_plan.add("kyc_sync", {kyc: calls}, seconds, detail=detail)["seconds"]
+
+
+def plan_whitelist(run_plan, settings, data_dir, output_dir, project_id, token_name, target_pools, backend_api_url, kyc_export_filename):
+    backend = endpoint_name(backend_api_url) if backend_api_url else "backend"
+
+    snapshot_filename = get_snapshot_filename(token_name, target_pools)
+    snapshot_summary = read_csv_summary(path.join(output_dir, snapshot_filename))
+
+    if snapshot_summary is None:
+        detail = f"{snapshot_filename} is missing locally (downloaded from S3 or the run stops)"
+    else:
+        detail = f"{snapshot_summary['rows']} wallets in {snapshot_filename}"
+
+    run_plan.add("raw_snapshot", {}, 0, detail=detail, token=token_name)
+
+    kyc_summary = read_csv_summary(kyc_export_filename)
+    kyc_item = run_plan.add("kyc_load", {}, run_plan.stage_seconds("kyc_load"), kind=CPU_STAGE, detail=f"{kyc_summary['rows'] if kyc_summary else 0} local KYC records")
+
+    # KYC load runs while the backend exports are fetched
+    paths = [kyc_item["seconds"]]
+
+    for stage_name, export_name in [("registration", f"Backend_Registration_Export_{project_id}"), ("wallet_delegation", "Backend_User_Export")]:
+        conditional = path.isfile(backend_cache_filenames(data_dir, export_name)[1])
+        detail = "conditional request (cached export)" if conditional else "full export"
+
+        paths.append(run_plan.add(stage_name, {backend: 1}, run_plan.stage_seconds(stage_name) or run_plan.request_seconds(backend, 1), detail=detail)["seconds"])
+
+    return max(paths) + run_plan.add("whitelist", {}, run_plan.stage_seconds("whitelist"), kind=CPU_STAGE, token=token_name)["seconds"]
+
+
+def create_plan(settings, main_dir, data_dir, output_dir, project_id, all_tokens_dict, target_tokens_list, all_tokens_list, unique_networks_list, target_pools, snapshot_timestamps, s3_bucket, backend_api_url, kyc_export_filename):
+    plan_time = datetime.now(timezone.utc)
+
+    history = load_run_history(output_dir)
+    run_plan = RunPlan(settings, history)
+
+    critical_paths = []
+
+    if s3_bucket:
+        s3_prefixes = [""] if settings.get("S3_FULL_DOWNLOAD") else get_required_s3_prefixes(main_dir, data_dir, output_dir, project_id, target_tokens_list, all_tokens_dict, unique_networks_list, target_pools)
+
+        # one listing per prefix, downloads depend on the remote changes
+        run_plan.add("s3_download", {"s3": len(s3_prefixes)}, run_plan.stage_seconds("s3_download") or run_plan.request_seconds("s3", len(s3_prefixes)), detail=f"{len(s3_prefixes)} prefixes")
+
+    for token_name in target_tokens_list:
+        if project_id is None:
+            for network in unique_networks_list:
+                if network not in all_tokens_dict[token_name].keys(): continue
+
+                critical_paths.append(plan_network(run_plan, settings, data_dir, all_tokens_dict, all_tokens_list, token_name, network, target_pools, snapshot_timestamps))
+
+            if token_name == "SFUND":
+                critical_paths.append(plan_kyc_sync(run_plan, settings["KYC"], kyc_export_filename, plan_time))
+
+        elif token_name == "SFUND":
+            critical_paths.append(plan_whitelist(run_plan, settings, data_dir, output_dir, project_id, token_name, target_pools, backend_api_url, kyc_export_filename))
+
+    io_seconds = sum(item["seconds"] for item in run_plan.items if item["kind"] == IO_STAGE)
+    cpu_seconds = sum(item["seconds"] for item in run_plan.items if item["kind"] == CPU_STAGE)
+
+    critical_path = max(critical_paths) if critical_paths else 0
+
+    endpoints = run_plan.endpoint_totals()
+
+    # all calls to an explorer share the request rate of its keys
+    key_seconds = max([endpoints[explorer]["calls"] / rate for explorer, rate in run_plan.explorer_rates.items() if explorer in endpoints] or [0])
+
+    # the run can't be faster than its longest chain of stages, the busiest worker pool or the explorer keys
+    wall_seconds = max(critical_path, io_seconds / run_plan.pipeline_settings["IO_WORKERS"], cpu_seconds / run_plan.pipeline_settings["CPU_WORKERS"], key_seconds)
+
+    return {
+        "created": plan_time.isoformat(),
+        "history_reports": history["REPORTS"],
+        "items": run_plan.items,
+        "endpoints": endpoints,
+        "estimate": {
+            "io_seconds": round(io_seconds, 2),
+            "cpu_seconds": round(cpu_seconds, 2),
+            "critical_path_seconds": round(critical_path, 2),
+            "explorer_key_seconds": round(key_seconds, 2),
+            "wall_seconds": round(wall_seconds, 2),
+            "finish_time": (plan_time + timedelta(seconds=wall_seconds)).isoformat(),
+        },
+    }
+
+
+def print_plan(plan):
+    print()
+    print("#"*20)
+    print()
+    print("* Run plan (no network calls were made)")
+
+    current_group = None
+
+    for item in plan["items"]:
+        group = " / ".join(str(item["labels"][key]) for key in ("token", "network") if key in item["labels"])
+
+        if group != current_group:
+            current_group = group
+            print()
+            print(f"** {group or 'Run'}")
+
+        name = item["labels"].get("pool") or item["labels"].get("lp") or ""
+        calls = ", ".join(f"{count} {endpoint}" for endpoint, count in item["calls"].items()) or "-"
+
+        print(f"   {item['stage']:<18} {name:<44} {calls:<48} ~{item['seconds']:.1f}s" + (f"  ({item['detail']})" if item["detail"] else ""))
+
+    print()
+    print("* Expected calls per endpoint")
+    print()
+
+    for endpoint, total in plan["endpoints"].items():
+        latency_source = "previous runs" if total["historical"] else "default"
+        print(f"   {endpoint:<44} {total['calls']:>7} calls  ({total['latency']}s per call, {latency_source})")
+
+    estimate = plan["estimate"]
+
+    print()
+    print("* Time estimate")
+    print()
+    print("   Network/disk stages:", f"{estimate['io_seconds']:.1f}s")
+    print("   Calculation stages:", f"{estimate['cpu_seconds']:.1f}s")
+    print("   Longest stage chain:", f"{estimate['critical_path_seconds']:.1f}s")
+    print("   Explorer key budget:", f"{estimate['explorer_key_seconds']:.1f}s")
+    print("   Estimated wall time:", f"{estimate['wall_seconds']:.1f}s")
+    print("   Estimated finish (UTC):", datetime.fromisoformat(estimate["finish_time"]).strftime("%d.%m.%Y %H:%M:%S"))
+    print("   Based on:", f"{plan['history_reports']} previous run reports" if plan["history_reports"] else "default latencies (no previous run reports)")
+
+
+def write_plan(plan, output_dir):
+    plan_filename = f"Run_Plan_{datetime.fromisoformat(plan['created']).strftime('%Y%m%d_%H%M%S')}.json"
+    plan_path = path.join(output_dir, plan_filename)
+
+    with open(plan_path, "w") as json_file:
+        json.dump(plan, json_file, indent=4, default=str)
+
+    print()
+    print("* Run plan saved as:", plan_path)
+
+    return plan_path
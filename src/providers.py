@@ -0,0 +1,99 @@
+import threading
+
+import requests
+
+from .replay import create_http_adapter
+from .metrics import record_response, increment, lazy_import
+
+
+DEFAULT_PROVIDER_SETTINGS = {
+    # hosts with pooled connections, and max. open connections per host (one per concurrent RPC call)
+    "POOL_CONNECTIONS": 10,
+    "POOL_MAXSIZE": 20,
+    "TIMEOUT": 30,
+    "MAX_RETRIES": 3,
+}
+
+PROVIDER_SETTINGS = dict(DEFAULT_PROVIDER_SETTINGS)
+
+# One keep-alive session shared by all RPC nodes, one Web3 provider per node URL
+# and one contract object per (node URL, contract address), kept for the whole run
+RPC_SESSION = {"SESSION": None}
+PROVIDERS = {}
+CONNECTED_PROVIDERS = set()
+CONTRACTS = {}
+
+providers_lock = threading.Lock()
+
+
+def configure_providers(provider_settings):
+    PROVIDER_SETTINGS.clear()
+    PROVIDER_SETTINGS.update({**DEFAULT_PROVIDER_SETTINGS, **(provider_settings or {})})
+
+
+def get_rpc_session():
+    with providers_lock:
+        if RPC_SESSION["SESSION"] is None:
+            session = requests.Session()
+            adapter = create_http_adapter(
+                PROVIDER_SETTINGS["MAX_RETRIES"],
+                pool_connections=PROVIDER_SETTINGS["POOL_CONNECTIONS"],
+                pool_maxsize=PROVIDER_SETTINGS["POOL_MAXSIZE"],
+            )
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+
+            session.hooks["response"].append(record_response)
+
+            RPC_SESSION["SESSION"] = session
+
+        return RPC_SESSION["SESSION"]
+
+
+def get_provider(rpc_url):
+    session = get_rpc_session()
+
+    with providers_lock:
+        if rpc_url not in PROVIDERS:
+            Web3 = lazy_import("web3").Web3
+
+            PROVIDERS[rpc_url] = Web3(Web3.HTTPProvider(rpc_url, session=session, request_kwargs={"timeout": PROVIDER_SETTINGS["TIMEOUT"]}))
+            increment("rpc_providers_created")
+
+        return PROVIDERS[rpc_url]
+
+
+# A node is probed (is_connected) until it answers once, later switches to it reuse the provider as is
+def is_provider_connected(rpc_url):
+    with providers_lock:
+        return rpc_url in CONNECTED_PROVIDERS
+
+
+def set_provider_connected(rpc_url, connected=True):
+    with providers_lock:
+        if connected:
+            CONNECTED_PROVIDERS.add(rpc_url)
+        else:
+            CONNECTED_PROVIDERS.discard(rpc_url)
+
+
+def get_contract(web3, contract_address, contract_abi):
+    contract_id = (web3.provider.endpoint_uri, contract_address)
+
+    with providers_lock:
+        if contract_id not in CONTRACTS:
+            CONTRACTS[contract_id] = web3.eth.contract(address=contract_address, abi=contract_abi)
+            increment("rpc_contracts_created")
+
+        return CONTRACTS[contract_id]
+
+
+def close_providers():
+    with providers_lock:
+        if RPC_SESSION["SESSION"] is not None:
+            RPC_SESSION["SESSION"].close()
+
+        RPC_SESSION["SESSION"] = None
+        PROVIDERS.clear()
+        CONNECTED_PROVIDERS.clear()
+        CONTRACTS.clear()
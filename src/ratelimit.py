@@ -0,0 +1,25 @@
+import threading
+
+from time import monotonic
+
+from .metrics import wait
+
+
+# Spaces out requests of all threads sharing the limiter (e.g. concurrent KYC pages) to a max. request rate
+class RateLimiter:
+
+    def __init__(self, requests_per_second, endpoint=None):
+        self.interval = 1 / requests_per_second if requests_per_second else 0
+        self.endpoint = endpoint
+        self.next_slot = 0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        if self.interval <= 0: return
+
+        with self.lock:
+            now = monotonic()
+            slot = max(self.next_slot, now)
+            self.next_slot = slot + self.interval
+
+        wait(slot - now, self.endpoint)
@@ -0,0 +1,552 @@
+# -*- coding: UTF-8 -*-
+
+# Record/replay harness for offline runs
+#
+# REPLAY_MODE=record  -> every HTTP request (explorer, RPC, KYC, backend) and S3 download/upload is captured into REPLAY_CASSETTE
+# REPLAY_MODE=replay  -> HTTP and S3 traffic is redirected to the local stand-in server (REPLAY_SERVER_URL), which serves the cassette
+#
+# Stand-in server: python -m src.replay --cassette Cassette --port 8765 --latency-ms 200 --error-rate 0.05
+
+import sys
+import json
+import base64
+import random
+import hashlib
+import argparse
+import threading
+
+from os import getenv, path, makedirs, walk
+from shutil import copyfile
+from time import sleep, time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qsl, unquote
+from xml.sax.saxutils import escape
+
+from requests.adapters import HTTPAdapter
+
+
+REPLAY_MODE = getenv("REPLAY_MODE", None)
+REPLAY_SERVER_URL = getenv("REPLAY_SERVER_URL", "http://127.0.0.1:8765")
+
+SECRET_PARAMS = ("apikey", "api_key", "key", "token")
+RESPONSE_HEADERS_TO_KEEP = ("content-type", "etag", "last-modified", "retry-after")
+
+HTTP_CASSETTE_FILENAME = "http.jsonl"
+S3_CASSETTE_FILENAME = "s3.jsonl"
+S3_OBJECTS_DIR = "s3"
+S3_UPLOADS_DIR = "s3_uploads"
+
+cassette_lock = threading.Lock()
+
+
+def get_cassette_dir():
+    cassette_dir = getenv("REPLAY_CASSETTE", "Cassette")
+
+    if not path.isabs(cassette_dir):
+        cassette_dir = path.join(path.abspath(path.dirname(sys.argv[0])), cassette_dir)
+
+    return cassette_dir
+
+
+def is_recording(): return REPLAY_MODE == "record"
+
+def is_replaying(): return REPLAY_MODE == "replay"
+
+
+def canonical_body(body):
+    if not body: return b""
+
+    if isinstance(body, str):
+        body = body.encode("utf-8")
+
+    try:
+        payload = json.loads(body)
+    except ValueError:
+        return body
+
+    # JSON-RPC ids change from run to run, they are not part of the request identity
+    if isinstance(payload, dict):
+        payload.pop("id", None)
+    elif isinstance(payload, list):
+        for item in payload:
+            if isinstance(item, dict): item.pop("id", None)
+
+    return json.dumps(payload, sort_keys=True, separators=(",", ":")).encode("utf-8")
+
+
+def sanitized_query(url):
+    query = parse_qsl(urlparse(url).query, keep_blank_values=True)
+    return sorted((k, v) for k, v in query if k.lower() not in SECRET_PARAMS)
+
+
+def request_key(method, url, body=None):
+    parsed = urlparse(url)
+
+    digest = hashlib.sha256()
+    digest.update(method.upper().encode("utf-8"))
+    digest.update(f"{parsed.netloc}{parsed.path}".encode("utf-8"))
+    digest.update(json.dumps(sanitized_query(url)).encode("utf-8"))
+    digest.update(canonical_body(body))
+
+    return digest.hexdigest()
+
+
+def request_summary(method, url, body=None):
+    parsed = urlparse(url)
+
+    summary = {"method": method.upper(), "host": parsed.netloc, "query": dict(sanitized_query(url))}
+
+    try:
+        payload = json.loads(body) if body else None
+        if isinstance(payload, dict) and "method" in payload:
+            summary["rpc_method"] = payload["method"]
+    except ValueError:
+        pass
+
+    return summary
+
+
+def append_to_cassette(filename, entry):
+    cassette_dir = get_cassette_dir()
+
+    with cassette_lock:
+        makedirs(cassette_dir, exist_ok=True)
+
+        with open(path.join(cassette_dir, filename), "a") as cassette_file:
+            cassette_file.write(json.dumps(entry) + "\n")
+
+
+class CassetteAdapter(HTTPAdapter):
+
+    def send(self, request, **kwargs):
+        if is_replaying():
+            request.headers["X-Replay-Key"] = request_key(request.method, request.url, request.body)
+            request.headers["X-Replay-Host"] = urlparse(request.url).netloc
+            request.url = f"{REPLAY_SERVER_URL.rstrip('/')}/__replay__"
+
+            return super().send(request, **kwargs)
+
+        start_time = time()
+        response = super().send(request, **kwargs)
+
+        if is_recording():
+            entry = request_summary(request.method, request.url, request.body)
+            entry["key"] = request_key(request.method, request.url, request.body)
+            entry["status"] = response.status_code
+            entry["elapsed"] = round(time() - start_time, 4)
+            entry["headers"] = {k: v for k, v in response.headers.items() if k.lower() in RESPONSE_HEADERS_TO_KEEP}
+            entry["body"] = base64.b64encode(response.content).decode("ascii")
+
+            append_to_cassette(HTTP_CASSETTE_FILENAME, entry)
+
+        return response
+
+
+def create_http_adapter(max_retries, **adapter_options):
+    if REPLAY_MODE is None:
+        return HTTPAdapter(max_retries=max_retries, **adapter_options)
+
+    return CassetteAdapter(max_retries=max_retries, **adapter_options)
+
+
+def s3_client_options():
+    options = {}
+
+    endpoint_url = getenv("S3_ENDPOINT_URL", None)
+
+    if is_replaying():
+        endpoint_url = REPLAY_SERVER_URL
+
+        options["aws_access_key_id"] = "replay"
+        options["aws_secret_access_key"] = "replay"
+        options["region_name"] = "us-east-1"
+
+    if endpoint_url:
+        from botocore.config import Config
+
+        options["endpoint_url"] = endpoint_url
+        options["config"] = Config(
+            s3={"addressing_style": "path"},
+            request_checksum_calculation="when_required",
+            response_checksum_validation="when_required",
+        )
+
+    return options
+
+
+def record_s3_operation(operation, bucket, key, local_path=None):
+    if not is_recording(): return
+
+    entry = {"operation": operation, "bucket": bucket, "key": key}
+
+    if local_path is not None and path.isfile(local_path):
+        entry["size"] = path.getsize(local_path)
+
+        # downloaded objects become the bucket content served in replay mode
+        if operation == "download":
+            object_path = path.join(get_cassette_dir(), S3_OBJECTS_DIR, bucket, key)
+
+            with cassette_lock:
+                makedirs(path.dirname(object_path), exist_ok=True)
+                copyfile(local_path, object_path)
+
+    append_to_cassette(S3_CASSETTE_FILENAME, entry)
+
+
+# ------------------------------
+# Stand-in server
+# ------------------------------
+
+def load_http_cassette(cassette_dir):
+    recorded = {}
+
+    cassette_path = path.join(cassette_dir, HTTP_CASSETTE_FILENAME)
+
+    if not path.isfile(cassette_path): return recorded
+
+    with open(cassette_path, "r") as cassette_file:
+        for line in cassette_file:
+            if not line.strip(): continue
+
+            entry = json.loads(line)
+            recorded.setdefault(entry["key"], []).append(entry)
+
+    return recorded
+
+
+def s3_etag(file_path):
+    digest = hashlib.md5()
+
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+
+    return f'"{digest.hexdigest()}"'
+
+
+def http_date(timestamp):
+    return datetime.fromtimestamp(timestamp, tz=timezone.utc).strftime("%a, %d %b %Y %H:%M:%S GMT")
+
+
+class ReplayHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def read_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length > 0 else b""
+
+    def send_payload(self, status, body=b"", headers=None):
+        self.send_response(status)
+
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def inject_faults(self):
+        server = self.server
+
+        if server.latency_ms > 0 or server.jitter_ms > 0:
+            sleep(max(0, server.latency_ms + server.rng.uniform(-server.jitter_ms, server.jitter_ms)) / 1000)
+
+        if server.error_rate > 0 and server.rng.random() < server.error_rate:
+            server.count("injected_errors")
+            self.send_payload(server.error_status, b'{"error": "injected by replay server"}', {"Content-Type": "application/json"})
+            return True
+
+        return False
+
+    def do_GET(self): self.dispatch()
+    def do_HEAD(self): self.dispatch()
+    def do_POST(self): self.dispatch()
+    def do_PUT(self): self.dispatch()
+    def do_DELETE(self): self.dispatch()
+
+    def dispatch(self):
+        body = self.read_body()
+
+        if self.inject_faults(): return
+
+        if self.path.startswith("/__replay__"):
+            self.serve_http(body)
+        else:
+            self.serve_s3(body)
+
+    def serve_http(self, body):
+        server = self.server
+        key = self.headers.get("X-Replay-Key")
+
+        with server.lock:
+            entries = server.recorded.get(key)
+
+            if not entries:
+                entry = None
+            else:
+                # identical requests are served in recorded order, the last answer repeats afterwards
+                position = server.positions.get(key, 0)
+                entry = entries[min(position, len(entries) - 1)]
+                server.positions[key] = position + 1
+
+        if entry is None:
+            server.count("misses")
+            print(f"! Replay miss: {self.command} {self.headers.get('X-Replay-Host')} ({key})")
+            self.send_payload(404, b'{"error": "request not found in cassette"}', {"Content-Type": "application/json"})
+            return
+
+        server.count("hits")
+
+        response_body = base64.b64decode(entry["body"])
+
+        # JSON-RPC answers have to carry the id of the incoming request
+        if entry.get("rpc_method") and body:
+            try:
+                request_payload = json.loads(body)
+                response_payload = json.loads(response_body)
+
+                if isinstance(request_payload, dict) and isinstance(response_payload, dict):
+                    response_payload["id"] = request_payload.get("id")
+                    response_body = json.dumps(response_payload).encode("utf-8")
+            except ValueError:
+                pass
+
+        self.send_payload(entry["status"], response_body, entry.get("headers"))
+
+    def s3_path(self, root, bucket, key):
+        return path.join(self.server.cassette_dir, root, bucket, key)
+
+    def find_s3_object(self, bucket, key):
+        for root in (S3_UPLOADS_DIR, S3_OBJECTS_DIR):
+            object_path = self.s3_path(root, bucket, key)
+            if path.isfile(object_path): return object_path
+
+        return None
+
+    def list_s3_objects(self, bucket, prefix):
+        objects = {}
+
+        for root in (S3_OBJECTS_DIR, S3_UPLOADS_DIR):
+            bucket_dir = path.join(self.server.cassette_dir, root, bucket)
+
+            for dir_path, _, filenames in walk(bucket_dir):
+                for filename in filenames:
+                    object_path = path.join(dir_path, filename)
+                    key = path.relpath(object_path, bucket_dir).replace("\\", "/")
+
+                    if key.startswith(prefix): objects[key] = object_path
+
+        return sorted(objects.items())
+
+    def serve_s3(self, body):
+        server = self.server
+        parsed = urlparse(self.path)
+        query = dict(parse_qsl(parsed.query, keep_blank_values=True))
+
+        parts = unquote(parsed.path).lstrip("/").split("/", 1)
+        bucket = parts[0]
+        key = parts[1] if len(parts) > 1 else ""
+
+        server.count("s3_requests")
+
+        if not key and self.command == "GET":
+            self.s3_list(bucket, query)
+        elif self.command in ("GET", "HEAD"):
+            self.s3_get(bucket, key)
+        elif self.command == "PUT" and "uploadId" in query:
+            self.s3_upload_part(query, body)
+        elif self.command == "PUT":
+            self.s3_put(bucket, key, body)
+        elif self.command == "POST" and "uploads" in query:
+            self.s3_create_multipart(bucket, key)
+        elif self.command == "POST" and "uploadId" in query:
+            self.s3_complete_multipart(bucket, key, query)
+        else:
+            self.send_payload(501, b"")
+
+    def s3_list(self, bucket, query):
+        prefix = query.get("prefix", "")
+        start_after = query.get("continuation-token") or query.get("start-after") or ""
+        max_keys = int(query.get("max-keys", 1000))
+
+        objects = [(k, p) for k, p in self.list_s3_objects(bucket, prefix) if k > start_after]
+        page, truncated = objects[:max_keys], len(objects) > max_keys
+
+        contents = "".join(
+            f"<Contents><Key>{escape(k)}</Key><LastModified>{datetime.fromtimestamp(path.getmtime(p), tz=timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.000Z')}</LastModified>"
+            f"<ETag>{escape(s3_etag(p))}</ETag><Size>{path.getsize(p)}</Size><StorageClass>STANDARD</StorageClass></Contents>"
+            for k, p in page
+        )
+
+        next_token = f"<NextContinuationToken>{escape(page[-1][0])}</NextContinuationToken>" if truncated else ""
+
+        xml = (
+            '<?xml version="1.0" encoding="UTF-8"?>'
+            '<ListBucketResult xmlns="http://s3.amazonaws.com/doc/2006-03-01/">'
+            f"<Name>{escape(bucket)}</Name><Prefix>{escape(prefix)}</Prefix><KeyCount>{len(page)}</KeyCount>"
+            f"<MaxKeys>{max_keys}</MaxKeys><IsTruncated>{'true' if truncated else 'false'}</IsTruncated>"
+            f"{contents}{next_token}</ListBucketResult>"
+        )
+
+        self.send_payload(200, xml.encode("utf-8"), {"Content-Type": "application/xml"})
+
+    def s3_get(self, bucket, key):
+        object_path = self.find_s3_object(bucket, key)
+
+        if object_path is None:
+            xml = f'<?xml version="1.0" encoding="UTF-8"?><Error><Code>NoSuchKey</Code><Key>{escape(key)}</Key></Error>'
+            self.send_payload(404, xml.encode("utf-8"), {"Content-Type": "application/xml"})
+            return
+
+        with open(object_path, "rb") as f:
+            content = f.read()
+
+        headers = {
+            "Content-Type": "application/octet-stream",
+            "ETag": s3_etag(object_path),
+            "Last-Modified": http_date(path.getmtime(object_path)),
+            "Accept-Ranges": "bytes",
+        }
+
+        # ranged GETs are used by multipart downloads
+        byte_range = self.headers.get("Range")
+
+        if byte_range and byte_range.startswith("bytes=") and self.command == "GET":
+            start, _, end = byte_range[len("bytes="):].partition("-")
+            start = int(start)
+            end = min(int(end), len(content) - 1) if end else len(content) - 1
+
+            headers["Content-Range"] = f"bytes {start}-{end}/{len(content)}"
+            self.send_payload(206, content[start:end + 1], headers)
+            return
+
+        if self.command == "HEAD":
+            self.send_response(200)
+            for k, v in headers.items(): self.send_header(k, v)
+            self.send_header("Content-Length", str(len(content)))
+            self.end_headers()
+            return
+
+        self.send_payload(200, content, headers)
+
+    def s3_put(self, bucket, key, body):
+        object_path = self.s3_path(S3_UPLOADS_DIR, bucket, key)
+
+        makedirs(path.dirname(object_path), exist_ok=True)
+
+        with open(object_path, "wb") as f:
+            f.write(body)
+
+        self.send_payload(200, b"", {"ETag": s3_etag(object_path)})
+
+    def s3_create_multipart(self, bucket, key):
+        server = self.server
+
+        with server.lock:
+            upload_id = f"replay-{len(server.multipart_uploads) + 1}"
+            server.multipart_uploads[upload_id] = {}
+
+        xml = (
+            '<?xml version="1.0" encoding="UTF-8"?><InitiateMultipartUploadResult>'
+            f"<Bucket>{escape(bucket)}</Bucket><Key>{escape(key)}</Key><UploadId>{upload_id}</UploadId>"
+            "</InitiateMultipartUploadResult>"
+        )
+
+        self.send_payload(200, xml.encode("utf-8"), {"Content-Type": "application/xml"})
+
+    def s3_upload_part(self, query, body):
+        server = self.server
+
+        with server.lock:
+            server.multipart_uploads[query["uploadId"]][int(query["partNumber"])] = body
+
+        self.send_payload(200, b"", {"ETag": f'"{hashlib.md5(body).hexdigest()}"'})
+
+    def s3_complete_multipart(self, bucket, key, query):
+        server = self.server
+
+        with server.lock:
+            parts = server.multipart_uploads.pop(query["uploadId"], {})
+
+        object_path = self.s3_path(S3_UPLOADS_DIR, bucket, key)
+        makedirs(path.dirname(object_path), exist_ok=True)
+
+        with open(object_path, "wb") as f:
+            for part_number in sorted(parts):
+                f.write(parts[part_number])
+
+        xml = (
+            '<?xml version="1.0" encoding="UTF-8"?><CompleteMultipartUploadResult>'
+            f"<Bucket>{escape(bucket)}</Bucket><Key>{escape(key)}</Key><ETag>{escape(s3_etag(object_path))}</ETag>"
+            "</CompleteMultipartUploadResult>"
+        )
+
+        self.send_payload(200, xml.encode("utf-8"), {"Content-Type": "application/xml"})
+
+
+class ReplayServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, cassette_dir, latency_ms=0, jitter_ms=0, error_rate=0, error_status=503, seed=0, verbose=False):
+        super().__init__(address, ReplayHandler)
+
+        self.cassette_dir = path.abspath(cassette_dir)
+        self.recorded = load_http_cassette(self.cassette_dir)
+        self.positions = {}
+        self.multipart_uploads = {}
+        self.stats = {}
+
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.verbose = verbose
+
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+
+    def count(self, name):
+        with self.lock:
+            self.stats[name] = self.stats.get(name, 0) + 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in server that replays a recorded cassette (explorer, RPC, KYC, backend and S3 traffic)")
+
+    parser.add_argument("--cassette", type=str, default="Cassette", help="Cassette directory created with REPLAY_MODE=record")
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-ms", type=float, default=0, help="Injected latency for every request")
+    parser.add_argument("--jitter-ms", type=float, default=0, help="Random +/- deviation of injected latency")
+    parser.add_argument("--error-rate", type=float, default=0, help="Share of requests answered with an injected error (0-1)")
+    parser.add_argument("--error-status", type=int, default=503, help="HTTP status code of injected errors")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of latency/error injection")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Log every request")
+
+    args = parser.parse_args()
+
+    server = ReplayServer((args.host, args.port), args.cassette, args.latency_ms, args.jitter_ms, args.error_rate, args.error_status, args.seed, args.verbose)
+
+    print(f"* Replaying {sum(len(v) for v in server.recorded.values())} recorded HTTP responses from {server.cassette_dir}")
+    print(f"** Listening on http://{args.host}:{args.port} (latency: {args.latency_ms} ms, jitter: {args.jitter_ms} ms, error rate: {args.error_rate})")
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+        print()
+        print("** Stats:", json.dumps(server.stats))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+import re
+import json
+import pickle
+import hashlib
+
+from glob import glob
+from os import path, makedirs, remove, replace
+
+import pandas as pd
+
+from .metrics import increment
+
+
+# Local directory in the main directory, outside the Data tree synced with S3
+RESULTS_DIR_NAME = "Snapshot_Results"
+
+# Source files whose changes invalidate the stored results
+RESULT_CODE_FILES = ["calculate.py", "balances.py", "store.py", "utils.py"]
+
+CODE_VERSION = {
+    "HASH": None,
+}
+
+
+def get_code_version():
+    if CODE_VERSION["HASH"] is None:
+        digest = hashlib.sha256()
+
+        for filename in RESULT_CODE_FILES:
+            with open(path.join(path.dirname(path.abspath(__file__)), filename), "rb") as f:
+                digest.update(f.read())
+
+        CODE_VERSION["HASH"] = digest.hexdigest()
+
+    return CODE_VERSION["HASH"]
+
+
+def fingerprint(inputs):
+    inputs = {**inputs, "code_version": get_code_version()}
+
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True, default=str).encode()).hexdigest()
+
+
+# Gap fills, reorgs and replaced unconfirmed txns can change rows anywhere in the cached txns, all of them are hashed
+def get_txns_version(df_pool_txns):
+    if df_pool_txns is None or df_pool_txns.empty: return None
+
+    return {
+        "count": len(df_pool_txns),
+        "hash": hashlib.sha256(pd.util.hash_pandas_object(df_pool_txns).values.tobytes()).hexdigest(),
+    }
+
+
+def get_lp_history_version(df_lp_history):
+    if df_lp_history is None or df_lp_history.empty: return None
+
+    # calculate() adds a "ratio" column to the shared LP history
+    df_lp_history = df_lp_history.drop(columns=["ratio"], errors="ignore")
+
+    return hashlib.sha256(pd.util.hash_pandas_object(df_lp_history.astype(str)).values.tobytes()).hexdigest()
+
+
+def get_pool_fingerprint(token_name, pool, df_pool_txns, snapshot_timestamps, exclude_list, CALCULATE_SSP, df_lp_history):
+    pool_name, pool_contract, pool_multiplier, pool_contract_owner, target_token, lp_history = pool
+
+    return fingerprint({
+        "token": token_name,
+        "pool": [pool_name, pool_contract, pool_contract_owner, target_token],
+        "multiplier": pool_multiplier,
+        "txns": get_txns_version(df_pool_txns),
+        "snapshot_timestamps": [int(t) for t in snapshot_timestamps],
+        "exclude_list": sorted(str(address) for address in exclude_list),
+        "calculate_ssp": CALCULATE_SSP,
+        "lp_history": get_lp_history_version(df_lp_history),
+    })
+
+
+def get_network_fingerprint(network, token_name, CALCULATE_SSP, pool_fingerprints):
+    return fingerprint({
+        "network": network,
+        "token": token_name,
+        "calculate_ssp": CALCULATE_SSP,
+        "pools": pool_fingerprints,
+    })
+
+
+def get_result_filename(results_dir, result_name, result_fingerprint):
+    return path.join(results_dir, f"{result_name}_{result_fingerprint[:16]}.pkl")
+
+
+def load_result(results_dir, result_name, result_fingerprint):
+    if results_dir is None: return None
+
+    result_filename = get_result_filename(results_dir, result_name, result_fingerprint)
+
+    if not path.isfile(result_filename):
+        increment("result_cache_misses")
+        return None
+
+    try:
+        with open(result_filename, "rb") as f:
+            stored = pickle.load(f)
+    except Exception as err:
+        print(f"! Error: Couldn't load stored result {result_filename} -> {err}")
+        return None
+
+    if stored.get("fingerprint") != result_fingerprint: return None
+
+    increment("result_cache_hits")
+
+    return stored["result"]
+
+
+def save_result(results_dir, result_name, result_fingerprint, result):
+    if results_dir is None: return
+
+    makedirs(results_dir, exist_ok=True)
+
+    result_filename = get_result_filename(results_dir, result_name, result_fingerprint)
+
+    # results of older inputs of the same pool/network can't be used anymore
+    # (exact match, "SFUND_BNB_STAKE_30_*" also matches the files of "SFUND_BNB_STAKE_30_OLD")
+    old_result_pattern = re.compile(re.escape(result_name) + r"_[0-9a-f]{16}\.pkl")
+
+    for old_filename in glob(path.join(results_dir, f"{result_name}_*.pkl")):
+        if old_filename != result_filename and old_result_pattern.fullmatch(path.basename(old_filename)):
+            remove(old_filename)
+
+    temp_filename = result_filename + ".tmp"
+
+    with open(temp_filename, "wb") as f:
+        pickle.dump({"fingerprint": result_fingerprint, "result": result}, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    replace(temp_filename, result_filename)
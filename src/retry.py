@@ -0,0 +1,179 @@
+import random
+import threading
+
+from time import monotonic, time
+from email.utils import parsedate_to_datetime
+
+from .metrics import wait, record_retry, increment, endpoint_name
+
+
+DEFAULT_RETRY_POLICY = {
+    "MAX_RETRIES": 5,
+    # exponential backoff with full jitter: a random delay between 0 and min(MAX_DELAY, BASE_DELAY * 2^retry)
+    "BASE_DELAY": 1,
+    "MAX_DELAY": 30,
+    # longest Retry-After (seconds) that is honored, longer ones fail the request
+    "MAX_RETRY_AFTER": 120,
+    "RETRY_STATUS_CODES": [408, 425, 429, 500, 502, 503, 504],
+    # consecutive failures that open the circuit of a host, and seconds until a test request is let through
+    "FAILURE_THRESHOLD": 5,
+    "RESET_TIMEOUT": 30,
+}
+
+# "DEFAULT" policy and per-host overrides ("HOSTS": {"api.etherscan.io": {...}}) from config.json
+RETRY_SETTINGS = {
+    "DEFAULT": dict(DEFAULT_RETRY_POLICY),
+    "HOSTS": {},
+}
+
+CIRCUIT_BREAKERS = {}
+circuit_breakers_lock = threading.Lock()
+
+
+class CircuitOpenError(ConnectionError):
+    pass
+
+
+def configure_retries(retry_settings):
+    retry_settings = retry_settings or {}
+
+    RETRY_SETTINGS["DEFAULT"] = {**DEFAULT_RETRY_POLICY, **retry_settings.get("DEFAULT", {})}
+    RETRY_SETTINGS["HOSTS"] = retry_settings.get("HOSTS", {})
+
+    with circuit_breakers_lock:
+        CIRCUIT_BREAKERS.clear()
+
+
+def get_retry_policy(endpoint):
+    return {**RETRY_SETTINGS["DEFAULT"], **RETRY_SETTINGS["HOSTS"].get(endpoint_name(endpoint), {})}
+
+
+# Seconds from a Retry-After header (delta seconds or an HTTP date)
+def parse_retry_after(value):
+    if not value: return None
+
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time())
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(policy, retry):
+    return random.uniform(0, min(policy["MAX_DELAY"], policy["BASE_DELAY"] * 2 ** retry))
+
+
+# Closed: requests go through. Open: requests fail at once until RESET_TIMEOUT has passed.
+# Half open: a single test request goes through, its result closes or reopens the circuit
+class CircuitBreaker:
+
+    def __init__(self, host, policy):
+        self.host = host
+        self.failure_threshold = policy["FAILURE_THRESHOLD"]
+        self.reset_timeout = policy["RESET_TIMEOUT"]
+        self.failures = 0
+        self.opened_at = None
+        # a test request without a result (e.g. cancelled) doesn't block the host for longer than RESET_TIMEOUT
+        self.probe_started = None
+        self.lock = threading.Lock()
+
+    def closed_or_testable(self, now):
+        if self.opened_at is None: return True
+        if now - self.opened_at < self.reset_timeout: return False
+
+        return self.probe_started is None or now - self.probe_started >= self.reset_timeout
+
+    def is_open(self):
+        with self.lock:
+            return not self.closed_or_testable(monotonic())
+
+    def allow(self):
+        with self.lock:
+            now = monotonic()
+
+            if not self.closed_or_testable(now): return False
+
+            if self.opened_at is not None:
+                self.probe_started = now
+
+            return True
+
+    def record_success(self):
+        with self.lock:
+            if self.opened_at is not None:
+                print(f"** Circuit of {self.host} is closed again")
+
+            self.failures = 0
+            self.opened_at = None
+            self.probe_started = None
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+
+            if self.probe_started is not None or (self.opened_at is None and self.failures >= self.failure_threshold):
+                self.opened_at = monotonic()
+                self.probe_started = None
+
+                print(f"! Error: {self.host} failed {self.failures} times in a row, its requests fail at once for {self.reset_timeout} seconds")
+                increment("circuits_opened")
+
+
+def get_circuit_breaker(endpoint):
+    host = endpoint_name(endpoint)
+
+    with circuit_breakers_lock:
+        if host not in CIRCUIT_BREAKERS:
+            CIRCUIT_BREAKERS[host] = CircuitBreaker(host, get_retry_policy(endpoint))
+
+        return CIRCUIT_BREAKERS[host]
+
+
+# Retry state of a single request: circuit check before each attempt, backoff (or Retry-After) after each failure
+class RetryPolicy:
+
+    def __init__(self, endpoint, max_retries=None):
+        self.endpoint = endpoint
+        self.policy = get_retry_policy(endpoint)
+        self.max_retries = self.policy["MAX_RETRIES"] if max_retries is None else max_retries
+        self.breaker = get_circuit_breaker(endpoint)
+        self.retry = 0
+
+    def check(self):
+        if self.breaker.allow(): return
+
+        increment("circuit_rejections")
+        raise CircuitOpenError(f"Circuit of {self.breaker.host} is open")
+
+    def is_retryable_status(self, status_code):
+        return status_code in self.policy["RETRY_STATUS_CODES"]
+
+    def success(self):
+        self.breaker.record_success()
+
+    # The host answered, the request itself can't succeed (e.g. 400, 401, 404)
+    def fatal(self):
+        self.breaker.record_success()
+        increment("fatal_request_errors")
+
+    # Waits before the next attempt, False when there are no retries left
+    # (host_failure=False for answers that are unusable but show that the host is up)
+    def failed(self, retry_after=None, host_failure=True):
+        if host_failure:
+            self.breaker.record_failure()
+
+        if self.retry >= self.max_retries: return False
+
+        if retry_after is not None and retry_after > self.policy["MAX_RETRY_AFTER"]: return False
+
+        delay = retry_after if retry_after is not None else backoff_delay(self.policy, self.retry)
+
+        self.retry += 1
+        record_retry(self.endpoint)
+        wait(delay, self.endpoint, "retry_after" if retry_after is not None else "retry")
+
+        return True
@@ -1,57 +1,348 @@
-import boto3
+import json
+import hashlib
+import threading
 from pathlib import Path
-from os import path, makedirs
+from os import path, makedirs, replace
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from .replay import s3_client_options, record_s3_operation
+from .metrics import increment, add_rows, lazy_import
+from .utils import set_remote_file_fetcher
+
+
+S3_MANIFEST_FILENAME = ".s3_manifest.json"
+
+# Number of files transferred at the same time
+S3_MAX_WORKERS = 16
+
+# Large txn caches are transferred in parts
+S3_MULTIPART_THRESHOLD = 64 * 1024 * 1024
+S3_MULTIPART_CHUNKSIZE = 16 * 1024 * 1024
+
+# Files that only describe the local state and are never uploaded or downloaded (e.g. the unconfirmed txn tail
+# of a pool is replaced or removed by every run, a stale copy in the bucket would be verified again)
+S3_LOCAL_ONLY_SUFFIXES = ("_Unconfirmed.csv",)
+
+manifest_lock = threading.Lock()
+
+# boto3 is only imported when a bucket is used
+S3_TRANSFER = {
+    "CONFIG": None,
+}
+
+def get_transfer_config():
+    if S3_TRANSFER["CONFIG"] is None:
+        S3_TRANSFER["CONFIG"] = lazy_import("boto3.s3.transfer").TransferConfig(
+            multipart_threshold=S3_MULTIPART_THRESHOLD,
+            multipart_chunksize=S3_MULTIPART_CHUNKSIZE,
+            max_concurrency=4,
+        )
+
+    return S3_TRANSFER["CONFIG"]
 
 # Initialize an S3 connection
 def initialize_s3():
-    return boto3.Session().resource('s3')
+    return lazy_import("boto3").Session().resource('s3', **s3_client_options())
+
+def initialize_s3_client():
+    return lazy_import("boto3").Session().client('s3', **s3_client_options())
+
+# Manifest of local files that are known to be in sync with the bucket (size, mtime and ETag)
+def load_s3_manifest(base_folder, target_s3_bucket):
+    manifest_path = path.join(base_folder, S3_MANIFEST_FILENAME)
+
+    if path.isfile(manifest_path):
+        try:
+            with open(manifest_path, "r") as json_file:
+                manifest = json.load(json_file)
+
+            if manifest.get("bucket") == target_s3_bucket:
+                return manifest
+        except ValueError:
+            print(f"! Error: {manifest_path} is corrupted, ignoring it")
+
+    return {"bucket": target_s3_bucket, "objects": {}}
+
+def save_s3_manifest(base_folder, manifest):
+    manifest_path = path.join(base_folder, S3_MANIFEST_FILENAME)
+    temp_path = manifest_path + ".tmp"
+
+    with open(temp_path, "w") as json_file:
+        json.dump(manifest, json_file, indent=1, sort_keys=True)
+
+    replace(temp_path, manifest_path)
+
+# Transfers of different pipeline stages can finish at the same time, entries are merged into the latest manifest
+def update_s3_manifest(base_folder, target_s3_bucket, entries):
+    if not entries: return
+
+    with manifest_lock:
+        manifest = load_s3_manifest(base_folder, target_s3_bucket)
+        manifest["objects"].update(entries)
+        save_s3_manifest(base_folder, manifest)
+
+def is_local_only(key):
+    return str(key).endswith(S3_LOCAL_ONLY_SUFFIXES)
+
+def local_file_state(file_path):
+    stat = Path(file_path).stat()
+    return {"size": stat.st_size, "mtime": stat.st_mtime_ns}
+
+# ETag of a local file, the way S3 calculates it for single part and multipart uploads
+def local_etag(file_path, chunk_size=S3_MULTIPART_CHUNKSIZE, threshold=S3_MULTIPART_THRESHOLD):
+    file_size = path.getsize(file_path)
+
+    with open(file_path, "rb") as f:
+        if file_size < threshold:
+            digest = hashlib.md5()
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(chunk)
 
-# Download everything from S3 bucket
-def s3_download_all(target_s3_bucket, destination_folder):
+            return f'"{digest.hexdigest()}"'
+
+        part_digests = [hashlib.md5(chunk).digest() for chunk in iter(lambda: f.read(chunk_size), b"")]
+
+    return f'"{hashlib.md5(b"".join(part_digests)).hexdigest()}-{len(part_digests)}"'
+
+def list_s3_objects(s3_client, target_s3_bucket, prefix=""):
+    objects = {}
+
+    paginator = s3_client.get_paginator("list_objects_v2")
+
+    for page in paginator.paginate(Bucket=target_s3_bucket, Prefix=prefix):
+        for item in page.get("Contents", []):
+            if item["Key"].endswith("/") or is_local_only(item["Key"]): continue
+            objects[item["Key"]] = {"size": item["Size"], "etag": item["ETag"]}
+
+    return objects
+
+def is_local_copy_current(destination_path, remote, known):
+    if not path.isfile(destination_path):
+        return False
+
+    local = local_file_state(destination_path)
+
+    # Remote object didn't change since the last sync, local file is either the same or newer (will be uploaded)
+    if known is not None and known.get("etag") == remote["etag"]:
+        return True
+
+    # No manifest entry yet (first run with the manifest), compare the content
+    if known is None and local["size"] == remote["size"]:
+        return local_etag(destination_path) == remote["etag"]
+
+    return False
+
+# Yields the result of each finished transfer, failed transfers are raised after the others are done
+# (callers record the finished ones first, the stage fails and is retried)
+def run_transfers(tasks, transfer_function, max_workers):
+    if not tasks: return
+
+    failed_keys = []
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(transfer_function, *task): task for task in tasks}
+
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+            except Exception as err:
+                print(f"! Error: S3 transfer failed for {futures[future][0]} -> {err}")
+                failed_keys.append(futures[future][0])
+                continue
+
+            yield result
+
+    if failed_keys:
+        raise IOError(f"{len(failed_keys)} of {len(tasks)} S3 transfers failed: {', '.join(sorted(failed_keys)[:5])}")
+
+# Download new or changed objects from S3 bucket
+def s3_download_all(target_s3_bucket, destination_folder, max_workers=S3_MAX_WORKERS):
+    s3_download_selected(target_s3_bucket, destination_folder, [""], max_workers)
+
+# Download new or changed objects under the given key prefixes
+def s3_download_selected(target_s3_bucket, destination_folder, prefixes, max_workers=S3_MAX_WORKERS):
     if not target_s3_bucket: return
+    if not prefixes: return
 
     print()
-    print("* Downloading all files from", target_s3_bucket, "bucket")
 
-    # connect to S3 bucket
-    s3 = initialize_s3()
-    bucket = s3.Bucket(target_s3_bucket)
+    if prefixes == [""]:
+        print("* Syncing files from", target_s3_bucket, "bucket")
+    else:
+        print("* Syncing files from", target_s3_bucket, "bucket:", ", ".join(prefixes))
+
+    s3_client = initialize_s3_client()
+    manifest = load_s3_manifest(destination_folder, target_s3_bucket)
+
+    remote_objects = {}
+
+    for prefix in prefixes:
+        remote_objects.update(list_s3_objects(s3_client, target_s3_bucket, prefix))
+
+    tasks = []
+    entries = {}
 
-    # Loop through all objects in the bucket
-    for file in bucket.objects.all():
-        destination_path = path.join(destination_folder, file.key)
+    for key, remote in remote_objects.items():
+        destination_path = path.join(destination_folder, key)
+
+        if is_local_copy_current(destination_path, remote, manifest["objects"].get(key)):
+            if key not in manifest["objects"]:
+                entries[key] = {**local_file_state(destination_path), "etag": remote["etag"]}
+            continue
+
+        tasks.append((key, destination_path, remote["etag"]))
+
+    def download(key, destination_path, etag):
         makedirs(path.dirname(destination_path), exist_ok=True)
-        bucket.download_file(file.key, destination_path)
-        print("**", file.key, "downloaded")
+        s3_client.download_file(target_s3_bucket, key, destination_path, Config=get_transfer_config())
+        record_s3_operation("download", target_s3_bucket, key, destination_path)
+        print("**", key, "downloaded")
+
+        return key, {**local_file_state(destination_path), "etag": etag}
+
+    try:
+        for key, entry in run_transfers(tasks, download, max_workers):
+            entries[key] = entry
+    finally:
+        update_s3_manifest(destination_folder, target_s3_bucket, entries)
+
+    skipped = len(remote_objects) - len(tasks)
 
-    print("** Download is complete")
+    increment("s3_downloaded_files", len(tasks))
+    increment("s3_skipped_downloads", skipped)
+    add_rows(len(tasks))
 
-# Upload specific directories to S3
-def s3_upload_specific_folders(target_s3_bucket, folders_list, destination_path_in_s3=""):
+    print(f"** Download is complete ({len(tasks)} downloaded, {skipped} already up-to-date)")
+
+# Fetch files from S3 on demand, when find_file can't locate them locally
+def enable_lazy_hydration(target_s3_bucket, base_folder):
+    if not target_s3_bucket: return
+
+    s3_client = initialize_s3_client()
+    base_folder = path.abspath(base_folder)
+
+    ClientError = lazy_import("botocore.exceptions").ClientError
+
+    missing_keys = set()
+
+    def fetch_missing_file(file_path):
+        if path.commonpath([base_folder, file_path]) != base_folder: return False
+
+        key = path.relpath(file_path, base_folder).replace("\\", "/")
+
+        if key in missing_keys or is_local_only(key): return False
+
+        try:
+            makedirs(path.dirname(file_path), exist_ok=True)
+            s3_client.download_file(target_s3_bucket, key, file_path, Config=get_transfer_config())
+            etag = s3_client.head_object(Bucket=target_s3_bucket, Key=key)["ETag"]
+        except ClientError:
+            missing_keys.add(key)
+            return False
+
+        record_s3_operation("download", target_s3_bucket, key, file_path)
+        increment("s3_lazy_downloads")
+
+        print("**", key, "downloaded from", target_s3_bucket, "bucket")
+
+        update_s3_manifest(base_folder, target_s3_bucket, {key: {**local_file_state(file_path), "etag": etag}})
+
+        return True
+
+    set_remote_file_fetcher(fetch_missing_file)
+
+# Upload new or changed files (keys are relative to base_folder) and record them in the manifest
+def upload_changed_files(s3_client, target_s3_bucket, base_folder, files, max_workers=S3_MAX_WORKERS):
+    manifest = load_s3_manifest(base_folder, target_s3_bucket)
+
+    tasks = []
+
+    files = [(key, file_path) for key, file_path in files if not is_local_only(key)]
+
+    for key, file_path in files:
+        known = manifest["objects"].get(key)
+        local = local_file_state(file_path)
+
+        if known is not None and known["size"] == local["size"] and known["mtime"] == local["mtime"]:
+            continue
+
+        tasks.append((key, str(file_path)))
+
+    def upload(key, file_path):
+        state = local_file_state(file_path)
+
+        s3_client.upload_file(file_path, target_s3_bucket, key, Config=get_transfer_config())
+        record_s3_operation("upload", target_s3_bucket, key, file_path)
+        print("**", key, "uploaded")
+
+        etag = s3_client.head_object(Bucket=target_s3_bucket, Key=key)["ETag"]
+
+        return key, {**state, "etag": etag}
+
+    entries = {}
+
+    try:
+        for key, entry in run_transfers(tasks, upload, max_workers):
+            entries[key] = entry
+    finally:
+        update_s3_manifest(base_folder, target_s3_bucket, entries)
+
+    increment("s3_uploaded_files", len(tasks))
+    increment("s3_skipped_uploads", len(files) - len(tasks))
+    add_rows(len(tasks))
+
+    return len(tasks)
+
+# Upload specific files as soon as they are ready (e.g. the caches and snapshot of a finished network)
+def s3_upload_files(target_s3_bucket, base_folder, file_paths, max_workers=S3_MAX_WORKERS):
+    if not target_s3_bucket: return
+    if not file_paths: return
+
+    s3_client = initialize_s3_client()
+
+    files = []
+
+    for file_path in file_paths:
+        file_path = Path(file_path)
+
+        if file_path.is_dir():
+            files += [(p.relative_to(base_folder).as_posix(), p) for p in file_path.glob("**/*") if p.is_file()]
+        elif file_path.is_file():
+            files.append((file_path.relative_to(base_folder).as_posix(), file_path))
+
+    uploaded = upload_changed_files(s3_client, target_s3_bucket, base_folder, files, max_workers)
+
+    print(f"** Uploaded {uploaded} of {len(files)} files to {target_s3_bucket} bucket")
+
+# Upload new or changed files of specific directories to S3
+def s3_upload_specific_folders(target_s3_bucket, folders_list, destination_path_in_s3="", max_workers=S3_MAX_WORKERS):
     if not target_s3_bucket: return
     if not folders_list: return
 
-    # connect to S3 bucket
-    s3 = initialize_s3()
-    bucket = s3.Bucket(target_s3_bucket)
+    s3_client = initialize_s3_client()
 
     print()
-    print("* Uploading folders to", target_s3_bucket, "bucket")
+    print("* Syncing folders to", target_s3_bucket, "bucket")
 
     if destination_path_in_s3 != "":
         destination_path_in_s3 = destination_path_in_s3 + "/"
 
+    base_folder = str(Path(folders_list[0]).parent)
+
+    files = []
+
     for folder_path in folders_list:
         folder = Path(folder_path)  # Specify each folder
         if folder.is_dir():
             for file_path in folder.glob("**/*"):  # Recursively find all files in the folder
                 if file_path.is_file():
                     # Determine the key for the S3 object (relative path within the folder)
-                    key = destination_path_in_s3 + str(file_path.relative_to(folder.parent))
-                    # Upload the file to S3
-                    bucket.upload_file(str(file_path), key)
-                    print("**", key, "uploaded")
+                    key = destination_path_in_s3 + file_path.relative_to(folder.parent).as_posix()
+
+                    files.append((key, file_path))
         else:
             print(f"! Error: {folder} is not a valid directory")
 
-    print("** Upload is complete")
\ No newline at end of file
+    uploaded = upload_changed_files(s3_client, target_s3_bucket, base_folder, files, max_workers)
+
+    print(f"** Upload is complete ({uploaded} uploaded, {len(files) - uploaded} unchanged)")
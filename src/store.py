@@ -0,0 +1,546 @@
+import sqlite3
+import threading
+import argparse
+
+from os import path
+from bisect import bisect_left
+from decimal import Decimal
+
+import numpy as np
+import pandas as pd
+
+from .metrics import increment
+from .utils import checkAddress, timestamp_to_date_str
+from .balances import BalanceHistory, build_balance_history
+
+
+DEFAULT_STORE_SETTINGS = {
+    "ENABLED": False,
+    # local database file in the main directory, it isn't uploaded to S3 (it can be rebuilt from the cache files)
+    "FILENAME": "Snapshot_Store.sqlite",
+}
+
+# Token amounts don't fit into 64-bit integers, they are stored as text and summed as Python integers
+STORE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS transfers (
+    network TEXT NOT NULL,
+    pool TEXT NOT NULL,
+    wallet TEXT NOT NULL,
+    timeStamp INTEGER NOT NULL,
+    blockNumber INTEGER NOT NULL,
+    seq INTEGER NOT NULL,
+    value TEXT NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS transfers_pool_wallet_time ON transfers (network, pool, wallet, timeStamp, seq);
+
+CREATE TABLE IF NOT EXISTS synced_pools (
+    network TEXT NOT NULL,
+    pool TEXT NOT NULL,
+    txns INTEGER NOT NULL,
+    fingerprint TEXT NOT NULL,
+    lastBlock INTEGER NOT NULL,
+    syncedTimestamp INTEGER NOT NULL,
+    PRIMARY KEY (network, pool)
+);
+
+CREATE TABLE IF NOT EXISTS balance_changes (
+    network TEXT NOT NULL,
+    pool TEXT NOT NULL,
+    wallet TEXT NOT NULL,
+    timeStamp INTEGER NOT NULL,
+    balance TEXT NOT NULL,
+    PRIMARY KEY (network, pool, wallet, timeStamp)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS lp_history (
+    network TEXT NOT NULL,
+    lp TEXT NOT NULL,
+    token TEXT NOT NULL,
+    timeStamp INTEGER NOT NULL,
+    lpAmount TEXT NOT NULL,
+    tokenAmount TEXT NOT NULL,
+    PRIMARY KEY (network, lp, token, timeStamp)
+);
+
+CREATE TABLE IF NOT EXISTS snapshot_blocks (
+    network TEXT NOT NULL,
+    timeStamp INTEGER NOT NULL,
+    blockNumber INTEGER NOT NULL,
+    PRIMARY KEY (network, timeStamp)
+);
+
+CREATE TABLE IF NOT EXISTS balances (
+    network TEXT NOT NULL,
+    pool TEXT NOT NULL,
+    wallet TEXT NOT NULL,
+    timeStamp INTEGER NOT NULL,
+    balance TEXT NOT NULL,
+    balanceFloat REAL NOT NULL,
+    PRIMARY KEY (network, pool, wallet, timeStamp)
+);
+
+CREATE INDEX IF NOT EXISTS balances_pool_time ON balances (network, pool, timeStamp, balanceFloat);
+"""
+
+TRANSFER_COLUMNS = ["blockNumber", "timeStamp", "from", "to", "value"]
+
+# Store of the run, None when it isn't enabled
+STORE = {"STORE": None}
+
+
+# Cumulative fingerprint after each txn, the stored txns are a prefix of a frame when the fingerprints match at their count
+def get_transfer_fingerprints(df_pool_txns):
+    row_hashes = pd.util.hash_pandas_object(df_pool_txns[TRANSFER_COLUMNS].astype(str), index=False).values
+
+    return np.cumsum(row_hashes, dtype=np.uint64)
+
+
+# Change points at the snapshot timestamps from (wallet, timestamp, balance) rows in (wallet, timestamp) order,
+# a balance counts from the first snapshot timestamp at or after it, the last change before a snapshot timestamp wins
+def balance_history_from_changes(change_rows, unique_wallets, snapshot_timestamps):
+    timestamps = [int(timestamp) for timestamp in snapshot_timestamps]
+    change_points = {}
+
+    for wallet, timestamp, balance in change_rows:
+        wallet_changes = change_points.setdefault(wallet, [])
+        index = bisect_left(timestamps, timestamp)
+        balance = int(balance)
+
+        if wallet_changes and wallet_changes[-1][0] == index:
+            wallet_changes.pop()
+
+        if balance != (wallet_changes[-1][1] if wallet_changes else 0):
+            wallet_changes.append((index, balance))
+
+    return BalanceHistory(unique_wallets, snapshot_timestamps, change_points)
+
+
+# Embedded database of transfers, LP history, snapshot blocks and pool balances (one connection per thread)
+class SnapshotStore:
+    def __init__(self, filename):
+        self.filename = filename
+
+        self.local = threading.local()
+        self.connections = []
+
+        # writes of the pipeline threads are serialized, reads run at the same time (WAL)
+        self.write_lock = threading.Lock()
+
+        with self.write_lock:
+            self.connection().executescript(STORE_SCHEMA)
+
+    def connection(self):
+        connection = getattr(self.local, "connection", None)
+
+        if connection is None:
+            connection = sqlite3.connect(self.filename, timeout=60, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+
+            self.local.connection = connection
+            self.connections.append(connection)
+
+        return connection
+
+    def close(self):
+        for connection in self.connections:
+            connection.close()
+
+        self.connections = []
+        self.local = threading.local()
+
+    # ------------------------------
+
+    # Txns of a pool are appended when the stored ones are a prefix of them, replaced otherwise (gap fill, reorg),
+    # the balance change points of the pool are updated in the same transaction. Txns of an earlier snapshot that are
+    # a prefix of the stored ones are kept as they are (the stored txns go further).
+    def sync_transfers(self, network, pool, df_pool_txns, synced_timestamp):
+        if df_pool_txns is None: return 0
+
+        fingerprints = get_transfer_fingerprints(df_pool_txns)
+
+        fingerprint = str(fingerprints[-1]) if len(fingerprints) > 0 else "0"
+        last_block = int(df_pool_txns["blockNumber"].max()) if len(df_pool_txns) > 0 else 0
+
+        connection = self.connection()
+
+        with self.write_lock:
+            synced = connection.execute("SELECT txns, fingerprint FROM synced_pools WHERE network = ? AND pool = ?", (network, pool)).fetchone()
+
+            if synced is not None and synced[0] == len(df_pool_txns) and synced[1] == fingerprint:
+                with connection:
+                    connection.execute("UPDATE synced_pools SET syncedTimestamp = ? WHERE network = ? AND pool = ?", (int(synced_timestamp), network, pool))
+
+                return 0
+
+            if synced is not None and synced[0] > len(df_pool_txns) and self.stored_fingerprint(connection, network, pool, len(df_pool_txns)) == fingerprint:
+                print(f"** Store: {pool} is synced beyond the snapshot ({synced[0]} txns), the stored txns are kept")
+
+                return 0
+
+            if synced is not None and 0 < synced[0] <= len(df_pool_txns) and synced[1] == str(fingerprints[synced[0] - 1]):
+                first_row = synced[0]
+            else:
+                first_row = 0
+
+            with connection:
+                if first_row == 0:
+                    connection.execute("DELETE FROM transfers WHERE network = ? AND pool = ?", (network, pool))
+                    connection.execute("DELETE FROM balance_changes WHERE network = ? AND pool = ?", (network, pool))
+
+                connection.executemany(
+                    "INSERT INTO transfers (network, pool, wallet, timeStamp, blockNumber, seq, value) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    self.transfer_rows(network, pool, df_pool_txns, first_row)
+                )
+
+                self.update_balance_changes(connection, network, pool, first_row)
+
+                connection.execute(
+                    "INSERT OR REPLACE INTO synced_pools (network, pool, txns, fingerprint, lastBlock, syncedTimestamp) VALUES (?, ?, ?, ?, ?, ?)",
+                    (network, pool, len(df_pool_txns), fingerprint, last_block, int(synced_timestamp))
+                )
+
+        synced_txns = len(df_pool_txns) - first_row
+        increment("store_synced_txns", synced_txns)
+
+        print(f"** Store: {'appended' if first_row > 0 else 'loaded'} {synced_txns} txns of {pool}")
+
+        return synced_txns
+
+    # Fingerprint of the first stored txns of a pool, rebuilt from the sender side (+value) and receiver side of each txn
+    def stored_fingerprint(self, connection, network, pool, txn_count):
+        if txn_count == 0: return "0"
+
+        rows = connection.execute(
+            "SELECT seq, blockNumber, timeStamp, wallet, value FROM transfers WHERE network = ? AND pool = ? AND seq < ? ORDER BY seq",
+            (network, pool, 2 * txn_count)
+        ).fetchall()
+
+        if len(rows) != 2 * txn_count: return None
+
+        df_stored_txns = pd.DataFrame({
+            "blockNumber": [row[1] for row in rows[1::2]],
+            "timeStamp": [row[2] for row in rows[1::2]],
+            "from": [row[3] for row in rows[1::2]],
+            "to": [row[3] for row in rows[0::2]],
+            "value": [row[4] for row in rows[1::2]],
+        })
+
+        return str(get_transfer_fingerprints(df_stored_txns)[-1])
+
+    # Both sides of a txn, sent to the pool (+value) and received from it (-value), in the order of filter_txns()
+    def transfer_rows(self, network, pool, df_pool_txns, first_row):
+        columns = [df_pool_txns[column].values[first_row:] for column in TRANSFER_COLUMNS]
+
+        for seq, (block_number, timestamp, from_wallet, to_wallet, value) in enumerate(zip(*columns), start=first_row):
+            value = int(value)
+
+            yield (network, pool, to_wallet, int(timestamp), int(block_number), 2 * seq, str(-value))
+            yield (network, pool, from_wallet, int(timestamp), int(block_number), 2 * seq + 1, str(value))
+
+    # Clamped balance of a wallet after each timestamp it changed at, continued from the last change point for appended txns
+    def update_balance_changes(self, connection, network, pool, first_row):
+        cursor = connection.execute(
+            "SELECT wallet, timeStamp, value FROM transfers WHERE network = ? AND pool = ? AND seq >= ? AND wallet != pool ORDER BY wallet, timeStamp, seq",
+            (network, pool, 2 * first_row)
+        )
+
+        change_points = []
+
+        current_wallet = None
+        current_timestamp = None
+
+        def close_timestamp():
+            if balance != last_balance:
+                change_points.append((network, pool, current_wallet, current_timestamp, str(balance)))
+
+            return balance
+
+        for wallet, timestamp, value in cursor:
+            if wallet != current_wallet or timestamp != current_timestamp:
+                if current_wallet is not None: last_balance = close_timestamp()
+
+                if wallet != current_wallet:
+                    last_change = None
+
+                    if first_row > 0:
+                        last_change = connection.execute(
+                            "SELECT balance FROM balance_changes WHERE network = ? AND pool = ? AND wallet = ? ORDER BY timeStamp DESC LIMIT 1",
+                            (network, pool, wallet)
+                        ).fetchone()
+
+                    last_balance = 0 if last_change is None else int(last_change[0])
+                    balance = last_balance
+
+                current_wallet = wallet
+                current_timestamp = timestamp
+
+            balance = max(0, balance + int(value))
+
+        if current_wallet is not None: close_timestamp()
+
+        connection.executemany("INSERT OR REPLACE INTO balance_changes (network, pool, wallet, timeStamp, balance) VALUES (?, ?, ?, ?, ?)", change_points)
+
+    # Balance change points of the wallets at the snapshot timestamps (same as filter_txns() + process_txns()),
+    # read from balance_changes (aggregated while syncing) instead of folding the transfers of the pool again
+    def pool_balances(self, network, pool, snapshot_timestamps, exclude_list, last_block):
+        exclude_list = [wallet for wallet in exclude_list if wallet is not None]
+        exclude_condition = f"wallet NOT IN ({', '.join('?' * len(exclude_list))})" if exclude_list else "1"
+
+        connection = self.connection()
+
+        unique_wallets = [row[0] for row in connection.execute(
+            f"SELECT DISTINCT wallet FROM transfers WHERE network = ? AND pool = ? AND blockNumber <= ? AND {exclude_condition} ORDER BY wallet",
+            (network, pool, last_block, *exclude_list)
+        )]
+
+        if len(unique_wallets) == 0:
+            print()
+            print("** Error: no txns of the pool in the store")
+            print()
+
+            return None
+
+        # txns after the snapshot block with the snapshot timestamp (blocks of the same second) are in the change points
+        # of a pool synced beyond the snapshot, its transfers up to the snapshot block are folded instead
+        later_txns = connection.execute(
+            "SELECT 1 FROM transfers WHERE network = ? AND pool = ? AND blockNumber > ? AND timeStamp <= ? LIMIT 1",
+            (network, pool, last_block, int(snapshot_timestamps[-1]))
+        ).fetchone()
+
+        if later_txns is None:
+            cursor = connection.execute(
+                f"SELECT wallet, timeStamp, balance FROM balance_changes WHERE network = ? AND pool = ? AND timeStamp <= ? AND {exclude_condition} ORDER BY wallet, timeStamp",
+                (network, pool, int(snapshot_timestamps[-1]), *exclude_list)
+            )
+
+            print("* Reading balance changes of", len(unique_wallets), "unique wallets from the store")
+
+            balance_history = balance_history_from_changes(cursor, unique_wallets, snapshot_timestamps)
+        else:
+            cursor = connection.execute(
+                f"SELECT wallet, timeStamp, value FROM transfers WHERE network = ? AND pool = ? AND blockNumber <= ? AND timeStamp <= ? AND {exclude_condition} ORDER BY wallet, timeStamp, seq",
+                (network, pool, last_block, int(snapshot_timestamps[-1]), *exclude_list)
+            )
+
+            print("* Aggregating transactions of", len(unique_wallets), "unique wallets in the store")
+
+            balance_history = build_balance_history(cursor, unique_wallets, snapshot_timestamps)
+
+        print("**", balance_history.change_count(), "balance changes")
+
+        return balance_history
+
+    # ------------------------------
+
+    # Non-zero balances of the snapshot timestamp (the SSP period is computed from the transfers again)
+    def save_balances(self, network, pool, balance_history):
+        if balance_history is None: return
+
+        snapshot_timestamp = int(balance_history.snapshot_timestamps[-1])
+
+        rows = [
+            (network, pool, wallet, snapshot_timestamp, str(balance), float(balance))
+            for wallet, balance in balance_history.final_balances().items()
+            if balance > 0
+        ]
+
+        connection = self.connection()
+
+        with self.write_lock, connection:
+            connection.execute("DELETE FROM balances WHERE network = ? AND pool = ? AND timeStamp = ?", (network, pool, snapshot_timestamp))
+            connection.executemany("INSERT INTO balances (network, pool, wallet, timeStamp, balance, balanceFloat) VALUES (?, ?, ?, ?, ?, ?)", rows)
+
+    # LP supply and the amount of the token in the LP, per snapshot timestamp
+    def save_lp_history(self, network, lp, token, df_lp_history):
+        if df_lp_history is None: return
+
+        rows = [
+            (network, lp, token, int(timestamp), str(int(row["lpAmount"])), str(int(row["tokenAmount"])))
+            for timestamp, row in df_lp_history.iterrows()
+            if pd.notna(row["lpAmount"]) and pd.notna(row["tokenAmount"])
+        ]
+
+        connection = self.connection()
+
+        with self.write_lock, connection:
+            connection.executemany("INSERT OR REPLACE INTO lp_history (network, lp, token, timeStamp, lpAmount, tokenAmount) VALUES (?, ?, ?, ?, ?, ?)", rows)
+
+    def save_snapshot_block(self, network, timestamp, block_number):
+        connection = self.connection()
+
+        with self.write_lock, connection:
+            connection.execute("INSERT OR REPLACE INTO snapshot_blocks (network, timeStamp, blockNumber) VALUES (?, ?, ?)", (network, int(timestamp), int(block_number)))
+
+    # Balance of a wallet in every synced pool at a timestamp, one index seek per pool
+    def wallet_balances(self, wallet, timestamp):
+        return self.connection().execute(
+            """
+            SELECT network, pool, syncedTimestamp, (
+                SELECT balance FROM balance_changes
+                WHERE balance_changes.network = synced_pools.network AND balance_changes.pool = synced_pools.pool
+                    AND wallet = ? AND timeStamp <= ?
+                ORDER BY timeStamp DESC LIMIT 1
+            )
+            FROM synced_pools ORDER BY network, pool
+            """,
+            (wallet, int(timestamp))
+        ).fetchall()
+
+    # (lpAmount, tokenAmount) of the latest LP history record at or before a timestamp
+    def lp_amounts(self, network, lp, token, timestamp):
+        lp_record = self.connection().execute(
+            "SELECT lpAmount, tokenAmount FROM lp_history WHERE network = ? AND lp = ? AND token = ? AND timeStamp <= ? ORDER BY timeStamp DESC LIMIT 1",
+            (network, lp, token, int(timestamp))
+        ).fetchone()
+
+        if lp_record is None: return None
+
+        return int(lp_record[0]), int(lp_record[1])
+
+    def query(self, sql, parameters=()):
+        return pd.read_sql_query(sql, self.connection(), params=parameters)
+
+
+# ------------------------------
+
+
+def open_store(store_settings, main_dir):
+    store_settings = {**DEFAULT_STORE_SETTINGS, **(store_settings or {})}
+
+    if not store_settings["ENABLED"]:
+        STORE["STORE"] = None
+        return None
+
+    store_filename = path.join(main_dir, store_settings["FILENAME"])
+
+    print(f"* Using the snapshot store: {store_filename}")
+
+    STORE["STORE"] = SnapshotStore(store_filename)
+
+    return STORE["STORE"]
+
+
+def get_store():
+    return STORE["STORE"]
+
+
+def close_store():
+    if STORE["STORE"] is not None:
+        STORE["STORE"].close()
+        STORE["STORE"] = None
+
+
+# Pool names and LP contracts of tokens.json, and the token contracts of each network
+def get_pool_details(all_tokens_dict):
+    pool_details = {}
+    token_contracts = {}
+
+    for token_name, token in all_tokens_dict.items():
+        for network, token_details in token.items():
+            if network == "TIERS": continue
+
+            token_contracts.setdefault(network, []).append((token_name, checkAddress(token_details["contract"])))
+
+            for pool_type in ("stake", "farm"):
+                for pool_name, pool_contract, pool_multiplier in token_details.get(pool_type, []):
+                    pool_details[(network, checkAddress(pool_contract))] = (token_name, pool_type, pool_name, checkAddress(token_details["lp_contract"]))
+
+    return pool_details, token_contracts
+
+
+# Balances of a wallet in every synced pool on every network at a timestamp, from the balance change points
+def lookup_wallet(store_settings, main_dir, all_tokens_dict, wallet, timestamp):
+    store_settings = {**DEFAULT_STORE_SETTINGS, **(store_settings or {})}
+    store_filename = path.join(main_dir, store_settings["FILENAME"])
+
+    wallet_address = checkAddress(wallet)
+
+    if wallet_address is None:
+        print(f"! Error: Invalid wallet address -> {wallet}")
+        return
+
+    if not path.isfile(store_filename):
+        print(f"! Error: Couldn't locate the store file, enable STORE in config.json and run a snapshot first -> {store_filename}")
+        return
+
+    pool_details, token_contracts = get_pool_details(all_tokens_dict)
+
+    store = SnapshotStore(store_filename)
+
+    try:
+        pool_balances = store.wallet_balances(wallet_address, timestamp)
+
+        print()
+        print(f"* Balances of {wallet_address} at {timestamp_to_date_str(timestamp)} UTC ({int(timestamp)})")
+        print()
+
+        if len(pool_balances) == 0:
+            print("** The store doesn't have any synced pools yet")
+            return
+
+        token_totals = {}
+
+        for network, pool, synced_timestamp, balance in pool_balances:
+            token_name, pool_type, pool_name, lp_contract = pool_details.get((network, pool), (None, None, pool, None))
+
+            amount = Decimal(int(balance or 0)) / Decimal(10**18)
+            token_amounts = []
+
+            if pool_type == "stake":
+                token_amounts.append((token_name, amount))
+            elif lp_contract is not None:
+                # LP amounts are converted for every token of the pair with an LP history (same as the snapshot)
+                for other_token_name, token_contract in token_contracts.get(network, []):
+                    lp_amounts = store.lp_amounts(network, lp_contract, token_contract, timestamp)
+
+                    if lp_amounts is None or lp_amounts[0] == 0: continue
+
+                    token_amounts.append((other_token_name, amount * Decimal(lp_amounts[1]) / Decimal(lp_amounts[0])))
+
+            for other_token_name, token_amount in token_amounts:
+                token_totals[other_token_name] = token_totals.get(other_token_name, Decimal(0)) + token_amount
+
+            unit = token_name if pool_type == "stake" else ("LP" if pool_type == "farm" else "")
+            converted = ", ".join(f"{token_amount:,.4f} {other_token_name}" for other_token_name, token_amount in token_amounts if pool_type != "stake")
+            synced = f"  (synced until {timestamp_to_date_str(synced_timestamp)})" if timestamp > synced_timestamp else ""
+
+            print((f"   {network:<10} {pool_name:<32} {amount:>24,.4f} {unit:<6}" + (f" = {converted}" if converted else "")).rstrip() + synced)
+
+        print()
+        print("* Totals")
+        print()
+
+        for token_name, token_amount in token_totals.items():
+            print(f"   {token_name:<10} {token_amount:,.4f}")
+    finally:
+        store.close()
+
+
+# ------------------------------
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ad-hoc SQL queries on the snapshot store (tables: transfers, lp_history, snapshot_blocks, balances)")
+
+    parser.add_argument("query", type=str, help="SQL query, e.g. \"SELECT wallet, balance FROM balances WHERE pool = '0x...' ORDER BY balanceFloat DESC LIMIT 10\"")
+    parser.add_argument("--store", type=str, default=DEFAULT_STORE_SETTINGS["FILENAME"], help="Store file")
+
+    args = parser.parse_args()
+
+    if not path.isfile(args.store):
+        print(f"! Error: Couldn't locate the store file -> {args.store}")
+        return
+
+    store = SnapshotStore(args.store)
+
+    try:
+        with pd.option_context("display.max_rows", None, "display.max_columns", None, "display.width", None):
+            print(store.query(args.query).to_string(index=False))
+    finally:
+        store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+import numpy as np
+import pandas as pd
+
+from decimal import Decimal
+
+
+BENCHMARK_SCALES = {
+    "small": {"TRANSFERS": 10_000, "WALLETS": 5_000},
+    "medium": {"TRANSFERS": 100_000, "WALLETS": 50_000},
+    "large": {"TRANSFERS": 1_000_000, "WALLETS": 500_000},
+}
+
+KYC_STATUSES = ["approved", "approved", "approved", "inreview", "waiting", "rejected"]
+
+
+def random_addresses(rng, count):
+    raw = rng.integers(0, 256, size=(count, 20), dtype=np.uint8)
+    return np.array(["0x" + row.tobytes().hex() for row in raw], dtype=object)
+
+
+def generate_wallets(wallet_count, seed=0):
+    rng = np.random.default_rng(seed)
+    return random_addresses(rng, wallet_count)
+
+
+def generate_snapshot_timestamps(ssp_period=90, end_timestamp=1735736400, daily_epoch_diff=86400):
+    start_timestamp = end_timestamp - ( ( ssp_period - 1 ) * daily_epoch_diff )
+    return np.linspace(start_timestamp, end_timestamp, ssp_period, dtype=np.int64)
+
+
+def generate_pool_txns(transfer_count, wallets, pool_contract, snapshot_timestamps, seed=0):
+    rng = np.random.default_rng(seed)
+
+    wallet_idx = rng.integers(0, len(wallets), size=transfer_count)
+    txn_wallets = wallets[wallet_idx]
+
+    # history starts one year before the SSP period, so the first snapshot column already has balances
+    start_timestamp = int(snapshot_timestamps[0]) - 365 * 86400
+    end_timestamp = int(snapshot_timestamps[-1])
+
+    timestamps = np.sort(rng.integers(start_timestamp, end_timestamp, size=transfer_count))
+    block_numbers = 10_000_000 + (timestamps - start_timestamp) // 3
+
+    # roughly 70% deposits (wallet -> pool) and 30% withdrawals (pool -> wallet)
+    is_deposit = rng.random(transfer_count) < 0.7
+    values = rng.integers(1, 50_000, size=transfer_count).astype(object) * (10 ** 18)
+
+    txn_from = np.where(is_deposit, txn_wallets, pool_contract)
+    txn_to = np.where(is_deposit, pool_contract, txn_wallets)
+
+    return pd.DataFrame({
+        "blockNumber": block_numbers,
+        "timeStamp": timestamps,
+        "from": txn_from,
+        "to": txn_to,
+        "value": values,
+    })
+
+
+def generate_lp_history(snapshot_timestamps, seed=0):
+    rng = np.random.default_rng(seed)
+
+    lp_amounts = rng.integers(1_000_000, 2_000_000, size=len(snapshot_timestamps)).astype(object) * (10 ** 18)
+    token_amounts = rng.integers(5_000_000, 9_000_000, size=len(snapshot_timestamps)).astype(object) * (10 ** 18)
+
+    df_lp_history = pd.DataFrame({"lpAmount": lp_amounts, "tokenAmount": token_amounts}, index=snapshot_timestamps)
+    df_lp_history.index.name = "timeStamp"
+
+    return df_lp_history
+
+
+def generate_pool_snapshots(wallets, token_name, pool_count=4, farm_count=1, CALCULATE_SSP=True, seed=0):
+    rng = np.random.default_rng(seed)
+
+    snapshot_list = []
+
+    for pool_idx in range(pool_count + farm_count):
+        is_farm = pool_idx >= pool_count
+        pool_name = f"{token_name}_BNB_{'FARM' if is_farm else 'STAKE'}_{pool_idx}"
+
+        pool_wallets = wallets[rng.random(len(wallets)) < 0.5]
+        balances = rng.integers(0, 100_000, size=len(pool_wallets)).astype(object) * (10 ** 18)
+
+        df_pool_snapshot = pd.DataFrame(index=pool_wallets)
+        df_pool_snapshot[f"{token_name} ({pool_name})"] = [Decimal(int(x)) for x in balances]
+
+        if is_farm:
+            df_pool_snapshot[f"LP ({pool_name})"] = [Decimal(int(x)) for x in balances // 5]
+
+        if CALCULATE_SSP:
+            df_pool_snapshot[f"SSP ({pool_name})"] = [Decimal(int(x)) * 90 for x in balances // 100]
+
+        snapshot_list.append(df_pool_snapshot)
+
+    return snapshot_list
+
+
+def generate_combined_snapshot(wallets, token_name, networks=("ARB", "BNB", "ETH"), CALCULATE_SSP=True, seed=0):
+    rng = np.random.default_rng(seed)
+
+    df_snapshot = pd.DataFrame(index=pd.Index(wallets, name="Wallet"))
+
+    for network in networks:
+        balances = rng.integers(0, 150_000, size=len(wallets))
+        df_snapshot[f"{network} - {token_name}"] = [Decimal(int(x)) for x in balances]
+
+        if CALCULATE_SSP:
+            df_snapshot[f"{network} - SSP"] = [Decimal(int(x)) for x in balances * 90 // 100]
+
+    return df_snapshot
+
+
+def generate_kyc_export(wallets, seed=0):
+    rng = np.random.default_rng(seed)
+
+    kyc_wallets = wallets[rng.random(len(wallets)) < 0.6]
+    record_count = len(kyc_wallets)
+
+    # a few applicants verify more than once with the same wallet
+    duplicates = kyc_wallets[rng.random(record_count) < 0.05]
+    ref_ids = np.concatenate([kyc_wallets, duplicates])
+    record_count = len(ref_ids)
+
+    statuses = np.array(KYC_STATUSES, dtype=object)[rng.integers(0, len(KYC_STATUSES), size=record_count)]
+
+    df_kyc = pd.DataFrame({
+        "refId": ref_ids,
+        "wallet": ref_ids,
+        "status": statuses,
+        "recordId": [f"rec{x:012d}" for x in range(record_count)],
+        "blockPassID": [f"bp{x:012d}" for x in range(record_count)],
+        "inreviewDate": "",
+        "waitingDate": "",
+        "approvedDate": "",
+    })
+
+    return df_kyc.set_index("refId")
+
+
+def generate_registrations(wallets, seed=0):
+    rng = np.random.default_rng(seed)
+
+    registered = wallets[rng.random(len(wallets)) < 0.3]
+
+    return pd.DataFrame(index=pd.Index(registered, name="primaryWallet"))
+
+
+def generate_wallet_delegations(wallets, seed=0, delegation_ratio=0.02):
+    rng = np.random.default_rng(seed)
+
+    delegation_count = int(len(wallets) * delegation_ratio)
+    picked = rng.choice(len(wallets), size=delegation_count * 2, replace=False)
+
+    primary = wallets[picked[:delegation_count]]
+    delegated = wallets[picked[delegation_count:]]
+
+    df_wallet_delegation = pd.DataFrame({"delegatedWallet": delegated}, index=pd.Index(primary, name="primaryWallet"))
+
+    return df_wallet_delegation
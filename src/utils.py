@@ -4,16 +4,18 @@ import sys
 import json
 import argparse
 
+from contextlib import contextmanager
+
 from os import remove, path, getcwd, chdir, makedirs, name as osname, system
 from datetime import datetime, timezone, timedelta
 from time import sleep, time
 from decimal import Decimal
-from glob import glob
-from web3 import Web3
+from glob import glob, has_magic
 from sys import exit
 
-import numpy as np
-import pandas as pd
+from .keccak import to_checksum_address
+
+# numpy/pandas are imported by the functions that use them, "--help" and argument parsing don't load them
 
 
 def clear(): system('cls' if osname == 'nt' else 'clear'); print()
@@ -115,6 +117,8 @@ def set_snapshot_timestamps(snapshot_datetime, daily_epoch_diff, ssp_period=0):
     if ssp_period < 1:
         ssp_period = 1
 
+    import numpy as np
+
     snapshot_timestamp = date_to_timestamp(snapshot_datetime)
 
     end_timestamp = snapshot_timestamp
@@ -143,6 +147,106 @@ def initialize_token(data_dir, all_tokens_dict, token_name, network):
     return token_dir, token_contract, lp_contract, stakes, farms
 
 
+# Explorer, RPC and timing settings of a network, shared by the pipeline stages of a token and the follow mode
+def create_network_settings(settings, network):
+    temp_settings = {
+        "NETWORK": network,
+        "SNAPSHOT_TIMESTAMP": settings.get("SNAPSHOT_TIMESTAMP"),
+        "SNAPSHOT_BLOCK_NUMBER": None,
+        "SEED_STAKING_START_TIMESTAMP": None,
+        "API_URL": None,
+        "API_KEY": None,
+        "RPC_NODES": None,
+        "CUR_RPC_NODE_IDX": None,
+        "MAX_RPC_TRY": None,
+        "DAILY_EPOCH_DIFF": settings["DAILY_EPOCH_DIFF"],
+        "API_CALL_DELAY": settings["NETWORK"]["API_CALL_DELAY"],
+    }
+
+    temp_settings["CHAIN_ID"] = settings["NETWORK"][network]["CHAIN_ID"]
+
+    if settings["NETWORK"][network]["CHAIN_ID"] == "":
+        temp_settings["API_URL"] = settings["NETWORK"][network]["API_URL"]
+        temp_settings["API_KEY"] = settings["NETWORK"][network]["API_KEY"]
+    else:
+        temp_settings["API_URL"] = settings["NETWORK"]["MULTICHAIN_API_URL"]
+        temp_settings["API_KEY"] = settings["NETWORK"]["MULTICHAIN_API_KEY"]
+
+    # explorer calls are spread over the keys of the explorer, each key with its own rate budget and daily quota
+    temp_settings["EXPLORER_KEYS"] = settings["NETWORK"].get("EXPLORER_KEYS")
+
+    temp_settings["RPC_NODES"] = settings["NETWORK"][network]["RPC_NODES"]
+
+    # txns with fewer confirmations are fetched again (and compared) by the next run
+    temp_settings["CONFIRMATIONS"] = settings["NETWORK"][network].get("CONFIRMATIONS")
+    temp_settings["RPC_HEDGING"] = settings["NETWORK"].get("RPC_HEDGING")
+    temp_settings["CUR_RPC_NODE_IDX"] = 0
+    temp_settings["MAX_RPC_TRY"] = 3
+
+    # snapshot blocks are cached once they are older than this
+    temp_settings["FINALITY_SECONDS"] = settings.get("FOLLOW", {}).get("FINALITY_SECONDS")
+
+    return temp_settings
+
+
+# A snapshot run and the follow mode (or two runs) don't write the same cache files at the same time
+@contextmanager
+def cache_lock(data_dir):
+    try:
+        import fcntl
+    except ImportError:
+        # no file locks on this platform
+        yield
+        return
+
+    with open(path.abspath(data_dir) + ".lock", "w") as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            print("* Waiting for another run that uses the cache files")
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def get_snapshot_filename(token_name, target_pools):
+    if target_pools == "stake":
+        return f"Raw_{token_name}_Stake_Snapshot.csv"
+    elif target_pools == "farm":
+        return f"Raw_{token_name}_Farm_Snapshot.csv"
+
+    return f"Raw_{token_name}_Snapshot.csv"
+
+
+# S3 key prefixes (relative to main_dir) of the cache files that a run needs
+def get_required_s3_prefixes(main_dir, data_dir, output_dir, project_id, target_tokens_list, all_tokens_dict, network_list, target_pools):
+    data_prefix = path.relpath(data_dir, main_dir).replace("\\", "/")
+    output_prefix = path.relpath(output_dir, main_dir).replace("\\", "/")
+
+    prefixes = []
+
+    for token_name in target_tokens_list:
+        if project_id is None:
+            for network in network_list:
+                if network not in all_tokens_dict[token_name].keys(): continue
+
+                prefixes.append(f"{data_prefix}/{token_name}_{network}/")
+
+            if token_name == "SFUND":
+                prefixes.append(f"{data_prefix}/KYC_")
+                prefixes.append(f"{data_prefix}/Raw_KYC_")
+
+        elif token_name == "SFUND":
+            prefixes.append(f"{output_prefix}/{get_snapshot_filename(token_name, target_pools)}")
+            prefixes.append(f"{data_prefix}/KYC_")
+            prefixes.append(f"{data_prefix}/Backend_")
+
+    return sorted(set(prefixes))
+
+
 def download_file_again(file_path, depreciation_period_in_hours):
 
     if file_path is None:
@@ -263,6 +367,14 @@ def load_json(file_path):
     with open(file_path, 'r') as json_file:
         return json.load(json_file)
 
+# Optional fallback for files that are missing locally (e.g. lazy S3 hydration)
+REMOTE_FILES = {
+    "FETCHER": None,
+}
+
+def set_remote_file_fetcher(fetcher):
+    REMOTE_FILES["FETCHER"] = fetcher
+
 def find_file(name):
     try:
         files = glob(str(name))
@@ -272,12 +384,20 @@ def find_file(name):
     except Exception as e:
         print(f"Error finding file: {e}")
 
+    fetcher = REMOTE_FILES["FETCHER"]
+
+    if fetcher is not None and not has_magic(str(name)):
+        if fetcher(path.abspath(str(name))):
+            return str(name)
+
     return None
 
 def finalize(network, token_name, CALCULATE_SSP, snapshot_list):
     if snapshot_list is None or len(snapshot_list) == 0:
         return None, None, None
-    
+
+    import pandas as pd
+
     result_df = pd.concat(snapshot_list, axis=1)
 
     result_df = result_df.fillna(Decimal("0"))
@@ -375,6 +495,11 @@ def parse_args(tokens_filename):
     parser.add_argument("-hm", "--hour", type=str, help="Sets target time for snapshot (in hh:mm format)")
     parser.add_argument("-p", "--pools", type=str, help="Sets target pool type for snapshot (values: stake, farm, all [default])")
     parser.add_argument("-id", "--project-id", type=str, help="Combines 'previously created snapshot' + 'registered wallets' + 'delegated wallets' to create project specific whitelist")
+    parser.add_argument("--profile", action="store_true", help="Saves a cProfile dump for each stage next to the run report")
+    parser.add_argument("--plan", action="store_true", help="Prints the work list, expected API calls and time estimate of the run without making any network calls")
+    parser.add_argument("--verify-cache", action="store_true", help="Reports the missing block ranges of the txn caches up to the snapshot block and fetches only those ranges")
+    parser.add_argument("--follow", action="store_true", help="Keeps running and refreshes the cache files (pool txns, LP history, snapshot blocks, KYC export) every few minutes, so the snapshot run has little left to fetch")
+    parser.add_argument("--wallet", type=str, help="Prints the balances of a wallet in every pool at the snapshot date (-d, -hm) from the snapshot store, nothing is fetched or recalculated")
 
     # Parse arguments
     args = parser.parse_args()
@@ -427,7 +552,16 @@ def parse_args(tokens_filename):
     if args.project_id:
         project_id = args.project_id
 
-    return project_id, all_tokens_dict, target_tokens_list, all_tokens_list, snapshot_datetime, target_pools
+    run_options = {
+        "PROFILE": args.profile,
+        "PLAN": args.plan,
+        "FOLLOW": args.follow,
+        "VERIFY_CACHE": args.verify_cache,
+        "WALLET": args.wallet,
+        "SNAPSHOT_TIME": preferred_time,
+    }
+
+    return project_id, all_tokens_dict, target_tokens_list, all_tokens_list, snapshot_datetime, target_pools, run_options
 
 def deleteFile(targetFile):
     try:
@@ -446,6 +580,8 @@ def csv_to_df(filename):
 
     if file is None: return None
 
+    import pandas as pd
+
     df = pd.read_csv(file)
     return df
 
@@ -459,7 +595,7 @@ def checkAddress(wallet_):
         return None
 
     try:
-        wallet_ = Web3.to_checksum_address(wallet_)
+        wallet_ = to_checksum_address(wallet_)
     except Exception:
         return None
 